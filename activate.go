@@ -3,48 +3,129 @@ package main
 import (
 	"context"
 	"fmt"
+	"strings"
+	"sync"
+
 	systemd "github.com/redhatinsights/rhc/internal/systemd"
+	"github.com/redhatinsights/rhc/internal/trace"
 )
 
-// activateService tries to enable and start the rhc-canonical-facts.timer,
-// rhc-canonical-facts.service and yggdrasil.service.
-func activateService() error {
-	conn, err := systemd.NewConnectionContext(context.Background(), systemd.ConnectionTypeSystem)
-	if err != nil {
-		return fmt.Errorf("cannot connect to systemd: %v", err)
-	}
-	defer conn.Close()
+// systemdConnHolder holds a connection to systemd shared by all systemd calls
+// of one rhc command. The connection is opened on first use.
+type systemdConnHolder struct {
+	mu   sync.Mutex
+	conn *systemd.Conn
+}
+
+// systemdConnKey is the key of the systemdConnHolder in the context of the
+// command.
+type systemdConnKey struct{}
+
+// withSystemdConn returns a copy of ctx holding a connection to systemd, which
+// is shared by all systemd calls using the returned context, or contexts
+// derived from it.
+func withSystemdConn(ctx context.Context) context.Context {
+	return context.WithValue(ctx, systemdConnKey{}, &systemdConnHolder{})
+}
 
-	if err := conn.EnableUnit("rhc-canonical-facts.timer", true, false); err != nil {
-		return fmt.Errorf("cannot enable rhc-canonical-facts.timer: %v", err)
+// getSystemdConn returns the connection to systemd held by ctx. The connection
+// is established, when it is called for the first time.
+func getSystemdConn(ctx context.Context) (*systemd.Conn, error) {
+	holder, ok := ctx.Value(systemdConnKey{}).(*systemdConnHolder)
+	if !ok {
+		return nil, fmt.Errorf("cannot connect to systemd: no connection in context")
+	}
+	holder.mu.Lock()
+	defer holder.mu.Unlock()
+	if holder.conn == nil {
+		err := trace.Run(ctx, "systemd connect", func(ctx context.Context) error {
+			// The connection outlives ctx, it is shared by all callers
+			conn, err := systemd.NewConnectionContext(context.Background(), systemd.ConnectionTypeSystem)
+			holder.conn = conn
+			return err
+		})
+		if err != nil {
+			return nil, fmt.Errorf("cannot connect to systemd: %v", err)
+		}
 	}
+	return holder.conn, nil
+}
 
-	// Start the canonical-facts service immediately, so the facts get generated
-	// and written out before yggdrasil.service starts.
-	if err := conn.StartUnit("rhc-canonical-facts.service", false); err != nil {
-		return fmt.Errorf("cannot start rhc-canonical-facts.service: %v", err)
+// closeSystemdConn closes the connection to systemd held by ctx, when it was
+// established.
+func closeSystemdConn(ctx context.Context) {
+	holder, ok := ctx.Value(systemdConnKey{}).(*systemdConnHolder)
+	if !ok {
+		return
+	}
+	holder.mu.Lock()
+	defer holder.mu.Unlock()
+	if holder.conn != nil {
+		holder.conn.Close()
+		holder.conn = nil
 	}
+}
+
+// systemdCall runs a call to systemd in a span named after the method and the
+// units.
+func systemdCall(ctx context.Context, name string, job func() error) error {
+	return trace.Run(ctx, "systemd "+name, func(ctx context.Context) error {
+		return job()
+	})
+}
+
+// activateUnitOps enable and start the rhc-canonical-facts.timer,
+// rhc-canonical-facts.service and yggdrasil.service. The canonical-facts
+// service is started immediately, so the facts get generated and written out
+// before yggdrasil.service starts.
+var activateUnitOps = []systemd.UnitOp{
+	{Unit: "rhc-canonical-facts.timer", Enable: true, Start: true, Wait: true},
+	{Unit: "rhc-canonical-facts.service", Start: true},
+	{Unit: "yggdrasil.service", Enable: true, Start: true, Wait: true, After: []string{"rhc-canonical-facts.service"}},
+}
+
+// deactivateUnitOps stop and disable the rhc-canonical-facts.timer and
+// yggdrasil.service.
+var deactivateUnitOps = []systemd.UnitOp{
+	{Unit: "rhc-canonical-facts.timer", Disable: true, Stop: true, Wait: true},
+	{Unit: "yggdrasil.service", Disable: true, Stop: true, Wait: true},
+}
 
-	if err := conn.EnableUnit("yggdrasil.service", true, false); err != nil {
-		return fmt.Errorf("cannot enable yggdrasil.service: %v", err)
+// applyUnitOps applies the operations on units in one transaction of systemd
+// calls. Changes are rolled back, when any of the operations fails.
+func applyUnitOps(ctx context.Context, ops []systemd.UnitOp) error {
+	conn, err := getSystemdConn(ctx)
+	if err != nil {
+		return err
 	}
 
-	if err := conn.Reload(); err != nil {
-		return fmt.Errorf("cannot reload systemd: %v", err)
+	units := make([]string, 0, len(ops))
+	for _, op := range ops {
+		units = append(units, op.Unit)
 	}
+	return systemdCall(ctx, "Apply "+strings.Join(units, " "), func() error {
+		return conn.Apply(ops)
+	})
+}
 
-	return nil
+// activateService tries to enable and start the rhc-canonical-facts.timer,
+// rhc-canonical-facts.service and yggdrasil.service.
+func activateService(ctx context.Context) error {
+	return applyUnitOps(ctx, activateUnitOps)
 }
 
 // isServiceInState returns true, when yggdrasil.service is in given state
-func isServiceInState(wantedState string) (bool, error) {
-	conn, err := systemd.NewConnectionContext(context.Background(), systemd.ConnectionTypeSystem)
+func isServiceInState(ctx context.Context, wantedState string) (bool, error) {
+	conn, err := getSystemdConn(ctx)
 	if err != nil {
-		return false, fmt.Errorf("cannot connect to systemd: %v", err)
+		return false, err
 	}
-	defer conn.Close()
 
-	state, err := conn.GetUnitState("yggdrasil.service")
+	var state string
+	err = systemdCall(ctx, "GetUnitState yggdrasil.service", func() (err error) {
+		state, err = conn.GetUnitStateContext(ctx, "yggdrasil.service")
+		return err
+	})
 	if err != nil {
 		return false, fmt.Errorf("cannot get unit state: %v", err)
 	}
@@ -57,24 +138,6 @@ func isServiceInState(wantedState string) (bool, error) {
 
 // deactivateService tries to stop and disable the rhc-canonical-facts.timer,
 // rhc-canonical-facts.service and yggdrasil.service.
-func deactivateService() error {
-	conn, err := systemd.NewConnectionContext(context.Background(), systemd.ConnectionTypeSystem)
-	if err != nil {
-		return fmt.Errorf("cannot connect to systemd: %v", err)
-	}
-	defer conn.Close()
-
-	if err := conn.DisableUnit("rhc-canonical-facts.timer", true, false); err != nil {
-		return fmt.Errorf("cannot disable rhc-canonical-facts.timer: %v", err)
-	}
-
-	if err := conn.DisableUnit("yggdrasil.service", true, false); err != nil {
-		return fmt.Errorf("cannot disable yggdrasil.service: %v", err)
-	}
-
-	if err := conn.Reload(); err != nil {
-		return fmt.Errorf("cannot reload systemd: %v", err)
-	}
-
-	return nil
+func deactivateService(ctx context.Context) error {
+	return applyUnitOps(ctx, deactivateUnitOps)
 }
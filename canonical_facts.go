@@ -1,16 +1,22 @@
 package main
 
 import (
+	"context"
 	"crypto/x509"
 	"encoding/pem"
 	"fmt"
 	"net"
 	"os"
 	"path/filepath"
+	"reflect"
 	"sort"
 	"strings"
+	"sync"
+	"syscall"
+	"unsafe"
 
 	"github.com/google/uuid"
+	"github.com/redhatinsights/rhc/internal/trace"
 )
 
 // An InvalidValueTypeError represents an error when serializing data into an
@@ -36,129 +42,260 @@ type CanonicalFacts struct {
 	FQDN                  string   `json:"fqdn"`
 }
 
-// CanonicalFactsFromMap creates a CanonicalFacts struct from the key-value
-// pairs in a map.
-func CanonicalFactsFromMap(m map[string]interface{}) (*CanonicalFacts, error) {
-	var facts CanonicalFacts
+// canonicalFactsField describes how a value from a map is decoded into a field
+// of CanonicalFacts.
+type canonicalFactsField struct {
+	// key is the map key of the field, taken from its json struct tag.
+	key string
+	// index is the index of the field in CanonicalFacts.
+	index int
+	// list is true for []string fields and false for string fields.
+	list bool
+}
 
-	if val, ok := m["insights_id"]; ok {
-		switch val := val.(type) {
-		case string:
-			facts.InsightsID = val
-		default:
-			return nil, &InvalidValueTypeError{key: "insights_id", val: val}
-		}
-	}
+// canonicalFactsFields is the decoding table of CanonicalFacts. It is computed
+// once from the struct tags, so adding a field to CanonicalFacts does not
+// require changes of the decoder.
+var canonicalFactsFields = newCanonicalFactsFields()
 
-	if val, ok := m["machine_id"]; ok {
-		switch val := val.(type) {
-		case string:
-			facts.MachineID = val
-		default:
-			return nil, &InvalidValueTypeError{key: "machine_id", val: val}
+// newCanonicalFactsFields computes the decoding table of CanonicalFacts. It
+// panics when a field has a type, which the decoder does not support.
+func newCanonicalFactsFields() []canonicalFactsField {
+	t := reflect.TypeOf(CanonicalFacts{})
+	fields := make([]canonicalFactsField, 0, t.NumField())
+	for i := 0; i < t.NumField(); i++ {
+		field := t.Field(i)
+		key := strings.Split(field.Tag.Get("json"), ",")[0]
+		if key == "" || key == "-" {
+			continue
 		}
-	}
-
-	if val, ok := m["bios_uuid"]; ok {
-		switch val := val.(type) {
-		case string:
-			facts.BIOSUUID = val
+		var list bool
+		switch field.Type {
+		case reflect.TypeOf(""):
+		case reflect.TypeOf([]string(nil)):
+			list = true
 		default:
-			return nil, &InvalidValueTypeError{key: "bios_uuid", val: val}
+			panic(fmt.Sprintf("unsupported type %v of canonical facts field %v", field.Type, field.Name))
 		}
+		fields = append(fields, canonicalFactsField{key: key, index: i, list: list})
 	}
+	return fields
+}
 
-	if val, ok := m["subscription_manager_id"]; ok {
-		switch val := val.(type) {
-		case string:
-			facts.SubscriptionManagerID = val
-		default:
-			return nil, &InvalidValueTypeError{key: "subscription_manager_id", val: val}
-		}
+// CanonicalFactsFromMap creates a CanonicalFacts struct from the key-value
+// pairs in a map. Lists of addresses can be given either as []string or as
+// []interface{} holding strings, as produced by encoding/json.
+func CanonicalFactsFromMap(m map[string]interface{}) (*CanonicalFacts, error) {
+	var facts CanonicalFacts
+
+	if err := decodeCanonicalFacts(m, &facts); err != nil {
+		return nil, err
 	}
 
-	if val, ok := m["ip_addresses"]; ok {
-		switch val := val.(type) {
-		case []string:
-			facts.IPAddresses = val
-		default:
-			return nil, &InvalidValueTypeError{key: "ip_addresses", val: val}
+	return &facts, nil
+}
+
+// CanonicalFactsFromMaps decodes a list of maps like CanonicalFactsFromMap.
+// The facts are stored into dst, which is reused when it has enough capacity,
+// and the resulting slice is returned. Decoding stops at the first invalid map.
+func CanonicalFactsFromMaps(maps []map[string]interface{}, dst []CanonicalFacts) ([]CanonicalFacts, error) {
+	if cap(dst) < len(maps) {
+		dst = make([]CanonicalFacts, len(maps))
+	}
+	dst = dst[:len(maps)]
+	for i, m := range maps {
+		dst[i] = CanonicalFacts{}
+		if err := decodeCanonicalFacts(m, &dst[i]); err != nil {
+			return nil, fmt.Errorf("cannot decode canonical facts #%d: %w", i, err)
 		}
 	}
+	return dst, nil
+}
 
-	if val, ok := m["fqdn"]; ok {
-		switch val := val.(type) {
-		case string:
-			facts.FQDN = val
-		default:
-			return nil, &InvalidValueTypeError{key: "fqdn", val: val}
+// decodeCanonicalFacts stores the values from the map to the fields of facts
+// according to canonicalFactsFields. Fields missing in the map are left
+// unchanged.
+func decodeCanonicalFacts(m map[string]interface{}, facts *CanonicalFacts) error {
+	value := reflect.ValueOf(facts).Elem()
+	for _, field := range canonicalFactsFields {
+		val, ok := m[field.key]
+		if !ok {
+			continue
+		}
+		if field.list {
+			list, ok := toStringList(val)
+			if !ok {
+				return &InvalidValueTypeError{key: field.key, val: val}
+			}
+			value.Field(field.index).Set(reflect.ValueOf(list))
+		} else {
+			str, ok := val.(string)
+			if !ok {
+				return &InvalidValueTypeError{key: field.key, val: val}
+			}
+			value.Field(field.index).SetString(str)
 		}
 	}
+	return nil
+}
 
-	if val, ok := m["mac_addresses"]; ok {
-		switch val := val.(type) {
-		case []string:
-			facts.MACAddresses = val
-		default:
-			return nil, &InvalidValueTypeError{key: "mac_addresses", val: val}
+// toStringList converts a []string or a []interface{} holding only strings to
+// []string. It returns false for any other value.
+func toStringList(val interface{}) ([]string, bool) {
+	switch val := val.(type) {
+	case []string:
+		return val, true
+	case []interface{}:
+		list := make([]string, len(val))
+		for i, item := range val {
+			str, ok := item.(string)
+			if !ok {
+				return nil, false
+			}
+			list[i] = str
 		}
+		return list, true
+	default:
+		return nil, false
 	}
+}
 
-	return &facts, nil
+// canonicalFactsCollector collects a group of canonical facts from one source.
+type canonicalFactsCollector struct {
+	// source identifies the source of the facts.
+	source string
+	// collect stores the facts from the source to the CanonicalFacts struct.
+	collect func(facts *CanonicalFacts) error
+}
+
+// Sources of canonical facts.
+const (
+	factsSourceInsightsID            = "insights_id"
+	factsSourceMachineID             = "machine_id"
+	factsSourceBIOSUUID              = "bios_uuid"
+	factsSourceSubscriptionManagerID = "subscription_manager_id"
+	factsSourceNetwork               = "network"
+	factsSourceFQDN                  = "fqdn"
+)
+
+// canonicalFactsCollectors is the list of all collectors of canonical facts.
+// Every collector sets different fields, so they can be run concurrently.
+var canonicalFactsCollectors = []canonicalFactsCollector{
+	{
+		source: factsSourceInsightsID,
+		collect: func(facts *CanonicalFacts) error {
+			facts.InsightsID = ""
+			if _, err := os.Stat("/etc/insights-client/machine-id"); !os.IsNotExist(err) {
+				insightsID, err := readFile("/etc/insights-client/machine-id")
+				if err != nil {
+					return err
+				}
+				facts.InsightsID = insightsID
+			}
+			return nil
+		},
+	},
+	{
+		source: factsSourceMachineID,
+		collect: func(facts *CanonicalFacts) error {
+			machineID, err := readFile("/etc/machine-id")
+			if err != nil {
+				return err
+			}
+			facts.MachineID, err = toUUIDv4(machineID)
+			return err
+		},
+	},
+	{
+		source: factsSourceBIOSUUID,
+		collect: func(facts *CanonicalFacts) error {
+			facts.BIOSUUID = ""
+			if _, err := os.Stat("/sys/devices/virtual/dmi/id/product_uuid"); !os.IsNotExist(err) {
+				BIOSUUID, err := readFile("/sys/devices/virtual/dmi/id/product_uuid")
+				if err != nil {
+					return err
+				}
+				facts.BIOSUUID = BIOSUUID
+			}
+			return nil
+		},
+	},
+	{
+		source: factsSourceSubscriptionManagerID,
+		collect: func(facts *CanonicalFacts) error {
+			var err error
+			facts.SubscriptionManagerID, err = readCert("/etc/pki/consumer/cert.pem")
+			return err
+		},
+	},
+	{
+		source: factsSourceNetwork,
+		collect: func(facts *CanonicalFacts) error {
+			var err error
+			facts.IPAddresses, facts.MACAddresses, err = collectNetworkFacts()
+			return err
+		},
+	},
+	{
+		source: factsSourceFQDN,
+		collect: func(facts *CanonicalFacts) error {
+			var err error
+			facts.FQDN, err = os.Hostname()
+			return err
+		},
+	},
 }
 
 // GetCanonicalFacts attempts to construct a CanonicalFacts struct by collecting
-// data from the localhost.
-func GetCanonicalFacts() (*CanonicalFacts, error) {
+// data from the localhost. Independent sources of facts are read concurrently.
+func GetCanonicalFacts(ctx context.Context) (*CanonicalFacts, error) {
 	var facts CanonicalFacts
-	var err error
-
-	if _, err := os.Stat("/etc/insights-client/machine-id"); !os.IsNotExist(err) {
-		insightsID, err := readFile("/etc/insights-client/machine-id")
-		if err != nil {
-			return nil, err
-		}
-		facts.InsightsID = insightsID
-	}
 
-	machineID, err := readFile("/etc/machine-id")
-	if err != nil {
-		return nil, err
-	}
-	facts.MachineID, err = toUUIDv4(machineID)
-	if err != nil {
+	if err := collectCanonicalFacts(ctx, &facts, nil); err != nil {
 		return nil, err
 	}
 
-	if _, err := os.Stat("/sys/devices/virtual/dmi/id/product_uuid"); !os.IsNotExist(err) {
-		BIOSUUID, err := readFile("/sys/devices/virtual/dmi/id/product_uuid")
-		if err != nil {
-			return nil, err
-		}
-		facts.BIOSUUID = BIOSUUID
-	}
-
-	facts.SubscriptionManagerID, err = readCert("/etc/pki/consumer/cert.pem")
-	if err != nil {
-		return nil, err
-	}
+	return &facts, nil
+}
 
-	facts.IPAddresses, err = collectIPAddresses()
-	if err != nil {
-		return nil, err
+// collectCanonicalFacts runs the collectors of the given sources concurrently
+// and stores the facts in the CanonicalFacts struct. When sources is nil, all
+// collectors are run. Every collector runs in its own span.
+func collectCanonicalFacts(ctx context.Context, facts *CanonicalFacts, sources map[string]bool) error {
+	var funcs []func() error
+	for _, collector := range canonicalFactsCollectors {
+		if sources != nil && !sources[collector.source] {
+			continue
+		}
+		collector := collector
+		funcs = append(funcs, func() error {
+			return trace.Run(ctx, "facts "+collector.source, func(ctx context.Context) error {
+				return collector.collect(facts)
+			})
+		})
 	}
+	return runConcurrently(funcs...)
+}
 
-	facts.FQDN, err = os.Hostname()
-	if err != nil {
-		return nil, err
+// runConcurrently calls all functions at once, and waits until all of them
+// return. The first non-nil error in the order of the functions is returned.
+func runConcurrently(funcs ...func() error) error {
+	errs := make([]error, len(funcs))
+	var wg sync.WaitGroup
+	for i, f := range funcs {
+		wg.Add(1)
+		go func(i int, f func() error) {
+			defer wg.Done()
+			errs[i] = f()
+		}(i, f)
 	}
-
-	facts.MACAddresses, err = collectMACAddresses()
-	if err != nil {
-		return nil, err
+	wg.Wait()
+	for _, err := range errs {
+		if err != nil {
+			return err
+		}
 	}
-
-	return &facts, nil
+	return nil
 }
 
 // readFile reads the contents of filename into a string, trims whitespace,
@@ -202,56 +339,186 @@ func readCert(filename string) (string, error) {
 	return cert.Subject.CommonName, nil
 }
 
-// collectIPAddresses iterates over network interfaces and collects IP
-// addresses.
-func collectIPAddresses() ([]string, error) {
-	addresses := make([]string, 0)
-	ifaces, err := net.Interfaces()
+// netlinkRIB returns a dump of the kernel routing information base. It is
+// a variable, so it can be replaced in tests.
+var netlinkRIB = syscall.NetlinkRIB
+
+// ARP hardware types of IP tunnels. Hardware address of such interfaces is an
+// IP address, so it is ignored the same way as net.Interfaces does.
+const (
+	arpHardwareIPv4IPv4 = 768
+	arpHardwareIPv6IPv6 = 769
+	arpHardwareIPv6IPv4 = 776
+	arpHardwareGREIPv4  = 778
+	arpHardwareGREIPv6  = 823
+)
+
+// netLink is a network interface as reported by the RTM_GETLINK dump.
+type netLink struct {
+	index        int32
+	name         string
+	loopback     bool
+	hardwareAddr net.HardwareAddr
+}
+
+// collectNetworkFacts collects IPv4 addresses of all network interfaces except
+// loopback, and hardware addresses of all network interfaces sorted by their
+// names. Interfaces and their addresses are read using one netlink dump each,
+// regardless of the number of interfaces.
+func collectNetworkFacts() ([]string, []string, error) {
+	rib, err := netlinkRIB(syscall.RTM_GETLINK, syscall.AF_UNSPEC)
 	if err != nil {
-		return nil, err
+		return nil, nil, os.NewSyscallError("netlinkrib", err)
+	}
+	links, err := parseLinks(rib)
+	if err != nil {
+		return nil, nil, err
+	}
+
+	rib, err = netlinkRIB(syscall.RTM_GETADDR, syscall.AF_INET)
+	if err != nil {
+		return nil, nil, os.NewSyscallError("netlinkrib", err)
+	}
+	addrs, err := parseIPv4Addresses(rib)
+	if err != nil {
+		return nil, nil, err
+	}
+
+	ipAddresses := make([]string, 0)
+	for _, link := range links {
+		if link.loopback {
+			continue
+		}
+		ipAddresses = append(ipAddresses, addrs[link.index]...)
+	}
+
+	sort.Slice(links, func(i, j int) bool {
+		return links[i].name < links[j].name
+	})
+	macAddresses := make([]string, 0, len(links))
+	for _, link := range links {
+		addr := link.hardwareAddr.String()
+		if addr == "" {
+			addr = "00:00:00:00:00:00"
+		}
+		macAddresses = append(macAddresses, addr)
 	}
-	for _, iface := range ifaces {
-		if iface.Flags&net.FlagLoopback == net.FlagLoopback {
+
+	return ipAddresses, macAddresses, nil
+}
+
+// parseLinks parses the network interfaces from the RTM_GETLINK dump.
+func parseLinks(rib []byte) ([]netLink, error) {
+	msgs, err := syscall.ParseNetlinkMessage(rib)
+	if err != nil {
+		return nil, os.NewSyscallError("parsenetlinkmessage", err)
+	}
+	var links []netLink
+	for i := range msgs {
+		m := &msgs[i]
+		if m.Header.Type == syscall.NLMSG_DONE {
+			break
+		}
+		if m.Header.Type != syscall.RTM_NEWLINK || len(m.Data) < syscall.SizeofIfInfomsg {
 			continue
 		}
-		addrs, err := iface.Addrs()
+		ifim := (*syscall.IfInfomsg)(unsafe.Pointer(&m.Data[0]))
+		attrs, err := syscall.ParseNetlinkRouteAttr(m)
 		if err != nil {
-			return nil, err
+			return nil, os.NewSyscallError("parsenetlinkrouteattr", err)
 		}
-		for _, addr := range addrs {
-			switch addr := addr.(type) {
-			case *net.IPNet:
-				netAddr := addr
-				if netAddr.IP.To4() == nil {
+		link := netLink{
+			index:    ifim.Index,
+			loopback: ifim.Flags&syscall.IFF_LOOPBACK != 0,
+		}
+		for _, a := range attrs {
+			switch a.Attr.Type {
+			case syscall.IFLA_IFNAME:
+				link.name = strings.TrimRight(string(a.Value), "\x00")
+			case syscall.IFLA_ADDRESS:
+				if isTunnelAddress(ifim.Type, a.Value) || isZero(a.Value) {
 					continue
 				}
-				addresses = append(addresses, netAddr.IP.String())
+				link.hardwareAddr = append(net.HardwareAddr(nil), a.Value...)
 			}
 		}
+		links = append(links, link)
 	}
-
-	return addresses, nil
+	return links, nil
 }
 
-// collectMACAddresses iterates over network interfaces and collects hardware
-// addresses.
-func collectMACAddresses() ([]string, error) {
-	addresses := make([]string, 0)
-	ifaces, err := net.Interfaces()
+// parseIPv4Addresses parses IPv4 addresses from the RTM_GETADDR dump. The
+// addresses are grouped by index of the interface.
+func parseIPv4Addresses(rib []byte) (map[int32][]string, error) {
+	msgs, err := syscall.ParseNetlinkMessage(rib)
 	if err != nil {
-		return nil, err
+		return nil, os.NewSyscallError("parsenetlinkmessage", err)
 	}
-	sort.Slice(ifaces, func(i, j int) bool {
-		return ifaces[i].Name < ifaces[j].Name
-	})
-	for _, iface := range ifaces {
-		addr := iface.HardwareAddr.String()
-		if addr == "" {
-			addr = "00:00:00:00:00:00"
+	addrs := make(map[int32][]string)
+	for i := range msgs {
+		m := &msgs[i]
+		if m.Header.Type == syscall.NLMSG_DONE {
+			break
+		}
+		if m.Header.Type != syscall.RTM_NEWADDR || len(m.Data) < syscall.SizeofIfAddrmsg {
+			continue
+		}
+		ifam := (*syscall.IfAddrmsg)(unsafe.Pointer(&m.Data[0]))
+		if ifam.Family != syscall.AF_INET {
+			continue
+		}
+		attrs, err := syscall.ParseNetlinkRouteAttr(m)
+		if err != nil {
+			return nil, os.NewSyscallError("parsenetlinkrouteattr", err)
+		}
+		// IFA_LOCAL is the address of the interface on point-to-point links,
+		// where IFA_ADDRESS is the address of the other end.
+		var addr []byte
+		for _, a := range attrs {
+			switch a.Attr.Type {
+			case syscall.IFA_LOCAL:
+				addr = a.Value
+			case syscall.IFA_ADDRESS:
+				if addr == nil {
+					addr = a.Value
+				}
+			}
+		}
+		if len(addr) != net.IPv4len {
+			continue
+		}
+		index := int32(ifam.Index)
+		addrs[index] = append(addrs[index], net.IP(addr).String())
+	}
+	return addrs, nil
+}
+
+// isTunnelAddress returns true, when addr is an IP address used as hardware
+// address of an IP tunnel interface.
+func isTunnelAddress(hardwareType uint16, addr []byte) bool {
+	switch len(addr) {
+	case net.IPv4len:
+		switch hardwareType {
+		case arpHardwareIPv4IPv4, arpHardwareGREIPv4, arpHardwareIPv6IPv4:
+			return true
+		}
+	case net.IPv6len:
+		switch hardwareType {
+		case arpHardwareIPv6IPv6, arpHardwareGREIPv6:
+			return true
+		}
+	}
+	return false
+}
+
+// isZero returns true, when all bytes are zero.
+func isZero(b []byte) bool {
+	for _, v := range b {
+		if v != 0 {
+			return false
 		}
-		addresses = append(addresses, addr)
 	}
-	return addresses, nil
+	return true
 }
 
 // toUUIDv4 parses id as a UUID and returns the "dashed" notation string format.
@@ -1,23 +1,149 @@
 package main
 
 import (
+	"bytes"
+	"context"
 	"encoding/json"
 	"fmt"
+	"os"
+	"os/signal"
+	"syscall"
+
+	"github.com/redhatinsights/rhc/internal/trace"
+	"github.com/subpop/go-log"
 	"github.com/urfave/cli/v2"
 )
 
+// ExitCodeFactsUnchanged is the exit code of the canonical-facts command, when
+// the file given by --output already contains the current facts.
+const ExitCodeFactsUnchanged = 2
+
 // canonicalFactAction tries to gather canonical facts about system,
-// and it prints JSON with facts to stdout.
-func canonicalFactAction(_ *cli.Context) error {
-	// NOTE: CLI context is not useful for anything
-	facts, err := GetCanonicalFacts()
-	if err != nil {
-		return cli.Exit(err, 1)
+// and it prints JSON with facts to stdout. When --output is used, the JSON
+// is written to the file instead, but only when it differs from the file
+// content. An unchanged file is reported by ExitCodeFactsUnchanged. When
+// --watch is used, the facts are written again whenever they change. The facts
+// kept by the daemon are printed, when it is running. They are not used for
+// --output, the file is written by rhc-canonical-facts.service right after
+// the registration changed, before the daemon could notice it.
+func canonicalFactAction(ctx *cli.Context) error {
+	if ctx.Bool("watch") {
+		return watchCanonicalFactsAction(ctx)
+	}
+
+	spanCtx, endTrace := startCommandTrace(ctx)
+	defer endTrace()
+
+	output := ctx.String("output")
+	var facts *CanonicalFacts
+	if output == "" {
+		facts = daemonCanonicalFacts(spanCtx)
+	}
+	if facts == nil {
+		var err error
+		facts, err = GetCanonicalFacts(spanCtx)
+		if err != nil {
+			return cli.Exit(err, 1)
+		}
 	}
 	data, err := json.MarshalIndent(facts, "", "   ")
 	if err != nil {
 		return err
 	}
-	fmt.Println(string(data))
+	data = append(data, '\n')
+
+	if output == "" {
+		fmt.Print(string(data))
+		return nil
+	}
+
+	var changed bool
+	err = trace.Run(spanCtx, "write "+output, func(ctx context.Context) (err error) {
+		changed, err = writeFileIfChanged(output, data)
+		return err
+	})
+	if err != nil {
+		return cli.Exit(fmt.Errorf("cannot write canonical facts: %v", err), 1)
+	}
+	if !changed {
+		log.Debugf("canonical facts in %v are up to date", output)
+		return cli.Exit("", ExitCodeFactsUnchanged)
+	}
+	return nil
+}
+
+// watchCanonicalFactsAction keeps running until it is terminated and writes
+// canonical facts every time any of them changes. Changes of network links and
+// addresses, hostname and files containing facts are watched, and only the
+// facts depending on the changed source are collected again.
+func watchCanonicalFactsAction(ctx *cli.Context) error {
+	output := ctx.String("output")
+	emit := func(facts *CanonicalFacts) {
+		// The facts written before are kept, when collecting fails.
+		if facts == nil {
+			return
+		}
+		data, err := json.MarshalIndent(facts, "", "   ")
+		if err != nil {
+			log.Errorf("cannot marshal canonical facts: %v", err)
+			return
+		}
+		data = append(data, '\n')
+		if output == "" {
+			fmt.Print(string(data))
+			return
+		}
+		changed, err := writeFileIfChanged(output, data)
+		if err != nil {
+			log.Errorf("cannot write canonical facts: %v", err)
+			return
+		}
+		if changed {
+			log.Infof("canonical facts written to %v", output)
+		}
+	}
+
+	events := make(chan string, 64)
+	if err := watchFactsSources(events); err != nil {
+		return cli.Exit(err, 1)
+	}
+
+	signals := make(chan os.Signal, 1)
+	signal.Notify(signals, syscall.SIGINT, syscall.SIGTERM)
+	stop := make(chan struct{})
+	go func() {
+		<-signals
+		close(stop)
+	}()
+
+	runFactsWatch(events, factsWatchDebounce, stop, emit)
+	return nil
+}
+
+// watchFactsSources starts watching network links and addresses, hostname and
+// files containing facts. The names of changed sources are sent to events.
+func watchFactsSources(events chan<- string) error {
+	if err := watchNetworkChanges(events); err != nil {
+		return err
+	}
+	if err := watchFiles(factsWatchedFiles, events); err != nil {
+		return err
+	}
+	if err := watchHostname(events); err != nil {
+		log.Warnf("cannot watch hostname: %v", err)
+	}
 	return nil
 }
+
+// writeFileIfChanged replaces content of filename with data, when they differ.
+// It returns true, when the file was written.
+func writeFileIfChanged(filename string, data []byte) (bool, error) {
+	current, err := os.ReadFile(filename)
+	if err == nil && bytes.Equal(current, data) {
+		return false, nil
+	}
+	if err := writeFileAtomically(filename, data, 0640); err != nil {
+		return false, err
+	}
+	return true, nil
+}
@@ -2,7 +2,14 @@ package main
 
 import (
 	"encoding/json"
+	"errors"
+	"fmt"
+	"os"
+	"path/filepath"
+	"sort"
+	"syscall"
 	"testing"
+	"unsafe"
 
 	"github.com/google/go-cmp/cmp"
 )
@@ -68,6 +75,26 @@ func TestCanonicalFactsFromMap(t *testing.T) {
 				MACAddresses:          []string{"CC:D1:7A:44:6D:1B", "A7:03:90:D0:05:A7"},
 			},
 		},
+		{
+			description: "valid with JSON-decoded address lists",
+			input: map[string]interface{}{
+				"machine_id":    "acc046d0-0add-4550-ac7c-5a833b1b6470",
+				"ip_addresses":  []interface{}{"1.2.3.4", "5.6.7.8"},
+				"mac_addresses": []interface{}{},
+			},
+			want: &CanonicalFacts{
+				MachineID:    "acc046d0-0add-4550-ac7c-5a833b1b6470",
+				IPAddresses:  []string{"1.2.3.4", "5.6.7.8"},
+				MACAddresses: []string{},
+			},
+		},
+		{
+			description: "invalid address in list",
+			input: map[string]interface{}{
+				"ip_addresses": []interface{}{"1.2.3.4", 5},
+			},
+			wantError: &InvalidValueTypeError{key: "ip_addresses", val: []interface{}{"1.2.3.4", 5}},
+		},
 	}
 
 	for _, test := range tests {
@@ -137,20 +164,253 @@ func TestCanonicalFactsUnmarshalJSON(t *testing.T) {
 	}
 }
 
+func TestCanonicalFactsFromMaps(t *testing.T) {
+	maps := []map[string]interface{}{
+		{"machine_id": "acc046d0-0add-4550-ac7c-5a833b1b6470", "fqdn": "foo.bar.com"},
+		{"ip_addresses": []interface{}{"1.2.3.4"}},
+	}
+	dst := []CanonicalFacts{{FQDN: "stale"}, {FQDN: "stale"}, {FQDN: "stale"}}
+
+	got, err := CanonicalFactsFromMaps(maps, dst)
+	if err != nil {
+		t.Fatal(err)
+	}
+	want := []CanonicalFacts{
+		{MachineID: "acc046d0-0add-4550-ac7c-5a833b1b6470", FQDN: "foo.bar.com"},
+		{IPAddresses: []string{"1.2.3.4"}},
+	}
+	if !cmp.Equal(got, want) {
+		t.Errorf("%v", cmp.Diff(got, want))
+	}
+	if &got[0] != &dst[0] {
+		t.Error("destination slice was not reused")
+	}
+
+	maps = append(maps, map[string]interface{}{"fqdn": 1})
+	_, err = CanonicalFactsFromMaps(maps, dst)
+	wantError := &InvalidValueTypeError{key: "fqdn", val: 1}
+	var gotError *InvalidValueTypeError
+	if !errors.As(err, &gotError) || !cmp.Equal(gotError, wantError, cmp.AllowUnexported(InvalidValueTypeError{})) {
+		t.Errorf("%v != %v", err, wantError)
+	}
+}
+
 func BenchmarkCanonicalFactsFromMap(b *testing.B) {
-	input := map[string]interface{}{
-		"insights_id":             "bb69cd34-263f-444c-9278-5935b61d7f60",
-		"machine_id":              "acc046d0-0add-4550-ac7c-5a833b1b6470",
-		"bios_uuid":               "d8ec3cd5-a6bc-4742-bd2f-32940da182b0",
-		"subscription_manager_id": "bc452b83-c4ee-4b80-91d8-98ff816b2440",
-		"ip_addresses":            []string{"1.2.3.4", "5.6.7.8"},
-		"fqdn":                    "foo.bar.com",
-		"mac_addresses":           []string{"CC:D1:7A:44:6D:1B", "A7:03:90:D0:05:A7"},
+	inputs := map[string]map[string]interface{}{
+		"string lists": {
+			"insights_id":             "bb69cd34-263f-444c-9278-5935b61d7f60",
+			"machine_id":              "acc046d0-0add-4550-ac7c-5a833b1b6470",
+			"bios_uuid":               "d8ec3cd5-a6bc-4742-bd2f-32940da182b0",
+			"subscription_manager_id": "bc452b83-c4ee-4b80-91d8-98ff816b2440",
+			"ip_addresses":            []string{"1.2.3.4", "5.6.7.8"},
+			"fqdn":                    "foo.bar.com",
+			"mac_addresses":           []string{"CC:D1:7A:44:6D:1B", "A7:03:90:D0:05:A7"},
+		},
+		"JSON-decoded lists": {
+			"insights_id":             "bb69cd34-263f-444c-9278-5935b61d7f60",
+			"machine_id":              "acc046d0-0add-4550-ac7c-5a833b1b6470",
+			"bios_uuid":               "d8ec3cd5-a6bc-4742-bd2f-32940da182b0",
+			"subscription_manager_id": "bc452b83-c4ee-4b80-91d8-98ff816b2440",
+			"ip_addresses":            []interface{}{"1.2.3.4", "5.6.7.8"},
+			"fqdn":                    "foo.bar.com",
+			"mac_addresses":           []interface{}{"CC:D1:7A:44:6D:1B", "A7:03:90:D0:05:A7"},
+		},
 	}
+	for name, input := range inputs {
+		b.Run(name, func(b *testing.B) {
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				_, err := CanonicalFactsFromMap(input)
+				if err != nil {
+					b.Error(err)
+				}
+			}
+		})
+	}
+}
+
+func BenchmarkCanonicalFactsFromMaps(b *testing.B) {
+	maps := make([]map[string]interface{}, 100000)
+	for i := range maps {
+		maps[i] = map[string]interface{}{
+			"insights_id":             "bb69cd34-263f-444c-9278-5935b61d7f60",
+			"machine_id":              "acc046d0-0add-4550-ac7c-5a833b1b6470",
+			"bios_uuid":               "d8ec3cd5-a6bc-4742-bd2f-32940da182b0",
+			"subscription_manager_id": "bc452b83-c4ee-4b80-91d8-98ff816b2440",
+			"ip_addresses":            []string{fmt.Sprintf("10.0.%d.%d", i/256%256, i%256)},
+			"fqdn":                    fmt.Sprintf("host%d.example.com", i),
+			"mac_addresses":           []string{"CC:D1:7A:44:6D:1B"},
+		}
+	}
+	var dst []CanonicalFacts
+	b.ReportAllocs()
+	b.ResetTimer()
 	for i := 0; i < b.N; i++ {
-		_, err := CanonicalFactsFromMap(input)
+		var err error
+		dst, err = CanonicalFactsFromMaps(maps, dst)
 		if err != nil {
-			b.Error(err)
+			b.Fatal(err)
 		}
 	}
 }
+
+func TestWriteFileIfChanged(t *testing.T) {
+	filename := filepath.Join(t.TempDir(), "canonical-facts.json")
+
+	tests := []struct {
+		description string
+		input       []byte
+		want        bool
+	}{
+		{
+			description: "new file",
+			input:       []byte(`{"fqdn":"foo.bar.com"}`),
+			want:        true,
+		},
+		{
+			description: "same content",
+			input:       []byte(`{"fqdn":"foo.bar.com"}`),
+			want:        false,
+		},
+		{
+			description: "changed content",
+			input:       []byte(`{"fqdn":"bar.foo.com"}`),
+			want:        true,
+		},
+	}
+
+	for _, test := range tests {
+		t.Run(test.description, func(t *testing.T) {
+			got, err := writeFileIfChanged(filename, test.input)
+			if err != nil {
+				t.Fatal(err)
+			}
+			if got != test.want {
+				t.Errorf("%v != %v", got, test.want)
+			}
+			data, err := os.ReadFile(filename)
+			if err != nil {
+				t.Fatal(err)
+			}
+			if !cmp.Equal(data, test.input) {
+				t.Errorf("%s != %s", data, test.input)
+			}
+		})
+	}
+}
+
+// netlinkMessage encodes a netlink message with the given header, fixed-size
+// payload and route attributes using native byte order.
+func netlinkMessage(msgType uint16, payload []byte, attrs map[uint16][]byte) []byte {
+	align := func(n int) int { return (n + syscall.NLMSG_ALIGNTO - 1) & ^(syscall.NLMSG_ALIGNTO - 1) }
+
+	// Attribute types are sorted to produce stable output
+	var types []int
+	for attrType := range attrs {
+		types = append(types, int(attrType))
+	}
+	sort.Ints(types)
+
+	body := append([]byte{}, payload...)
+	for _, attrType := range types {
+		value := attrs[uint16(attrType)]
+		attr := syscall.RtAttr{Len: uint16(syscall.SizeofRtAttr + len(value)), Type: uint16(attrType)}
+		data := make([]byte, align(int(attr.Len)))
+		copy(data, (*[syscall.SizeofRtAttr]byte)(unsafe.Pointer(&attr))[:])
+		copy(data[syscall.SizeofRtAttr:], value)
+		body = append(body, data...)
+	}
+
+	header := syscall.NlMsghdr{Len: uint32(syscall.SizeofNlMsghdr + len(body)), Type: msgType}
+	msg := make([]byte, align(int(header.Len)))
+	copy(msg, (*[syscall.SizeofNlMsghdr]byte)(unsafe.Pointer(&header))[:])
+	copy(msg[syscall.SizeofNlMsghdr:], body)
+	return msg
+}
+
+// fakeNetlinkRIB returns a function replacing netlinkRIB, which reports a
+// loopback interface and count of ethernet interfaces with one IPv4 address
+// each.
+func fakeNetlinkRIB(count int) func(int, int) ([]byte, error) {
+	var links, addrs []byte
+	for i := 0; i <= count; i++ {
+		link := syscall.IfInfomsg{Index: int32(i + 1)}
+		name := "lo"
+		hardwareAddr := make([]byte, 6)
+		if i == 0 {
+			link.Flags = syscall.IFF_LOOPBACK
+		} else {
+			name = fmt.Sprintf("veth%04d", i)
+			hardwareAddr = []byte{0x02, 0x42, 0xac, 0x11, byte(i >> 8), byte(i)}
+		}
+		links = append(links, netlinkMessage(
+			syscall.RTM_NEWLINK,
+			(*[syscall.SizeofIfInfomsg]byte)(unsafe.Pointer(&link))[:],
+			map[uint16][]byte{
+				syscall.IFLA_IFNAME:  append([]byte(name), 0),
+				syscall.IFLA_ADDRESS: hardwareAddr,
+			},
+		)...)
+
+		addr := syscall.IfAddrmsg{Family: syscall.AF_INET, Prefixlen: 8, Index: uint32(i + 1)}
+		ip := []byte{127, 0, 0, 1}
+		if i > 0 {
+			ip = []byte{10, 0, byte(i >> 8), byte(i)}
+		}
+		addrs = append(addrs, netlinkMessage(
+			syscall.RTM_NEWADDR,
+			(*[syscall.SizeofIfAddrmsg]byte)(unsafe.Pointer(&addr))[:],
+			map[uint16][]byte{
+				syscall.IFA_ADDRESS: ip,
+				syscall.IFA_LOCAL:   ip,
+			},
+		)...)
+	}
+	done := netlinkMessage(syscall.NLMSG_DONE, make([]byte, 4), nil)
+	links = append(links, done...)
+	addrs = append(addrs, done...)
+
+	return func(proto, family int) ([]byte, error) {
+		switch proto {
+		case syscall.RTM_GETLINK:
+			return links, nil
+		case syscall.RTM_GETADDR:
+			return addrs, nil
+		}
+		return nil, fmt.Errorf("unsupported netlink request %v", proto)
+	}
+}
+
+func TestCollectNetworkFacts(t *testing.T) {
+	defer func(f func(int, int) ([]byte, error)) { netlinkRIB = f }(netlinkRIB)
+	netlinkRIB = fakeNetlinkRIB(2)
+
+	ipAddresses, macAddresses, err := collectNetworkFacts()
+	if err != nil {
+		t.Fatal(err)
+	}
+	wantIPAddresses := []string{"10.0.0.1", "10.0.0.2"}
+	if !cmp.Equal(ipAddresses, wantIPAddresses) {
+		t.Errorf("%v != %v", ipAddresses, wantIPAddresses)
+	}
+	wantMACAddresses := []string{"00:00:00:00:00:00", "02:42:ac:11:00:01", "02:42:ac:11:00:02"}
+	if !cmp.Equal(macAddresses, wantMACAddresses) {
+		t.Errorf("%v != %v", macAddresses, wantMACAddresses)
+	}
+}
+
+func BenchmarkCollectNetworkFacts(b *testing.B) {
+	defer func(f func(int, int) ([]byte, error)) { netlinkRIB = f }(netlinkRIB)
+
+	for _, count := range []int{10, 100, 1000} {
+		netlinkRIB = fakeNetlinkRIB(count)
+		b.Run(fmt.Sprintf("interfaces=%v", count), func(b *testing.B) {
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				if _, _, err := collectNetworkFacts(); err != nil {
+					b.Fatal(err)
+				}
+			}
+		})
+	}
+}
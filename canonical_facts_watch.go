@@ -0,0 +1,284 @@
+package main
+
+import (
+	"context"
+	"errors"
+	"fmt"
+	"os"
+	"path/filepath"
+	"strings"
+	"syscall"
+	"time"
+	"unsafe"
+
+	"github.com/redhatinsights/rhc/internal/trace"
+	"github.com/subpop/go-log"
+	"golang.org/x/sys/unix"
+)
+
+// factsWatchDebounce is the time to wait for further events, before the facts
+// are regenerated. Bursts of events (e.g. an interface going up with several
+// addresses) result in a single regeneration.
+const factsWatchDebounce = time.Second
+
+// factsWatchedFiles maps files to the source of canonical facts depending on
+// their content.
+var factsWatchedFiles = map[string]string{
+	"/etc/machine-id":                 factsSourceMachineID,
+	"/etc/insights-client/machine-id": factsSourceInsightsID,
+	"/etc/pki/consumer/cert.pem":      factsSourceSubscriptionManagerID,
+	"/etc/hostname":                   factsSourceFQDN,
+}
+
+// runFactsWatch collects all canonical facts and passes them to emit. Then it
+// waits for names of changed sources on the events channel. When no event is
+// received for the debounce time, only the facts of the changed sources are
+// collected again and the updated facts are passed to emit. When collecting
+// fails, nil is passed to emit, so the facts known before are not used any
+// more, and the sources are collected again after the next event. It returns
+// when the stop channel is closed.
+func runFactsWatch(events <-chan string, debounce time.Duration, stop <-chan struct{}, emit func(facts *CanonicalFacts)) {
+	// Spans of collecting are recorded by throwaway recorders, the process
+	// runs for a long time and it never writes a trace.
+	collect := func(facts *CanonicalFacts, sources map[string]bool) error {
+		ctx, span := trace.NewRecorder().Start(context.Background(), "collect")
+		defer span.End()
+		return collectCanonicalFacts(ctx, facts, sources)
+	}
+
+	var facts CanonicalFacts
+	pending := make(map[string]bool)
+	if err := collect(&facts, nil); err != nil {
+		log.Errorf("cannot collect canonical facts: %v", err)
+		for _, collector := range canonicalFactsCollectors {
+			pending[collector.source] = true
+		}
+		emit(nil)
+	} else {
+		emit(&facts)
+	}
+
+	timer := time.NewTimer(debounce)
+	if !timer.Stop() {
+		<-timer.C
+	}
+	armed := false
+
+	for {
+		select {
+		case <-stop:
+			timer.Stop()
+			return
+		case source := <-events:
+			log.Debugf("canonical facts source %v changed", source)
+			pending[source] = true
+			if armed && !timer.Stop() {
+				<-timer.C
+			}
+			timer.Reset(debounce)
+			armed = true
+		case <-timer.C:
+			armed = false
+			// Collect into a copy, so a failure does not leave the facts
+			// partially updated.
+			updated := facts
+			if err := collect(&updated, pending); err != nil {
+				log.Errorf("cannot collect canonical facts: %v", err)
+				emit(nil)
+				continue
+			}
+			facts = updated
+			pending = make(map[string]bool)
+			emit(&facts)
+		}
+	}
+}
+
+// watchNetworkChanges subscribes to netlink notifications about changes of
+// network links and IPv4 addresses. A factsSourceNetwork event is sent for
+// every received notification. IPv6 addresses are not part of the canonical
+// facts, so their changes are not watched.
+func watchNetworkChanges(events chan<- string) error {
+	fd, err := syscall.Socket(syscall.AF_NETLINK, syscall.SOCK_RAW|syscall.SOCK_CLOEXEC, syscall.NETLINK_ROUTE)
+	if err != nil {
+		return fmt.Errorf("cannot create netlink socket: %w", err)
+	}
+	addr := &syscall.SockaddrNetlink{
+		Family: syscall.AF_NETLINK,
+		Groups: unix.RTMGRP_LINK | unix.RTMGRP_IPV4_IFADDR,
+	}
+	if err := syscall.Bind(fd, addr); err != nil {
+		syscall.Close(fd)
+		return fmt.Errorf("cannot subscribe to netlink notifications: %w", err)
+	}
+
+	go func() {
+		defer syscall.Close(fd)
+		buf := make([]byte, os.Getpagesize())
+		for {
+			_, _, err := syscall.Recvfrom(fd, buf, 0)
+			switch {
+			case err == nil, errors.Is(err, syscall.ENOBUFS):
+				// ENOBUFS means some notifications were dropped, the
+				// network facts have to be collected again anyway.
+				events <- factsSourceNetwork
+			case errors.Is(err, syscall.EINTR):
+			default:
+				log.Errorf("cannot receive netlink notification: %v", err)
+				return
+			}
+		}
+	}()
+	return nil
+}
+
+// fileWatchMask selects the inotify events of watched directories.
+const fileWatchMask = syscall.IN_CLOSE_WRITE | syscall.IN_CREATE | syscall.IN_DELETE |
+	syscall.IN_MOVED_FROM | syscall.IN_MOVED_TO
+
+// fileWatcher watches the directories of files using inotify. A directory,
+// which does not exist, is watched through its nearest existing ancestor, until
+// it is created.
+type fileWatcher struct {
+	fd    int
+	files map[string]string
+	// dirs maps watch descriptors to the watched directories.
+	dirs map[int]string
+	// watched is the set of watched directories.
+	watched map[string]bool
+}
+
+// arm watches the directories of all files, or their nearest existing
+// ancestors. It returns the directories of files, which were not watched
+// before.
+func (w *fileWatcher) arm() []string {
+	var armed []string
+	for path := range w.files {
+		dir := filepath.Dir(path)
+		for candidate := dir; !w.watched[candidate]; candidate = filepath.Dir(candidate) {
+			wd, err := syscall.InotifyAddWatch(w.fd, candidate, fileWatchMask)
+			if err == nil {
+				w.dirs[wd] = candidate
+				w.watched[candidate] = true
+				if candidate == dir {
+					armed = append(armed, dir)
+				}
+				break
+			}
+			missing := errors.Is(err, syscall.ENOENT) || errors.Is(err, syscall.ENOTDIR)
+			if !missing || candidate == filepath.Dir(candidate) {
+				log.Debugf("cannot watch directory %v: %v", candidate, err)
+				break
+			}
+		}
+	}
+	return armed
+}
+
+// rearm watches directories of files, which were created since they were
+// last armed. Files created in them before the watch was added are reported
+// to the events channel.
+func (w *fileWatcher) rearm(events chan<- string) {
+	for _, dir := range w.arm() {
+		for path, source := range w.files {
+			if filepath.Dir(path) != dir {
+				continue
+			}
+			if _, err := os.Stat(path); err == nil {
+				events <- source
+			}
+		}
+	}
+}
+
+// watchFiles watches the files given as keys of the files map using inotify.
+// Parent directories are watched instead of the files, so creating, removing
+// and atomically replacing the files is noticed too. Whenever a file changes,
+// its source from the files map is sent to the events channel. Parent
+// directories, which do not exist yet, are watched as soon as they are created.
+func watchFiles(files map[string]string, events chan<- string) error {
+	fd, err := syscall.InotifyInit1(syscall.IN_CLOEXEC)
+	if err != nil {
+		return fmt.Errorf("cannot initialize inotify: %w", err)
+	}
+	w := &fileWatcher{
+		fd:      fd,
+		files:   files,
+		dirs:    make(map[int]string),
+		watched: make(map[string]bool),
+	}
+	w.arm()
+
+	go func() {
+		defer syscall.Close(fd)
+		buf := make([]byte, 4096)
+		for {
+			n, err := syscall.Read(fd, buf)
+			if err != nil {
+				if errors.Is(err, syscall.EINTR) {
+					continue
+				}
+				log.Errorf("cannot read inotify events: %v", err)
+				return
+			}
+			for offset := 0; offset+syscall.SizeofInotifyEvent <= n; {
+				event := (*syscall.InotifyEvent)(unsafe.Pointer(&buf[offset]))
+				nameStart := offset + syscall.SizeofInotifyEvent
+				nameEnd := nameStart + int(event.Len)
+				name := strings.TrimRight(string(buf[nameStart:nameEnd]), "\x00")
+				offset = nameEnd
+
+				switch {
+				case event.Mask&syscall.IN_Q_OVERFLOW != 0:
+					for _, source := range files {
+						events <- source
+					}
+					w.rearm(events)
+				case event.Mask&syscall.IN_IGNORED != 0:
+					// The directory was removed, its ancestor is watched
+					// until it is created again.
+					delete(w.watched, w.dirs[int(event.Wd)])
+					delete(w.dirs, int(event.Wd))
+					w.rearm(events)
+				default:
+					if source, ok := files[filepath.Join(w.dirs[int(event.Wd)], name)]; ok {
+						events <- source
+					}
+					if event.Mask&syscall.IN_ISDIR != 0 {
+						w.rearm(events)
+					}
+				}
+			}
+		}
+	}()
+	return nil
+}
+
+// watchHostname waits for changes of the kernel hostname, which are not
+// necessarily reflected in /etc/hostname (e.g. a hostname set by DHCP). The
+// kernel reports the change by POLLERR and POLLPRI on the sysctl file.
+func watchHostname(events chan<- string) error {
+	file, err := os.Open("/proc/sys/kernel/hostname")
+	if err != nil {
+		return err
+	}
+
+	go func() {
+		defer file.Close()
+		fds := []unix.PollFd{{Fd: int32(file.Fd()), Events: unix.POLLPRI | unix.POLLERR}}
+		for {
+			_, err := unix.Poll(fds, -1)
+			if err != nil {
+				if errors.Is(err, syscall.EINTR) {
+					continue
+				}
+				log.Errorf("cannot watch hostname: %v", err)
+				return
+			}
+			if fds[0].Revents&(unix.POLLPRI|unix.POLLERR) != 0 {
+				events <- factsSourceFQDN
+			}
+		}
+	}()
+	return nil
+}
@@ -0,0 +1,166 @@
+package main
+
+import (
+	"fmt"
+	"os"
+	"path/filepath"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/google/go-cmp/cmp"
+)
+
+func TestRunFactsWatch(t *testing.T) {
+	var mu sync.Mutex
+	calls := make(map[string]int)
+	failing := false
+	collector := func(source string, field func(facts *CanonicalFacts) *string) canonicalFactsCollector {
+		return canonicalFactsCollector{
+			source: source,
+			collect: func(facts *CanonicalFacts) error {
+				mu.Lock()
+				defer mu.Unlock()
+				calls[source]++
+				if failing {
+					return fmt.Errorf("cannot read %v", source)
+				}
+				*field(facts) = source + string(rune('0'+calls[source]))
+				return nil
+			},
+		}
+	}
+	defer func(collectors []canonicalFactsCollector) {
+		canonicalFactsCollectors = collectors
+	}(canonicalFactsCollectors)
+	canonicalFactsCollectors = []canonicalFactsCollector{
+		collector(factsSourceMachineID, func(facts *CanonicalFacts) *string { return &facts.MachineID }),
+		collector(factsSourceFQDN, func(facts *CanonicalFacts) *string { return &facts.FQDN }),
+	}
+
+	events := make(chan string)
+	stop := make(chan struct{})
+	emitted := make(chan *CanonicalFacts, 10)
+	done := make(chan struct{})
+	go func() {
+		runFactsWatch(events, 20*time.Millisecond, stop, func(facts *CanonicalFacts) {
+			if facts != nil {
+				snapshot := *facts
+				facts = &snapshot
+			}
+			emitted <- facts
+		})
+		close(done)
+	}()
+
+	want := &CanonicalFacts{MachineID: "machine_id1", FQDN: "fqdn1"}
+	if got := <-emitted; !cmp.Equal(got, want) {
+		t.Errorf("%v", cmp.Diff(got, want))
+	}
+
+	// A burst of events results in a single update of the changed source.
+	for i := 0; i < 5; i++ {
+		events <- factsSourceFQDN
+	}
+	want = &CanonicalFacts{MachineID: "machine_id1", FQDN: "fqdn2"}
+	if got := <-emitted; !cmp.Equal(got, want) {
+		t.Errorf("%v", cmp.Diff(got, want))
+	}
+
+	// Facts known before are not used, when collecting fails.
+	mu.Lock()
+	failing = true
+	mu.Unlock()
+	events <- factsSourceFQDN
+	if got := <-emitted; got != nil {
+		t.Errorf("facts emitted after collecting failed: %+v", got)
+	}
+
+	close(stop)
+	<-done
+	if len(emitted) != 0 {
+		t.Errorf("unexpected facts emitted: %v", <-emitted)
+	}
+	wantCalls := map[string]int{factsSourceMachineID: 1, factsSourceFQDN: 3}
+	if !cmp.Equal(calls, wantCalls) {
+		t.Errorf("%v", cmp.Diff(calls, wantCalls))
+	}
+}
+
+func TestWatchFiles(t *testing.T) {
+	dir := t.TempDir()
+	watched := filepath.Join(dir, "watched")
+	missing := filepath.Join(dir, "missing", "sub", "file")
+	files := map[string]string{
+		watched: "watched",
+		missing: "missing",
+	}
+	events := make(chan string, 10)
+	if err := watchFiles(files, events); err != nil {
+		t.Fatal(err)
+	}
+
+	waitForEvent := func(want string) {
+		t.Helper()
+		timeout := time.After(5 * time.Second)
+		for {
+			select {
+			case got := <-events:
+				if got == want {
+					return
+				}
+			case <-timeout:
+				t.Fatalf("no event %q received", want)
+			}
+		}
+	}
+	// drain drops events, until no event is received for a while.
+	drain := func() {
+		for {
+			select {
+			case <-events:
+			case <-time.After(100 * time.Millisecond):
+				return
+			}
+		}
+	}
+
+	if err := os.WriteFile(filepath.Join(dir, "other"), []byte("data"), 0644); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.WriteFile(watched, []byte("data"), 0644); err != nil {
+		t.Fatal(err)
+	}
+	select {
+	case got := <-events:
+		if got != "watched" {
+			t.Errorf("got event %q, want %q", got, "watched")
+		}
+	case <-time.After(5 * time.Second):
+		t.Fatal("no event received")
+	}
+
+	// Directories created after the start are watched too.
+	if err := os.MkdirAll(filepath.Dir(missing), 0755); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.WriteFile(missing, []byte("data"), 0644); err != nil {
+		t.Fatal(err)
+	}
+	waitForEvent("missing")
+	drain()
+
+	// And again, after they were removed and created again.
+	if err := os.RemoveAll(filepath.Join(dir, "missing")); err != nil {
+		t.Fatal(err)
+	}
+	waitForEvent("missing")
+	drain()
+	if err := os.MkdirAll(filepath.Dir(missing), 0755); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.WriteFile(missing, []byte("data"), 0644); err != nil {
+		t.Fatal(err)
+	}
+	waitForEvent("missing")
+}
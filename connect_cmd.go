@@ -1,12 +1,14 @@
 package main
 
 import (
+	"context"
 	"encoding/json"
 	"fmt"
 	"os"
 	"strings"
 	"time"
 
+	"github.com/redhatinsights/rhc/internal/trace"
 	"github.com/subpop/go-log"
 	"github.com/urfave/cli/v2"
 )
@@ -31,7 +33,9 @@ type ConnectResult struct {
 		Analytics        FeatureResult `json:"analytics"`
 		RemoteManagement FeatureResult `json:"remote_management"`
 	} `json:"features"`
-	format string
+	Durations map[string]int64 `json:"durations_ms"`
+	Timings   []trace.Timing   `json:"timings,omitempty"`
+	format    string
 }
 
 // Error implement error interface for structure ConnectResult
@@ -44,6 +48,12 @@ func (connectResult ConnectResult) Error() string {
 			return err.Error()
 		}
 		result = string(data)
+	case "ndjson":
+		data, err := json.Marshal(connectResult)
+		if err != nil {
+			return err.Error()
+		}
+		result = string(data)
 	case "":
 		break
 	default:
@@ -56,13 +66,15 @@ func (connectResult ConnectResult) Error() string {
 // and there is no conflict between provided options
 func beforeConnectAction(ctx *cli.Context) error {
 	// First check if machine-readable format is used
-	err := setupFormatOption(ctx)
+	err := setupFormatOption(ctx, "json", "ndjson")
 	if err != nil {
 		return err
 	}
 
 	// When machine is already connected, then return error
-	uuid, err := getConsumerUUID()
+	uuidCtx, cancel := withCommandTimeout(ctx, context.Background())
+	defer cancel()
+	uuid, err := getConsumerUUID(uuidCtx)
 	if err != nil {
 		return fmt.Errorf("unable to get consumer UUID: %s", err)
 	}
@@ -132,6 +144,9 @@ func beforeConnectAction(ctx *cli.Context) error {
 // gather the profile information that the system will configure
 // connect system to Red Hat Insights, and it also tries to start rhcd service
 func connectAction(ctx *cli.Context) error {
+	spanCtx, endTrace := startCommandTrace(ctx)
+	defer endTrace()
+
 	var connectResult ConnectResult
 	connectResult.format = ctx.String("format")
 
@@ -142,7 +157,7 @@ func connectAction(ctx *cli.Context) error {
 		if uiSettings.isMachineReadable {
 			connectResult.UID = uid
 			connectResult.UIDError = errMsg
-			return cli.Exit(connectResult, exitCode)
+			return exitWithResult(connectResult, exitCode)
 		} else {
 			return cli.Exit(fmt.Errorf("error: %s", errMsg), exitCode)
 		}
@@ -156,12 +171,15 @@ func connectAction(ctx *cli.Context) error {
 		exitCode := 1
 		if uiSettings.isMachineReadable {
 			connectResult.HostnameError = err.Error()
-			return cli.Exit(connectResult, exitCode)
+			return exitWithResult(connectResult, exitCode)
 		} else {
 			return cli.Exit(err, exitCode)
 		}
 	}
 
+	// Any cached status of the system is outdated after this action
+	defer invalidateStatusCache()
+
 	interactivePrintf("Connecting %v to %v.\nThis might take a few seconds.\n\n", hostname, Provider)
 
 	var featuresStr []string
@@ -195,73 +213,131 @@ func connectAction(ctx *cli.Context) error {
 	featuresListStr := strings.Join(featuresStr, ", ")
 	interactivePrintf("Features preferences: %s\n\n", featuresListStr)
 
-	var start time.Time
+	/* 0. Check that the servers are reachable, before any configuration is changed */
+	if !ctx.Bool("no-preflight") {
+		err := trace.Run(spanCtx, "preflight", streamStep("preflight", func(stepCtx context.Context) error {
+			return preflightCheck(stepCtx, ctx.String("server"), AnalyticsFeature.Enabled)
+		}))
+		if err != nil {
+			err = fmt.Errorf("cannot connect to Red Hat Subscription Management: %w", err)
+			if uiSettings.isMachineReadable {
+				connectResult.RHSMConnectError = err.Error()
+				return exitWithResult(connectResult, 1)
+			}
+			return cli.Exit(err, 1)
+		}
+	}
+
 	durations := make(map[string]time.Duration)
 	errorMessages := make(map[string]LogMessage)
-	/* 1. Register to RHSM, because we need to get consumer certificate. This blocks following action */
-	start = time.Now()
-	var returnedMsg string
-	returnedMsg, err = registerRHSM(ctx, ContentFeature.Enabled)
-	if err != nil {
+
+	/* 1. Register to RHSM, because we need to get consumer certificate. This blocks following actions */
+	rhsmStep := &pipelineStep{
+		ID: "rhsm",
+		Run: func(stepCtx context.Context) error {
+			returnedMsg, err := registerRHSM(stepCtx, ctx, ContentFeature.Enabled)
+			if err != nil {
+				if !uiSettings.isMachineReadable {
+					fmt.Printf(
+						"%s[%v] Cannot connect to Red Hat Subscription Management\n",
+						smallIndent,
+						uiSettings.iconError,
+					)
+					fmt.Printf(
+						"%s[%v] Skipping generation of Red Hat repository file\n",
+						mediumIndent,
+						uiSettings.iconError,
+					)
+				}
+				return err
+			}
+			interactivePrintf("%s[%v] %v\n", smallIndent, uiSettings.iconOK, returnedMsg)
+			if ContentFeature.Enabled {
+				interactivePrintf(
+					"%s[%v] Content ... Red Hat repository file generated\n",
+					mediumIndent,
+					uiSettings.iconOK,
+				)
+			} else {
+				interactivePrintf("%s[ ] Content ... Red Hat repository file not generated\n", mediumIndent)
+			}
+			return nil
+		},
+	}
+	steps := []*pipelineStep{rhsmStep}
+
+	/* 2. Register insights-client. It requires only consumer certificate */
+	insightsStep := &pipelineStep{
+		ID:       "insights",
+		Requires: []string{rhsmStep.ID},
+		Progress: "Connecting to Red Hat Insights",
+		Run:      registerInsights,
+	}
+	if AnalyticsFeature.Enabled {
+		steps = append(steps, insightsStep)
+	}
+
+	/* 3. Start yggdrasil (rhcd) service. It requires only consumer certificate,
+	but rhc-canonical-facts.service started with it reads the machine ID of
+	insights-client, so it is activated after insights-client is registered,
+	even when the registration failed. */
+	serviceStep := &pipelineStep{
+		ID:       ServiceName,
+		Requires: []string{rhsmStep.ID},
+		Progress: fmt.Sprintf("Activating the %v service", ServiceName),
+		Run:      activateService,
+	}
+	if AnalyticsFeature.Enabled {
+		serviceStep.After = []string{insightsStep.ID}
+	}
+	if ManagementFeature.Enabled {
+		steps = append(steps, serviceStep)
+	}
+
+	for _, step := range steps {
+		step.Run = streamStep(step.ID, step.Run)
+	}
+	if err := runPipeline(spanCtx, steps, pipelineProgress(mediumIndent)); err != nil {
+		return cli.Exit(err, 1)
+	}
+	for _, step := range steps {
+		if step.Skipped {
+			emitSkippedStep(step.ID)
+		}
+	}
+
+	/* Report results of all steps in fixed order */
+	if rhsmStep.Err != nil {
 		connectResult.RHSMConnected = false
 		errorMessages["rhsm"] = LogMessage{
 			level: log.LevelError,
 			message: fmt.Errorf("cannot connect to Red Hat Subscription Management: %w",
-				err)}
+				rhsmStep.Err)}
 		if uiSettings.isMachineReadable {
 			connectResult.RHSMConnectError = errorMessages["rhsm"].message.Error()
 			connectResult.Features.Content.Successful = false
-		} else {
-			fmt.Printf(
-				"%s[%v] Cannot connect to Red Hat Subscription Management\n",
-				smallIndent,
-				uiSettings.iconError,
-			)
-			fmt.Printf(
-				"%s[%v] Skipping generation of Red Hat repository file\n",
-				mediumIndent,
-				uiSettings.iconError,
-			)
 		}
 	} else {
 		connectResult.RHSMConnected = true
-		interactivePrintf("%s[%v] %v\n", smallIndent, uiSettings.iconOK, returnedMsg)
-		if ContentFeature.Enabled {
-			if uiSettings.isMachineReadable {
-				connectResult.Features.Content.Successful = true
-			}
-			interactivePrintf(
-				"%s[%v] Content ... Red Hat repository file generated\n",
-				mediumIndent,
-				uiSettings.iconOK,
-			)
-		} else {
-			if uiSettings.isMachineReadable {
-				connectResult.Features.Content.Successful = false
-			}
-			interactivePrintf("%s[ ] Content ... Red Hat repository file not generated\n", mediumIndent)
+		if uiSettings.isMachineReadable {
+			connectResult.Features.Content.Successful = ContentFeature.Enabled
 		}
 	}
-	durations["rhsm"] = time.Since(start)
+	durations["rhsm"] = rhsmStep.Duration
 
-	/* 2. Register insights-client */
 	if AnalyticsFeature.Enabled {
-		if errors, exist := errorMessages["rhsm"]; exist {
-			if errors.level == log.LevelError {
-				interactivePrintf(
-					"%s[%v] Skipping connection to Red Hat Insights\n",
-					mediumIndent,
-					uiSettings.iconError,
-				)
-			}
+		if insightsStep.Skipped {
+			interactivePrintf(
+				"%s[%v] Skipping connection to Red Hat Insights\n",
+				mediumIndent,
+				uiSettings.iconError,
+			)
 		} else {
-			start = time.Now()
-			err = showProgress(" Connecting to Red Hat Insights...", registerInsights, mediumIndent)
-			if err != nil {
+			if insightsStep.Err != nil {
 				connectResult.Features.Analytics.Successful = false
 				errorMessages["insights"] = LogMessage{
 					level:   log.LevelError,
-					message: fmt.Errorf("cannot connect to Red Hat Insights: %w", err)}
+					message: fmt.Errorf("cannot connect to Red Hat Insights: %w", insightsStep.Err)}
 				if uiSettings.isMachineReadable {
 					connectResult.Features.Analytics.Error = errorMessages["insights"].message.Error()
 				} else {
@@ -279,7 +355,7 @@ func connectAction(ctx *cli.Context) error {
 					uiSettings.iconOK,
 				)
 			}
-			durations["insights"] = time.Since(start)
+			durations["insights"] = insightsStep.Duration
 		}
 	} else {
 		if uiSettings.isMachineReadable {
@@ -289,8 +365,7 @@ func connectAction(ctx *cli.Context) error {
 	}
 
 	if ManagementFeature.Enabled {
-		/* 3. Start yggdrasil (rhcd) service */
-		if rhsmErrMsg, exist := errorMessages["rhsm"]; exist && rhsmErrMsg.level == log.LevelError {
+		if serviceStep.Skipped {
 			connectResult.Features.RemoteManagement.Successful = false
 			interactivePrintf(
 				"%s[%v] Skipping activation of %v service\n",
@@ -299,15 +374,12 @@ func connectAction(ctx *cli.Context) error {
 				ServiceName,
 			)
 		} else {
-			start = time.Now()
-			progressMessage := fmt.Sprintf(" Activating the %v service", ServiceName)
-			err = showProgress(progressMessage, activateService, mediumIndent)
-			if err != nil {
+			if serviceStep.Err != nil {
 				connectResult.Features.RemoteManagement.Successful = false
 				errorMessages[ServiceName] = LogMessage{
 					level: log.LevelError,
 					message: fmt.Errorf("cannot activate %s service: %w",
-						ServiceName, err)}
+						ServiceName, serviceStep.Err)}
 				if uiSettings.isMachineReadable {
 					connectResult.Features.RemoteManagement.Error = errorMessages[ServiceName].message.Error()
 				} else {
@@ -327,7 +399,7 @@ func connectAction(ctx *cli.Context) error {
 					ServiceName,
 				)
 			}
-			durations[ServiceName] = time.Since(start)
+			durations[ServiceName] = serviceStep.Duration
 		}
 	} else {
 		if uiSettings.isMachineReadable {
@@ -349,6 +421,11 @@ func connectAction(ctx *cli.Context) error {
 		}
 	}
 
+	connectResult.Durations = make(map[string]int64, len(durations))
+	for step, duration := range durations {
+		connectResult.Durations[step] = duration.Milliseconds()
+	}
+
 	interactivePrintf("\nSuccessfully connected to Red Hat!\n")
 
 	if !uiSettings.isMachineReadable {
@@ -356,7 +433,7 @@ func connectAction(ctx *cli.Context) error {
 		fmt.Printf("\nManage your connected systems: https://red.ht/connector\n")
 
 		/* 6. Optionally display duration time of each sub-action */
-		showTimeDuration(durations)
+		showTimeDuration(trace.Timings())
 	}
 
 	err = showErrorMessages("connect", errorMessages)
@@ -364,5 +441,6 @@ func connectAction(ctx *cli.Context) error {
 		return err
 	}
 
-	return cli.Exit(connectResult, 0)
+	connectResult.Timings = trace.Timings()
+	return exitWithResult(connectResult, 0)
 }
@@ -0,0 +1,123 @@
+package main
+
+import (
+	"encoding/json"
+	"fmt"
+	"os"
+	"text/tabwriter"
+	"time"
+
+	"github.com/redhatinsights/rhc/internal/http"
+	"github.com/urfave/cli/v2"
+)
+
+// EndpointDiagnosis is the result of the probe of one endpoint. Durations are
+// in milliseconds, like timings of traces.
+type EndpointDiagnosis struct {
+	Name       string  `json:"name"`
+	Address    string  `json:"address"`
+	Proxy      bool    `json:"proxy"`
+	IP         string  `json:"ip,omitempty"`
+	DNSMs      float64 `json:"dns_ms"`
+	ConnectMs  float64 `json:"connect_ms"`
+	TLSMs      float64 `json:"tls_ms"`
+	TotalMs    float64 `json:"total_ms"`
+	ErrorStage string  `json:"error_stage,omitempty"`
+	Error      string  `json:"error,omitempty"`
+}
+
+// newEndpointDiagnosis converts the result of the probe of the endpoint.
+func newEndpointDiagnosis(e endpoint, result http.ProbeResult) EndpointDiagnosis {
+	milliseconds := func(d time.Duration) float64 {
+		return float64(d.Microseconds()) / 1000
+	}
+	diagnosis := EndpointDiagnosis{
+		Name:      e.name,
+		Address:   e.address,
+		Proxy:     e.proxy,
+		IP:        result.IP,
+		DNSMs:     milliseconds(result.DNS),
+		ConnectMs: milliseconds(result.Connect),
+		TLSMs:     milliseconds(result.TLSHandshake),
+		TotalMs:   milliseconds(result.Total),
+	}
+	if result.Err != nil {
+		diagnosis.ErrorStage = result.Stage
+		diagnosis.Error = probeError(e, result).Error()
+	}
+	return diagnosis
+}
+
+// beforeDiagnoseAction ensures that user has supplied a correct CLI options
+func beforeDiagnoseAction(ctx *cli.Context) error {
+	err := setupFormatOption(ctx, "json")
+	if err != nil {
+		return err
+	}
+	return checkForUnknownArgs(ctx)
+}
+
+// diagnoseAction checks that the servers of Red Hat Subscription Management
+// and Red Hat Insights are reachable from the system, like connect does it
+// before it changes anything. It prints the time spent resolving, connecting
+// and in TLS handshake with every server. The exit code is 1, when any server
+// is not reachable.
+func diagnoseAction(ctx *cli.Context) error {
+	spanCtx, endTrace := startCommandTrace(ctx)
+	defer endTrace()
+
+	candlepin := candlepinEndpoint(ctx.String("server"))
+	endpoints := []endpoint{candlepin, insightsEndpoint(candlepin)}
+	results := probeEndpoints(spanCtx, endpoints)
+
+	diagnoses := make([]EndpointDiagnosis, len(endpoints))
+	failed := false
+	for i, e := range endpoints {
+		diagnoses[i] = newEndpointDiagnosis(e, results[i])
+		failed = failed || results[i].Err != nil
+	}
+
+	if uiSettings.isMachineReadable {
+		data, err := json.MarshalIndent(struct {
+			Endpoints []EndpointDiagnosis `json:"endpoints"`
+		}{diagnoses}, "", "    ")
+		if err != nil {
+			return cli.Exit(err, 1)
+		}
+		fmt.Println(string(data))
+	} else {
+		w := tabwriter.NewWriter(os.Stdout, 0, 0, 2, ' ', 0)
+		_, _ = fmt.Fprintln(w, "\tENDPOINT\tADDRESS\tIP\tDNS\tCONNECT\tTLS\tTOTAL\t")
+		for i, diagnosis := range diagnoses {
+			result := results[i]
+			address := diagnosis.Address
+			if diagnosis.Proxy {
+				address += " (proxy)"
+			}
+			if result.Err != nil {
+				_, _ = fmt.Fprintf(w, "[%v]\t%v\t%v\t%v\t\n", uiSettings.iconError, diagnosis.Name, address, diagnosis.Error)
+				continue
+			}
+			tls := "-"
+			if !diagnosis.Proxy {
+				tls = result.TLSHandshake.Truncate(time.Microsecond).String()
+			}
+			_, _ = fmt.Fprintf(w, "[%v]\t%v\t%v\t%v\t%v\t%v\t%v\t%v\t\n",
+				uiSettings.iconOK,
+				diagnosis.Name,
+				address,
+				diagnosis.IP,
+				result.DNS.Truncate(time.Microsecond),
+				result.Connect.Truncate(time.Microsecond),
+				tls,
+				result.Total.Truncate(time.Microsecond),
+			)
+		}
+		_ = w.Flush()
+	}
+
+	if failed {
+		return cli.Exit("", 1)
+	}
+	return nil
+}
@@ -1,11 +1,12 @@
 package main
 
 import (
+	"context"
 	"encoding/json"
 	"fmt"
 	"os"
-	"time"
 
+	"github.com/redhatinsights/rhc/internal/trace"
 	"github.com/subpop/go-log"
 	"github.com/urfave/cli/v2"
 )
@@ -13,16 +14,17 @@ import (
 // DisconnectResult is structure holding information about result of
 // disconnect command. The result could be printed in machine-readable format.
 type DisconnectResult struct {
-	Hostname                  string `json:"hostname"`
-	HostnameError             string `json:"hostname_error,omitempty"`
-	UID                       int    `json:"uid"`
-	UIDError                  string `json:"uid_error,omitempty"`
-	RHSMDisconnected          bool   `json:"rhsm_disconnected"`
-	RHSMDisconnectedError     string `json:"rhsm_disconnect_error,omitempty"`
-	InsightsDisconnected      bool   `json:"insights_disconnected"`
-	InsightsDisconnectedError string `json:"insights_disconnected_error,omitempty"`
-	YggdrasilStopped          bool   `json:"yggdrasil_stopped"`
-	YggdrasilStoppedError     string `json:"yggdrasil_stopped_error,omitempty"`
+	Hostname                  string         `json:"hostname"`
+	HostnameError             string         `json:"hostname_error,omitempty"`
+	UID                       int            `json:"uid"`
+	UIDError                  string         `json:"uid_error,omitempty"`
+	RHSMDisconnected          bool           `json:"rhsm_disconnected"`
+	RHSMDisconnectedError     string         `json:"rhsm_disconnect_error,omitempty"`
+	InsightsDisconnected      bool           `json:"insights_disconnected"`
+	InsightsDisconnectedError string         `json:"insights_disconnected_error,omitempty"`
+	YggdrasilStopped          bool           `json:"yggdrasil_stopped"`
+	YggdrasilStoppedError     string         `json:"yggdrasil_stopped_error,omitempty"`
+	Timings                   []trace.Timing `json:"timings,omitempty"`
 	format                    string
 }
 
@@ -36,6 +38,12 @@ func (disconnectResult DisconnectResult) Error() string {
 			return err.Error()
 		}
 		result = string(data)
+	case "ndjson":
+		data, err := json.Marshal(disconnectResult)
+		if err != nil {
+			return err.Error()
+		}
+		result = string(data)
 	case "":
 		break
 	default:
@@ -46,19 +54,20 @@ func (disconnectResult DisconnectResult) Error() string {
 
 // beforeDisconnectAction ensures the used has supplied a correct `--format` flag
 func beforeDisconnectAction(ctx *cli.Context) error {
-	err := setupFormatOption(ctx)
+	err := setupFormatOption(ctx, "json", "ndjson")
 	if err != nil {
 		return err
 	}
+	insightsStatusFromClient = ctx.Bool("insights-client-status")
 
 	return checkForUnknownArgs(ctx)
 }
 
 // disconnectService tries to stop yggdrasil.service, when it hasn't
 // been already stopped.
-func disconnectService(disconnectResult *DisconnectResult, errorMessages *map[string]LogMessage) error {
+func disconnectService(ctx context.Context, disconnectResult *DisconnectResult, errorMessages *map[string]LogMessage) error {
 	// First check if the service hasn't been already stopped
-	isInactive, err := isServiceInState("inactive")
+	isInactive, err := isServiceInState(ctx, "inactive")
 	if err != nil {
 		return err
 	}
@@ -70,7 +79,7 @@ func disconnectService(disconnectResult *DisconnectResult, errorMessages *map[st
 	}
 	// When the service is not inactive, then try to get this service to this state
 	progressMessage := fmt.Sprintf(" Deactivating the %v service", ServiceName)
-	err = showProgress(progressMessage, deactivateService, smallIndent)
+	err = showProgress(progressMessage, func() error { return deactivateService(ctx) }, smallIndent)
 	if err != nil {
 		errMsg := fmt.Sprintf("Cannot deactivate %s service: %v", ServiceName, err)
 		(*errorMessages)[ServiceName] = LogMessage{
@@ -88,8 +97,8 @@ func disconnectService(disconnectResult *DisconnectResult, errorMessages *map[st
 
 // disconnectInsightsClient tries to unregister insights-client if the client hasn't been
 // already unregistered
-func disconnectInsightsClient(disconnectResult *DisconnectResult, errorMessages *map[string]LogMessage) error {
-	isRegistered, err := insightsIsRegistered()
+func disconnectInsightsClient(ctx context.Context, disconnectResult *DisconnectResult, errorMessages *map[string]LogMessage) error {
+	isRegistered, err := insightsIsRegistered(ctx)
 	if err != nil {
 		return err
 	}
@@ -99,7 +108,11 @@ func disconnectInsightsClient(disconnectResult *DisconnectResult, errorMessages
 		interactivePrintf(" [%v] %v\n", uiSettings.iconInfo, infoMsg)
 		return nil
 	}
-	err = showProgress(" Disconnecting from Red Hat Insights...", unregisterInsights, smallIndent)
+	err = showProgress(
+		" Disconnecting from Red Hat Insights...",
+		func() error { return unregisterInsights(ctx) },
+		smallIndent,
+	)
 	if err != nil {
 		errMsg := fmt.Sprintf("Cannot disconnect from Red Hat Insights: %v", err)
 		(*errorMessages)["insights"] = LogMessage{
@@ -117,8 +130,8 @@ func disconnectInsightsClient(disconnectResult *DisconnectResult, errorMessages
 
 // disconnectRHSM tries to unregister system from RHSM if the client hasn't been already
 // unregistered from RHSM
-func disconnectRHSM(disconnectResult *DisconnectResult, errorMessages *map[string]LogMessage) error {
-	isRegistered, err := isRHSMRegistered()
+func disconnectRHSM(ctx context.Context, disconnectResult *DisconnectResult, errorMessages *map[string]LogMessage) error {
+	isRegistered, err := isRHSMRegistered(ctx)
 	if err != nil {
 		return err
 	}
@@ -130,7 +143,7 @@ func disconnectRHSM(disconnectResult *DisconnectResult, errorMessages *map[strin
 	}
 	err = showProgress(
 		" Disconnecting from Red Hat Subscription Management...",
-		unregister,
+		func() error { return unregister(ctx) },
 		smallIndent,
 	)
 	if err != nil {
@@ -152,6 +165,9 @@ func disconnectRHSM(disconnectResult *DisconnectResult, errorMessages *map[strin
 // disconnectAction tries to stop (yggdrasil) rhcd service, disconnect from Red Hat Insights,
 // and finally it unregisters system from Red Hat Subscription Management
 func disconnectAction(ctx *cli.Context) error {
+	spanCtx, endTrace := startCommandTrace(ctx)
+	defer endTrace()
+
 	var disconnectResult DisconnectResult
 	disconnectResult.format = ctx.String("format")
 
@@ -162,7 +178,7 @@ func disconnectAction(ctx *cli.Context) error {
 		if uiSettings.isMachineReadable {
 			disconnectResult.UID = uid
 			disconnectResult.UIDError = errMsg
-			return cli.Exit(disconnectResult, exitCode)
+			return exitWithResult(disconnectResult, exitCode)
 		} else {
 			return cli.Exit(fmt.Errorf("error: %s", errMsg), exitCode)
 		}
@@ -176,36 +192,51 @@ func disconnectAction(ctx *cli.Context) error {
 		exitCode := 1
 		if uiSettings.isMachineReadable {
 			disconnectResult.HostnameError = err.Error()
-			return cli.Exit(disconnectResult, exitCode)
+			return exitWithResult(disconnectResult, exitCode)
 		} else {
 			return cli.Exit(err, exitCode)
 		}
 	}
 
+	// Any cached status of the system is outdated after this action
+	defer invalidateStatusCache()
+
 	interactivePrintf("Disconnecting %v from %v.\nThis might take a few seconds.\n\n", hostname, Provider)
 
-	var start time.Time
-	durations := make(map[string]time.Duration)
 	errorMessages := make(map[string]LogMessage)
 
+	// runStep runs the step in a span and reports it, when events are streamed.
+	// The steps record their failures in errorMessages, instead of returning them.
+	runStep := func(step string, run func(ctx context.Context) error) {
+		_ = trace.Run(spanCtx, step, streamStep(step, func(ctx context.Context) error {
+			if err := run(ctx); err != nil {
+				return err
+			}
+			if errorMessage, ok := errorMessages[step]; ok {
+				return errorMessage.message
+			}
+			return nil
+		}))
+	}
+
 	/* 1. Deactivate yggdrasil (rhcd) service */
-	start = time.Now()
-	_ = disconnectService(&disconnectResult, &errorMessages)
-	durations[ServiceName] = time.Since(start)
+	runStep(ServiceName, func(ctx context.Context) error {
+		return disconnectService(ctx, &disconnectResult, &errorMessages)
+	})
 
 	/* 2. Disconnect from Red Hat Insights */
-	start = time.Now()
-	_ = disconnectInsightsClient(&disconnectResult, &errorMessages)
-	durations["insights"] = time.Since(start)
+	runStep("insights", func(ctx context.Context) error {
+		return disconnectInsightsClient(ctx, &disconnectResult, &errorMessages)
+	})
 
 	/* 3. Unregister system from Red Hat Subscription Management */
-	start = time.Now()
-	_ = disconnectRHSM(&disconnectResult, &errorMessages)
-	durations["rhsm"] = time.Since(start)
+	runStep("rhsm", func(ctx context.Context) error {
+		return disconnectRHSM(ctx, &disconnectResult, &errorMessages)
+	})
 
 	if !uiSettings.isMachineReadable {
 		fmt.Printf("\nManage your connected systems: https://red.ht/connector\n")
-		showTimeDuration(durations)
+		showTimeDuration(trace.Timings())
 
 		err = showErrorMessages("disconnect", errorMessages)
 		if err != nil {
@@ -213,5 +244,6 @@ func disconnectAction(ctx *cli.Context) error {
 		}
 	}
 
-	return cli.Exit(disconnectResult, 0)
+	disconnectResult.Timings = trace.Timings()
+	return exitWithResult(disconnectResult, 0)
 }
@@ -18,8 +18,10 @@ type RhcFeature struct {
 	Enabled bool
 	// Reason for disabling feature
 	Reason string
-	// Requires is a list of IDs of other features that are required for this feature. RhcFeature
-	// dependencies are not resolved.
+	// Requires is a list of other features that are required for this feature. When any of
+	// required features is disabled, then this feature is disabled too (see checkFeatureInput).
+	// Order of connect steps is not derived from this list; the steps are scheduled by
+	// runPipeline according to their own requirements.
 	Requires []*RhcFeature
 	// EnableFunc is callback function, and it is called when the feature should transition
 	// into enabled state.
@@ -0,0 +1,421 @@
+package main
+
+import (
+	"bufio"
+	"bytes"
+	"context"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io"
+	"os"
+	"os/exec"
+	"os/signal"
+	"strings"
+	"sync"
+	"syscall"
+	"time"
+
+	"github.com/urfave/cli/v2"
+)
+
+// sshExitCodeError is the exit code of ssh, when it cannot connect to the host.
+const sshExitCodeError = 255
+
+// fleetOptions configures runFleet.
+type fleetOptions struct {
+	// ssh is the ssh program. Tests use a stand-in.
+	ssh string
+	// sshOptions are passed to ssh as -o OPTION.
+	sshOptions []string
+	// command is the rhc command run on every host.
+	command []string
+	// parallel is the number of hosts processed at once.
+	parallel int
+	// timeout limits a single attempt on a host.
+	timeout time.Duration
+	// retries is the number of additional attempts on a host, which failed
+	// to run the command.
+	retries int
+	// retryDelay is the delay before the first retry. It grows linearly with
+	// every further retry.
+	retryDelay time.Duration
+	// retryTimeouts allows retrying attempts that timed out. It must be false
+	// for commands, which are not safe to run twice.
+	retryTimeouts bool
+	// decode parses the output of the command into the result.
+	decode func(result *FleetHostResult, stdout, stderr []byte) error
+}
+
+// FleetHostResult is the outcome of a fleet command on one host. It is
+// printed as one line of NDJSON output.
+type FleetHostResult struct {
+	Host       string         `json:"host"`
+	Attempts   int            `json:"attempts"`
+	DurationMs int64          `json:"duration_ms"`
+	ExitCode   int            `json:"exit_code"`
+	Error      string         `json:"error,omitempty"`
+	Status     *SystemStatus  `json:"status,omitempty"`
+	Connect    *ConnectResult `json:"connect,omitempty"`
+	// unreachable is true, when the command could not be run on the host.
+	unreachable bool
+}
+
+// FleetSummary aggregates results of all hosts. It is printed as the last
+// line of NDJSON output.
+type FleetSummary struct {
+	Hosts       int   `json:"hosts"`
+	Succeeded   int   `json:"succeeded"`
+	Failed      int   `json:"failed"`
+	Unreachable int   `json:"unreachable"`
+	Retried     int   `json:"retried"`
+	DurationMs  int64 `json:"duration_ms"`
+	// Connected counts hosts connected to RHSM ("rhsm"), Red Hat Insights
+	// ("insights") and hosts running the yggdrasil (rhcd) service.
+	Connected map[string]int `json:"connected"`
+}
+
+// add counts the result of one host in the summary.
+func (summary *FleetSummary) add(result *FleetHostResult) {
+	summary.Hosts++
+	switch {
+	case result.unreachable:
+		summary.Unreachable++
+	case result.Error != "" || result.ExitCode != 0:
+		summary.Failed++
+	default:
+		summary.Succeeded++
+	}
+	if result.Attempts > 1 {
+		summary.Retried++
+	}
+	count := func(key string, connected bool) {
+		if connected {
+			summary.Connected[key]++
+		}
+	}
+	if status := result.Status; status != nil {
+		count("rhsm", status.RHSMConnected)
+		count("insights", status.InsightsConnected)
+		count(ServiceName, status.YggdrasilRunning)
+	}
+	if connect := result.Connect; connect != nil {
+		count("rhsm", connect.RHSMConnected)
+		count("insights", connect.Features.Analytics.Successful)
+		count(ServiceName, connect.Features.RemoteManagement.Successful)
+	}
+}
+
+// readHosts reads the list of hosts, one host per line. Empty lines and lines
+// starting with # are skipped. The file "-" is standard input.
+func readHosts(filename string) ([]string, error) {
+	var input io.Reader = os.Stdin
+	if filename != "-" {
+		file, err := os.Open(filename)
+		if err != nil {
+			return nil, err
+		}
+		defer file.Close()
+		input = file
+	}
+
+	var hosts []string
+	scanner := bufio.NewScanner(input)
+	for scanner.Scan() {
+		host := strings.TrimSpace(scanner.Text())
+		if host == "" || strings.HasPrefix(host, "#") {
+			continue
+		}
+		// ssh would take it for an option
+		if strings.HasPrefix(host, "-") {
+			return nil, fmt.Errorf("invalid host: %v", host)
+		}
+		hosts = append(hosts, host)
+	}
+	return hosts, scanner.Err()
+}
+
+// shellQuote quotes the words, so the remote shell run by ssh passes them to
+// the command unchanged.
+func shellQuote(words []string) string {
+	quoted := make([]string, len(words))
+	for i, word := range words {
+		quoted[i] = "'" + strings.ReplaceAll(word, "'", `'\''`) + "'"
+	}
+	return strings.Join(quoted, " ")
+}
+
+// runRemote runs the command on the host using ssh. The command is sent to
+// the remote shell on stdin, so arguments like activation keys do not appear
+// in the arguments of ssh, which any user of the local system can list. ssh
+// runs in its own process group, which is killed as a whole, when ctx is done;
+// otherwise processes inheriting its output could keep the attempt running.
+func runRemote(ctx context.Context, options *fleetOptions, host string) (stdout []byte, stderr []byte, exitCode int, err error) {
+	args := []string{"-o", "BatchMode=yes"}
+	for _, option := range options.sshOptions {
+		args = append(args, "-o", option)
+	}
+	args = append(args, host, "sh")
+
+	var stdoutBuf, stderrBuf bytes.Buffer
+	cmd := exec.Command(options.ssh, args...)
+	cmd.Stdin = strings.NewReader("exec " + shellQuote(options.command) + "\n")
+	cmd.Stdout = &stdoutBuf
+	cmd.Stderr = &stderrBuf
+	cmd.SysProcAttr = &syscall.SysProcAttr{Setpgid: true}
+	if err := cmd.Start(); err != nil {
+		return nil, nil, -1, err
+	}
+
+	done := make(chan error, 1)
+	go func() {
+		done <- cmd.Wait()
+	}()
+	select {
+	case err = <-done:
+	case <-ctx.Done():
+		_ = syscall.Kill(-cmd.Process.Pid, syscall.SIGKILL)
+		<-done
+		return stdoutBuf.Bytes(), stderrBuf.Bytes(), -1, ctx.Err()
+	}
+
+	var exitError *exec.ExitError
+	if errors.As(err, &exitError) {
+		return stdoutBuf.Bytes(), stderrBuf.Bytes(), exitError.ExitCode(), nil
+	}
+	return stdoutBuf.Bytes(), stderrBuf.Bytes(), 0, err
+}
+
+// firstLine returns the first non-empty line of the output.
+func firstLine(output []byte) string {
+	for _, line := range strings.Split(string(output), "\n") {
+		if line = strings.TrimSpace(line); line != "" {
+			return line
+		}
+	}
+	return ""
+}
+
+// runFleetHost runs the command on one host and retries attempts, which
+// could not run the command.
+func runFleetHost(ctx context.Context, options *fleetOptions, host string) *FleetHostResult {
+	result := &FleetHostResult{Host: host}
+	start := time.Now()
+	defer func() {
+		result.DurationMs = time.Since(start).Milliseconds()
+	}()
+
+	for attempt := 1; ; attempt++ {
+		result.Attempts = attempt
+		attemptCtx, cancel := context.WithTimeout(ctx, options.timeout)
+		stdout, stderr, exitCode, err := runRemote(attemptCtx, options, host)
+		timedOut := errors.Is(attemptCtx.Err(), context.DeadlineExceeded)
+		cancel()
+
+		*result = FleetHostResult{Host: host, Attempts: attempt, ExitCode: exitCode}
+		var retryable bool
+		switch {
+		case timedOut:
+			result.Error = fmt.Sprintf("timed out after %v", options.timeout)
+			result.unreachable = true
+			retryable = options.retryTimeouts
+		case err != nil:
+			result.Error = err.Error()
+			result.unreachable = true
+			retryable = true
+		case exitCode == sshExitCodeError:
+			result.Error = fmt.Sprintf("ssh failed: %v", firstLine(stderr))
+			result.unreachable = true
+			retryable = true
+		default:
+			if err := options.decode(result, stdout, stderr); err != nil {
+				result.Error = fmt.Sprintf("cannot parse output of rhc: %v", err)
+				if line := firstLine(stderr); line != "" {
+					result.Error = line
+				}
+			}
+		}
+
+		if !retryable || attempt > options.retries || ctx.Err() != nil {
+			return result
+		}
+		select {
+		case <-time.After(time.Duration(attempt) * options.retryDelay):
+		case <-ctx.Done():
+			return result
+		}
+	}
+}
+
+// runFleet runs the command on all hosts, at most options.parallel hosts at
+// once. Results are passed to report in the order the hosts finish; report is
+// never called concurrently. Hosts, which have not been started when ctx is
+// done, are skipped.
+func runFleet(ctx context.Context, hosts []string, options *fleetOptions, report func(result *FleetHostResult)) {
+	queue := make(chan string)
+	results := make(chan *FleetHostResult)
+
+	workers := options.parallel
+	if workers > len(hosts) {
+		workers = len(hosts)
+	}
+	var wg sync.WaitGroup
+	for i := 0; i < workers; i++ {
+		wg.Add(1)
+		go func() {
+			defer wg.Done()
+			for host := range queue {
+				results <- runFleetHost(ctx, options, host)
+			}
+		}()
+	}
+	go func() {
+		defer close(queue)
+		for _, host := range hosts {
+			select {
+			case queue <- host:
+			case <-ctx.Done():
+				return
+			}
+		}
+	}()
+	go func() {
+		wg.Wait()
+		close(results)
+	}()
+
+	for result := range results {
+		report(result)
+	}
+}
+
+// decodeFleetStatus parses the output of `rhc status --format json`.
+func decodeFleetStatus(result *FleetHostResult, stdout, stderr []byte) error {
+	var status SystemStatus
+	if err := json.Unmarshal(stdout, &status); err != nil {
+		return err
+	}
+	result.Status = &status
+	return nil
+}
+
+// decodeFleetConnect parses the output of `rhc connect --format json`. The
+// document is printed as the exit message, so it can be in standard error.
+func decodeFleetConnect(result *FleetHostResult, stdout, stderr []byte) error {
+	output := stdout
+	if len(bytes.TrimSpace(output)) == 0 {
+		output = stderr
+	}
+	var connect ConnectResult
+	if err := json.Unmarshal(output, &connect); err != nil {
+		return err
+	}
+	result.Connect = &connect
+	return nil
+}
+
+// beforeFleetAction checks the options common to all fleet commands.
+func beforeFleetAction(ctx *cli.Context) error {
+	if ctx.String("hosts") == "" {
+		return cli.Exit("--hosts is required", ExitCodeUsage)
+	}
+	if ctx.Int("parallel") < 1 {
+		return cli.Exit("--parallel must be at least 1", ExitCodeUsage)
+	}
+	if ctx.Int("retries") < 0 {
+		return cli.Exit("--retries must not be negative", ExitCodeUsage)
+	}
+	return checkForUnknownArgs(ctx)
+}
+
+// beforeFleetConnectAction checks the options of `fleet connect`.
+func beforeFleetConnectAction(ctx *cli.Context) error {
+	if err := beforeFleetAction(ctx); err != nil {
+		return err
+	}
+	if ctx.String("organization") == "" || len(ctx.StringSlice("activation-key")) == 0 {
+		return cli.Exit("--organization and --activation-key are required", ExitCodeUsage)
+	}
+	enabledFeatures := ctx.StringSlice("enable-feature")
+	disabledFeatures := ctx.StringSlice("disable-feature")
+	return checkFeatureInput(&enabledFeatures, &disabledFeatures)
+}
+
+// fleetAction runs the remote command on all hosts given by --hosts and prints
+// the result of every host as a line of NDJSON, as soon as the host finishes.
+// The last line is the summary. The exit code is 1, when the command did not
+// succeed on all hosts.
+func fleetAction(ctx *cli.Context, options *fleetOptions) error {
+	hosts, err := readHosts(ctx.String("hosts"))
+	if err != nil {
+		return cli.Exit(fmt.Errorf("cannot read hosts: %w", err), ExitCodeNoInput)
+	}
+
+	options.ssh = ctx.String("ssh")
+	options.sshOptions = ctx.StringSlice("ssh-option")
+	options.parallel = ctx.Int("parallel")
+	options.timeout = ctx.Duration("timeout")
+	options.retries = ctx.Int("retries")
+	options.retryDelay = ctx.Duration("retry-delay")
+	if ctx.Bool("sudo") {
+		options.command = append([]string{"sudo", "-n"}, options.command...)
+	}
+
+	// Interrupted run kills running attempts and still prints the summary
+	runCtx, stop := signal.NotifyContext(context.Background(), syscall.SIGINT, syscall.SIGTERM)
+	defer stop()
+
+	encoder := json.NewEncoder(os.Stdout)
+	summary := FleetSummary{Connected: make(map[string]int)}
+	start := time.Now()
+	runFleet(runCtx, hosts, options, func(result *FleetHostResult) {
+		summary.add(result)
+		if err := encoder.Encode(result); err != nil {
+			fmt.Fprintf(os.Stderr, "cannot write result of %v: %v\n", result.Host, err)
+		}
+	})
+	summary.DurationMs = time.Since(start).Milliseconds()
+	if err := encoder.Encode(struct {
+		Summary FleetSummary `json:"summary"`
+	}{summary}); err != nil {
+		return cli.Exit(err, 1)
+	}
+
+	if summary.Succeeded != len(hosts) {
+		return cli.Exit("", 1)
+	}
+	return nil
+}
+
+// fleetStatusAction runs `rhc status` on all hosts.
+func fleetStatusAction(ctx *cli.Context) error {
+	return fleetAction(ctx, &fleetOptions{
+		command:       []string{ShortName, "status", "--format", "json"},
+		retryTimeouts: true,
+		decode:        decodeFleetStatus,
+	})
+}
+
+// fleetConnectAction runs `rhc connect` with an activation key on all hosts.
+// Attempts, which timed out, are not retried, because connect could have
+// finished on the host.
+func fleetConnectAction(ctx *cli.Context) error {
+	command := []string{ShortName, "connect", "--format", "json", "--organization", ctx.String("organization")}
+	for _, key := range ctx.StringSlice("activation-key") {
+		command = append(command, "--activation-key", key)
+	}
+	for _, template := range ctx.StringSlice("content-template") {
+		command = append(command, "--content-template", template)
+	}
+	for _, feature := range ctx.StringSlice("enable-feature") {
+		command = append(command, "--enable-feature", feature)
+	}
+	for _, feature := range ctx.StringSlice("disable-feature") {
+		command = append(command, "--disable-feature", feature)
+	}
+	return fleetAction(ctx, &fleetOptions{
+		command:       command,
+		retryTimeouts: false,
+		decode:        decodeFleetConnect,
+	})
+}
@@ -0,0 +1,219 @@
+package main
+
+import (
+	"context"
+	"os"
+	"os/exec"
+	"path/filepath"
+	"strings"
+	"testing"
+	"time"
+
+	"github.com/google/go-cmp/cmp"
+)
+
+// fakeSSH is a stand-in for ssh. The behavior depends on the host name.
+const fakeSSH = `#!/bin/sh
+while [ "$1" = "-o" ]; do shift 2; done
+host=$1
+echo "$host" >> "$DIR/log"
+case "$host" in
+connected)
+    echo '{"hostname":"connected","rhsm_connected":true,"insights_connected":true,"yggdrasil_running":true}'
+    ;;
+disconnected)
+    echo '{"hostname":"disconnected","rhsm_connected":false,"insights_connected":false,"yggdrasil_running":false}'
+    exit 1
+    ;;
+down)
+    echo "ssh: connect to host down port 22: Connection refused" >&2
+    exit 255
+    ;;
+flaky)
+    if [ ! -e "$DIR/flaky" ]; then
+        touch "$DIR/flaky"
+        exit 255
+    fi
+    echo '{"hostname":"flaky","rhsm_connected":true,"insights_connected":false,"yggdrasil_running":false}'
+    ;;
+slow)
+    sleep 30
+    ;;
+broken)
+    echo "error: rhc: command not found" >&2
+    exit 127
+    ;;
+local)
+    echo "$@" > "$DIR/args"
+    shift
+    exec "$@"
+    ;;
+esac
+`
+
+func setupFakeSSH(t *testing.T) (ssh string, dir string) {
+	dir = t.TempDir()
+	ssh = filepath.Join(dir, "ssh")
+	script := strings.Replace(fakeSSH, "#!/bin/sh\n", "#!/bin/sh\nDIR="+dir+"\n", 1)
+	if err := os.WriteFile(ssh, []byte(script), 0755); err != nil {
+		t.Fatal(err)
+	}
+	return ssh, dir
+}
+
+func TestRunFleet(t *testing.T) {
+	ssh, dir := setupFakeSSH(t)
+	options := &fleetOptions{
+		ssh:           ssh,
+		command:       []string{"rhc", "status", "--format", "json"},
+		parallel:      3,
+		timeout:       500 * time.Millisecond,
+		retries:       2,
+		retryDelay:    time.Millisecond,
+		retryTimeouts: false,
+		decode:        decodeFleetStatus,
+	}
+	hosts := []string{"connected", "disconnected", "down", "flaky", "slow", "broken"}
+
+	start := time.Now()
+	got := make(map[string]*FleetHostResult)
+	summary := FleetSummary{Connected: make(map[string]int)}
+	runFleet(context.Background(), hosts, options, func(result *FleetHostResult) {
+		got[result.Host] = result
+		summary.add(result)
+	})
+	if elapsed := time.Since(start); elapsed > 10*time.Second {
+		t.Fatalf("slow host was not stopped after timeout: %v", elapsed)
+	}
+
+	tests := []struct {
+		host          string
+		wantAttempts  int
+		wantExitCode  int
+		wantError     string
+		wantConnected bool
+	}{
+		{host: "connected", wantAttempts: 1, wantConnected: true},
+		{host: "disconnected", wantAttempts: 1, wantExitCode: 1},
+		{host: "down", wantAttempts: 3, wantExitCode: 255, wantError: "ssh failed: ssh: connect to host down port 22: Connection refused"},
+		{host: "flaky", wantAttempts: 2, wantConnected: true},
+		{host: "slow", wantAttempts: 1, wantExitCode: -1, wantError: "timed out after 500ms"},
+		{host: "broken", wantAttempts: 1, wantExitCode: 127, wantError: "error: rhc: command not found"},
+	}
+	for _, test := range tests {
+		t.Run(test.host, func(t *testing.T) {
+			result := got[test.host]
+			if result == nil {
+				t.Fatal("no result")
+			}
+			if result.Attempts != test.wantAttempts {
+				t.Errorf("got %v attempts, want %v", result.Attempts, test.wantAttempts)
+			}
+			if result.ExitCode != test.wantExitCode {
+				t.Errorf("got exit code %v, want %v", result.ExitCode, test.wantExitCode)
+			}
+			if result.Error != test.wantError {
+				t.Errorf("got error %q, want %q", result.Error, test.wantError)
+			}
+			connected := result.Status != nil && result.Status.RHSMConnected
+			if connected != test.wantConnected {
+				t.Errorf("got connected %v, want %v", connected, test.wantConnected)
+			}
+		})
+	}
+
+	wantSummary := FleetSummary{
+		Hosts:       6,
+		Succeeded:   2,
+		Failed:      2,
+		Unreachable: 2,
+		Retried:     2,
+		Connected:   map[string]int{"rhsm": 2, "insights": 1, ServiceName: 1},
+	}
+	if diff := cmp.Diff(wantSummary, summary); diff != "" {
+		t.Errorf("unexpected summary: %v", diff)
+	}
+
+	data, err := os.ReadFile(filepath.Join(dir, "log"))
+	if err != nil {
+		t.Fatal(err)
+	}
+	if calls := strings.Count(string(data), "\n"); calls != 9 {
+		t.Errorf("ssh was run %v times, want 9", calls)
+	}
+}
+
+func TestRunFleetSerial(t *testing.T) {
+	ssh, _ := setupFakeSSH(t)
+	options := &fleetOptions{
+		ssh:      ssh,
+		command:  []string{"rhc", "status", "--format", "json"},
+		parallel: 1,
+		timeout:  5 * time.Second,
+		decode:   decodeFleetStatus,
+	}
+	hosts := []string{"disconnected", "connected", "broken", "connected"}
+
+	var got []string
+	runFleet(context.Background(), hosts, options, func(result *FleetHostResult) {
+		got = append(got, result.Host)
+	})
+	if diff := cmp.Diff(hosts, got); diff != "" {
+		t.Errorf("hosts were not processed one by one: %v", diff)
+	}
+}
+
+func TestRunRemoteStdin(t *testing.T) {
+	ssh, dir := setupFakeSSH(t)
+	options := &fleetOptions{
+		ssh:     ssh,
+		command: []string{"printf", "%s\n", "it's a key"},
+	}
+	stdout, stderr, exitCode, err := runRemote(context.Background(), options, "local")
+	if err != nil || exitCode != 0 {
+		t.Fatalf("command failed with exit code %v: %v: %s", exitCode, err, stderr)
+	}
+	if got := string(stdout); got != "it's a key\n" {
+		t.Errorf("got output %q", got)
+	}
+	args, err := os.ReadFile(filepath.Join(dir, "args"))
+	if err != nil {
+		t.Fatal(err)
+	}
+	if strings.Contains(string(args), "key") {
+		t.Errorf("command was passed in arguments of ssh: %s", args)
+	}
+}
+
+func TestShellQuote(t *testing.T) {
+	words := []string{"rhc", "connect", "--activation-key", "it's a key", "$HOME", ""}
+	output, err := exec.Command("sh", "-c", "printf '%s\\n' "+shellQuote(words)).Output()
+	if err != nil {
+		t.Fatal(err)
+	}
+	if diff := cmp.Diff(words, strings.Split(strings.TrimSuffix(string(output), "\n"), "\n")); diff != "" {
+		t.Errorf("words were changed by the shell: %v", diff)
+	}
+}
+
+func TestReadHosts(t *testing.T) {
+	filename := filepath.Join(t.TempDir(), "hosts")
+	content := "# lab\nhost1.example.com\n\n  root@host2  \n"
+	if err := os.WriteFile(filename, []byte(content), 0644); err != nil {
+		t.Fatal(err)
+	}
+	got, err := readHosts(filename)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if diff := cmp.Diff([]string{"host1.example.com", "root@host2"}, got); diff != "" {
+		t.Errorf("unexpected hosts: %v", diff)
+	}
+
+	if err := os.WriteFile(filename, []byte("-oProxyCommand=evil\n"), 0644); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := readHosts(filename); err == nil {
+		t.Error("host looking like an option was accepted")
+	}
+}
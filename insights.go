@@ -1,42 +1,135 @@
 package main
 
 import (
+	"context"
 	"errors"
 	"io/fs"
 	"os"
 	"os/exec"
+	"strings"
+
+	"github.com/redhatinsights/rhc/internal/trace"
+	"github.com/subpop/go-log"
+)
+
+// Paths of insights-client and of the files it keeps its registration state in.
+var (
+	insightsClientPath       = "/usr/bin/insights-client"
+	insightsRegisteredFile   = "/etc/insights-client/.registered"
+	insightsUnregisteredFile = "/etc/insights-client/.unregistered"
+	insightsMachineIDFile    = "/etc/insights-client/machine-id"
 )
 
-func registerInsights() error {
-	cmd := exec.Command("/usr/bin/insights-client", "--register")
+// insightsStatusFromClient forces insightsIsRegistered to run
+// `insights-client --status` instead of reading the marker files. It is set
+// by the --insights-client-status option.
+var insightsStatusFromClient = false
 
-	return cmd.Run()
+// runInsightsClient runs insights-client with given arguments in a span.
+func runInsightsClient(ctx context.Context, args ...string) error {
+	return trace.Run(ctx, "exec insights-client "+strings.Join(args, " "), func(ctx context.Context) error {
+		return exec.CommandContext(ctx, insightsClientPath, args...).Run()
+	})
 }
 
-func unregisterInsights() error {
-	cmd := exec.Command("/usr/bin/insights-client", "--unregister")
+// statFile returns information about the file in a span.
+func statFile(ctx context.Context, filename string) (fs.FileInfo, error) {
+	var info fs.FileInfo
+	err := trace.Run(ctx, "stat "+filename, func(ctx context.Context) error {
+		var err error
+		info, err = os.Stat(filename)
+		return err
+	})
+	return info, err
+}
+
+func registerInsights(ctx context.Context) error {
+	return runInsightsClient(ctx, "--register")
+}
 
-	return cmd.Run()
+func unregisterInsights(ctx context.Context) error {
+	return runInsightsClient(ctx, "--unregister")
 }
 
 // insightsIsRegistered checks whether insights-client reports its
 // status as registered or not. If the system is registered, `true` is
 // returned, otherwise `false` is returned, and `error` is filled with
 // an error value.
-func insightsIsRegistered() (bool, error) {
+//
+// The state is read from the marker files of insights-client, and
+// insights-client is run only when the files do not decide the state, or when
+// insightsStatusFromClient is set.
+func insightsIsRegistered(ctx context.Context) (bool, error) {
+	if !insightsStatusFromClient {
+		if isRegistered, ok := insightsMarkerStatus(ctx); ok {
+			return isRegistered, nil
+		}
+		log.Debug("registration state of insights-client is ambiguous, running insights-client --status")
+	}
+	return insightsClientStatus(ctx)
+}
+
+// fileExists returns true or false, when the file exists or does not exist.
+// The second returned value is false, when it cannot be decided.
+func fileExists(ctx context.Context, filename string) (exists bool, ok bool) {
+	_, err := statFile(ctx, filename)
+	if err == nil {
+		return true, true
+	}
+	if errors.Is(err, fs.ErrNotExist) {
+		return false, true
+	}
+	log.Debugf("cannot check %v: %v", filename, err)
+	return false, false
+}
+
+// insightsMarkerStatus decides the registration state from the files
+// insights-client writes on registration and unregistration, without running
+// insights-client. The second returned value is false, when the files are
+// ambiguous: both markers exist, the machine ID exists without any marker, or
+// any of the files cannot be checked.
+func insightsMarkerStatus(ctx context.Context) (isRegistered bool, ok bool) {
+	registered, ok := fileExists(ctx, insightsRegisteredFile)
+	if !ok {
+		return false, false
+	}
+	unregistered, ok := fileExists(ctx, insightsUnregisteredFile)
+	if !ok {
+		return false, false
+	}
+	switch {
+	case registered && !unregistered:
+		return true, true
+	case unregistered && !registered:
+		return false, true
+	case registered && unregistered:
+		return false, false
+	}
+	// No marker exists. insights-client has never registered the system,
+	// unless it left its machine ID behind.
+	machineID, ok := fileExists(ctx, insightsMachineIDFile)
+	if !ok || machineID {
+		return false, false
+	}
+	return false, true
+}
+
+// insightsClientStatus runs `insights-client --status` to detect the
+// registration state.
+func insightsClientStatus(ctx context.Context) (bool, error) {
 	// While `insights-client --status` properly checks for registration status by
 	// asking Inventory, its two modes (legacy v. non-legacy API) behave
 	// differently (they return different texts with different exit codes) and
 	// we can't rely on the output or exit codes.
 	// The `.registered` file is always present on a registered system.
-	err := exec.Command("/usr/bin/insights-client", "--status").Run()
+	err := runInsightsClient(ctx, "--status")
 	if err != nil {
 		var exitError *exec.ExitError
 		if errors.As(err, &exitError) {
 			// If .unregistered exists, insights-client is confident
 			// it is not registered. We can suppress the error,
 			// we don't care why it returned non-zero exit code.
-			_, err := os.Stat("/etc/insights-client/.unregistered")
+			_, err := statFile(ctx, insightsUnregisteredFile)
 			if err == nil {
 				return false, nil
 			}
@@ -44,7 +137,7 @@ func insightsIsRegistered() (bool, error) {
 		return false, err
 	}
 
-	_, err = os.Stat("/etc/insights-client/.registered")
+	_, err = statFile(ctx, insightsRegisteredFile)
 	if errors.Is(err, fs.ErrNotExist) {
 		return false, nil
 	}
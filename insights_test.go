@@ -0,0 +1,133 @@
+package main
+
+import (
+	"context"
+	"os"
+	"path/filepath"
+	"testing"
+)
+
+// setupInsightsFiles points the paths of insights-client and its state files
+// to a temporary directory, and creates the given state files there. The fake
+// insights-client records that it was run and exits with given status.
+func setupInsightsFiles(t testing.TB, files []string, clientStatus string) (ranFile string) {
+	dir := t.TempDir()
+	saved := []string{insightsClientPath, insightsRegisteredFile, insightsUnregisteredFile, insightsMachineIDFile}
+	t.Cleanup(func() {
+		insightsClientPath, insightsRegisteredFile, insightsUnregisteredFile, insightsMachineIDFile =
+			saved[0], saved[1], saved[2], saved[3]
+	})
+
+	insightsRegisteredFile = filepath.Join(dir, ".registered")
+	insightsUnregisteredFile = filepath.Join(dir, ".unregistered")
+	insightsMachineIDFile = filepath.Join(dir, "machine-id")
+	for _, file := range files {
+		if err := os.WriteFile(filepath.Join(dir, file), nil, 0644); err != nil {
+			t.Fatal(err)
+		}
+	}
+
+	ranFile = filepath.Join(dir, "ran")
+	insightsClientPath = filepath.Join(dir, "insights-client")
+	script := "#!/bin/sh\ntouch " + ranFile + "\nexit " + clientStatus + "\n"
+	if err := os.WriteFile(insightsClientPath, []byte(script), 0755); err != nil {
+		t.Fatal(err)
+	}
+	return ranFile
+}
+
+func TestInsightsIsRegistered(t *testing.T) {
+	tests := []struct {
+		description  string
+		files        []string
+		clientStatus string
+		fromClient   bool
+		want         bool
+		wantClient   bool
+	}{
+		{
+			description: "registered",
+			files:       []string{".registered", "machine-id"},
+			want:        true,
+		},
+		{
+			description: "unregistered",
+			files:       []string{".unregistered"},
+			want:        false,
+		},
+		{
+			description: "never registered",
+			want:        false,
+		},
+		{
+			description:  "both markers",
+			files:        []string{".registered", ".unregistered"},
+			clientStatus: "1",
+			want:         false,
+			wantClient:   true,
+		},
+		{
+			description:  "machine ID without markers",
+			files:        []string{"machine-id"},
+			clientStatus: "0",
+			want:         false,
+			wantClient:   true,
+		},
+		{
+			description:  "forced insights-client",
+			files:        []string{".registered"},
+			clientStatus: "0",
+			fromClient:   true,
+			want:         true,
+			wantClient:   true,
+		},
+	}
+
+	for _, test := range tests {
+		t.Run(test.description, func(t *testing.T) {
+			clientStatus := test.clientStatus
+			if clientStatus == "" {
+				clientStatus = "0"
+			}
+			ranFile := setupInsightsFiles(t, test.files, clientStatus)
+			insightsStatusFromClient = test.fromClient
+			defer func() { insightsStatusFromClient = false }()
+
+			got, err := insightsIsRegistered(context.Background())
+			if err != nil {
+				t.Fatal(err)
+			}
+			if got != test.want {
+				t.Errorf("got %v, want %v", got, test.want)
+			}
+			_, err = os.Stat(ranFile)
+			if ran := err == nil; ran != test.wantClient {
+				t.Errorf("insights-client was run: %v, want %v", ran, test.wantClient)
+			}
+		})
+	}
+}
+
+// BenchmarkInsightsIsRegistered compares reading the marker files with running
+// insights-client. The fake insights-client is a shell script, so the second
+// result is only a lower bound of the cost of the real Python program.
+func BenchmarkInsightsIsRegistered(b *testing.B) {
+	setupInsightsFiles(b, []string{".registered", "machine-id"}, "0")
+	defer func() { insightsStatusFromClient = false }()
+
+	for _, fromClient := range []bool{false, true} {
+		name := "native"
+		if fromClient {
+			name = "insights-client"
+		}
+		b.Run(name, func(b *testing.B) {
+			insightsStatusFromClient = fromClient
+			b.ReportAllocs()
+			for i := 0; i < b.N; i++ {
+				if _, err := insightsIsRegistered(context.Background()); err != nil {
+					b.Fatal(err)
+				}
+			}
+		})
+	}
+}
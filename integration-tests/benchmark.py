@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+"""
+Latency benchmark of rhc commands. Every command is run repeatedly against
+the fake system (see the fakes package), so the results do not depend on
+any server. Wall time percentiles, numbers of executed processes and
+numbers of D-Bus calls of fake RHSM and systemd are written as JSON.
+
+Run the benchmark and save the results:
+
+    sudo RHC_BINARY=./builddir/rhc python3 integration-tests/benchmark.py \\
+        run --iterations 50 --output results.json
+
+Measure the startup cost of rhc: the time until rhc prints the first output
+and the peak resident memory. It runs rhc directly on the host, it does not
+need root and it does not change the system:
+
+    RHC_BINARY=./builddir/rhc python3 integration-tests/benchmark.py \\
+        startup --iterations 50 --output startup.json
+
+Compare the results with a baseline; exit code is 1 when any command got
+slower by more than the threshold, or when it runs more processes, makes
+more D-Bus calls or uses more memory than before:
+
+    python3 integration-tests/benchmark.py compare baseline.json results.json --threshold 0.2
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import FakeSystem, missing_requirements, rhc_binary
+
+CREDENTIALS = ("--username", "admin", "--password", "secret")
+
+# Compared latency metrics
+METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def prepare_disconnected(system):
+    system.reset()
+
+
+def prepare_connected(system):
+    system.reset()
+    system.run_rhc("connect", *CREDENTIALS)
+
+
+def prepare_cached(system):
+    if not system.rhsm.is_registered:
+        prepare_connected(system)
+    # Ensures the cached status exists, it is a cache hit after the first run
+    system.run_rhc("status")
+
+
+# Benchmarked commands: name -> (arguments of rhc, preparation of the system).
+# The preparation is run before every iteration and it is not measured.
+SCENARIOS = {
+    "status-disconnected": (("status", "--no-cache"), prepare_disconnected),
+    "status-connected": (("status", "--no-cache"), prepare_connected),
+    "status-cached": (("status",), prepare_cached),
+    "connect": (("connect",) + CREDENTIALS, prepare_disconnected),
+    "disconnect": (("disconnect",), prepare_connected),
+}
+
+
+# Commands measured by the startup benchmark: name -> arguments of rhc. The
+# status probes run after the first line is printed, so they do not affect
+# the time to the first output.
+STARTUP_COMMANDS = {
+    "startup-version": ("--version",),
+    "startup-status": ("status", "--no-cache"),
+    "startup-canonical-facts": ("canonical-facts",),
+}
+
+
+def percentiles(samples):
+    """:return: dictionary with p50, p95 and p99 of the samples"""
+    if len(samples) == 1:
+        return {metric: samples[0] for metric in METRICS}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50_ms": cuts[49], "p95_ms": cuts[94], "p99_ms": cuts[98]}
+
+
+def count_processes(system, args):
+    """Runs rhc once under strace and counts the programs it executed
+    :return: number of executed programs or None, when strace is missing
+    """
+    if shutil.which("strace") is None:
+        return None
+    with tempfile.NamedTemporaryFile("r") as trace:
+        system.run_rhc(
+            *args, check=False,
+            wrapper=["strace", "-f", "-qq", "-e", "trace=execve", "-e", "signal=none", "-o", trace.name],
+        )
+        # The first execve is rhc itself
+        executed = [line for line in trace if "execve(" in line and "= 0" in line]
+        return max(len(executed) - 1, 0)
+
+
+def benchmark(system, args, prepare, iterations):
+    samples = []
+    for _ in range(iterations):
+        prepare(system)
+        rhsm_calls = len(system.rhsm.calls)
+        systemd_calls = len(system.systemd.calls)
+        start = time.monotonic()
+        system.run_rhc(*args, check=False)
+        samples.append((time.monotonic() - start) * 1000)
+        dbus_calls = {
+            "rhsm": len(system.rhsm.calls) - rhsm_calls,
+            "systemd": len(system.systemd.calls) - systemd_calls,
+        }
+    # Processes are counted in a separate run, strace would distort the times
+    prepare(system)
+    result = {
+        "iterations": iterations,
+        "samples_ms": samples,
+        "mean_ms": statistics.mean(samples),
+        **percentiles(samples),
+        "processes": count_processes(system, args),
+        "dbus_calls": dbus_calls,
+    }
+    return result
+
+
+def measure_startup(args):
+    """Runs rhc once
+    :return: milliseconds until the first byte of output, and peak resident
+        memory of rhc in KiB
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [rhc_binary(), *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=dict(os.environ, NO_COLOR="1"),
+    )
+    process.stdout.read(1)
+    first_output = (time.monotonic() - start) * 1000
+    process.stdout.read()
+    process.stdout.close()
+    # wait4 reports the resource usage of this child only
+    _pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return first_output, usage.ru_maxrss
+
+
+def startup(options):
+    if options.iterations < 1:
+        sys.exit("at least one iteration is required")
+    if rhc_binary() is None:
+        sys.exit("cannot run benchmark: rhc binary not found, set RHC_BINARY")
+    results = {"rhc": rhc_binary(), "commands": {}}
+    for name, args in STARTUP_COMMANDS.items():
+        if options.command and name not in options.command:
+            continue
+        samples, memory = [], []
+        for _ in range(options.iterations):
+            first_output, max_rss = measure_startup(args)
+            samples.append(first_output)
+            memory.append(max_rss)
+        result = {
+            "iterations": options.iterations,
+            "samples_ms": samples,
+            "mean_ms": statistics.mean(samples),
+            **percentiles(samples),
+            "max_rss_kib": max(memory),
+        }
+        results["commands"][name] = result
+        print(
+            f"{name:24} first output p50 {result['p50_ms']:6.1f} ms  p95 {result['p95_ms']:6.1f} ms  "
+            f"p99 {result['p99_ms']:6.1f} ms  max RSS {result['max_rss_kib']} KiB"
+        )
+    with open(options.output, "w") as output:
+        json.dump(results, output, indent=2)
+        output.write("\n")
+
+
+def run(options):
+    if options.iterations < 1:
+        sys.exit("at least one iteration is required")
+    reason = missing_requirements()
+    if reason:
+        sys.exit(f"cannot run benchmark: {reason}")
+    results = {"rhc": rhc_binary(), "commands": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        system = FakeSystem(directory).start()
+        try:
+            for name, (args, prepare) in SCENARIOS.items():
+                if options.command and name not in options.command:
+                    continue
+                result = benchmark(system, args, prepare, options.iterations)
+                results["commands"][name] = result
+                print(
+                    f"{name:20} p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+                    f"p99 {result['p99_ms']:8.1f} ms  processes {result['processes']}  "
+                    f"D-Bus calls {result['dbus_calls']}"
+                )
+        finally:
+            system.stop()
+    with open(options.output, "w") as output:
+        json.dump(results, output, indent=2)
+        output.write("\n")
+
+
+def compare(options):
+    with open(options.baseline) as baseline_file:
+        baseline = json.load(baseline_file)["commands"]
+    with open(options.results) as results_file:
+        results = json.load(results_file)["commands"]
+
+    regressions = []
+    for name in sorted(set(baseline) & set(results)):
+        old, new = baseline[name], results[name]
+        for metric in METRICS:
+            change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            print(f"{name:20} {metric:7} {old[metric]:8.1f} -> {new[metric]:8.1f} ms ({change:+.1%})")
+            if change > options.threshold:
+                regressions.append(f"{name}: {metric} increased by {change:.1%}")
+        if None not in (old.get("processes"), new.get("processes")) and new["processes"] > old["processes"]:
+            regressions.append(f"{name}: executed processes increased from {old['processes']} to {new['processes']}")
+        if "max_rss_kib" in old and "max_rss_kib" in new:
+            change = (new["max_rss_kib"] - old["max_rss_kib"]) / old["max_rss_kib"] if old["max_rss_kib"] else 0.0
+            print(f"{name:20} max RSS {old['max_rss_kib']:8} -> {new['max_rss_kib']:8} KiB ({change:+.1%})")
+            if change > options.threshold:
+                regressions.append(f"{name}: max RSS increased by {change:.1%}")
+        old_dbus_calls = old.get("dbus_calls", {})
+        for service, calls in new.get("dbus_calls", {}).items():
+            if calls > old_dbus_calls.get(service, 0):
+                regressions.append(
+                    f"{name}: D-Bus calls of {service} increased from "
+                    f"{old_dbus_calls.get(service, 0)} to {calls}"
+                )
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency benchmark of rhc commands")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run benchmark and write JSON results")
+    run_parser.add_argument("--iterations", type=int, default=20, help="runs of every command")
+    run_parser.add_argument("--output", default="benchmark.json", help="file with results")
+    run_parser.add_argument(
+        "--command", action="append", choices=sorted(SCENARIOS),
+        help="benchmark only this command (can be used more times)",
+    )
+
+    startup_parser = subparsers.add_parser("startup", help="measure time to first output and memory of rhc")
+    startup_parser.add_argument("--iterations", type=int, default=20, help="runs of every command")
+    startup_parser.add_argument("--output", default="startup.json", help="file with results")
+    startup_parser.add_argument(
+        "--command", action="append", choices=sorted(STARTUP_COMMANDS),
+        help="measure only this command (can be used more times)",
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="compare results with a baseline")
+    compare_parser.add_argument("baseline", help="results of the baseline")
+    compare_parser.add_argument("results", help="compared results")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.2,
+        help="allowed relative increase of latency and memory (default: 0.2, i.e. 20%%)",
+    )
+
+    options = parser.parse_args()
+    if options.action == "run":
+        run(options)
+        return 0
+    if options.action == "startup":
+        startup(options)
+        return 0
+    return compare(options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,85 @@
+import contextlib
+import os
 import pytest
 import subprocess
 import logging
 
+import timing
+from fakes import FakeSystem, missing_requirements
+from timing import TimedRhc, phase
+from utils import (
+    detect_service_name,
+    prepare_args_for_connect,
+    service_unit,
+    yggdrasil_service_is_active,
+)
+
 logger = logging.getLogger(__name__)
 
 
-def pytest_configure():
+def pytest_addoption(parser):
+    group = parser.getgroup("rhc")
+    group.addoption(
+        "--target",
+        action="append",
+        default=[],
+        metavar="[USER@]HOST",
+        help="run tests in a pytest-xdist worker on the host (VM or container "
+        "with sshd) over ssh, one worker is started for every target",
+    )
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_cmdline_main(config):
+    """Turns --target options into pytest-xdist workers. Tests, which change
+    the real system, can run in parallel only, when every worker has its own
+    system. Without targets all these tests are run by one worker, and only
+    tests using the fake system are spread across workers.
+    """
+    targets = config.getoption("target")
+    if targets:
+        if not config.pluginmanager.hasplugin("xdist"):
+            raise pytest.UsageError("--target requires pytest-xdist")
+        directory = os.path.dirname(os.path.abspath(__file__))
+        config.option.tx = [f"ssh={target}//python=python3" for target in targets]
+        config.option.rsyncdir = [directory]
+        if config.option.dist == "no":
+            # Tests of one module run by one worker, so they share the
+            # registration of the module.
+            config.option.dist = "loadscope"
+    elif getattr(config.option, "numprocesses", None) and config.option.dist == "no":
+        config.option.dist = "loadgroup"
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("target") or not config.pluginmanager.hasplugin("xdist"):
+        return
+    for item in items:
+        if "rhc" in item.fixturenames and "fake_system" not in item.fixturenames:
+            item.add_marker(pytest.mark.xdist_group("system"))
+
+
+def pytest_configure(config):
     """Setting the name of service available on the system with rhc installed
     Name of the service in upstream package is 'yggdrasil'
     and downstream is 'rhcd'
     """
-    proc = subprocess.run(
-        ["systemctl", "status", "yggdrasil"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
-    )
-    if "Unit yggdrasil.service could not be found" in proc.stderr:
-        pytest.service_name = "rhcd"
-    else:
+    config.pluginmanager.register(timing, "timing")
+    try:
+        pytest.service_name = detect_service_name()
+    except OSError:
+        # No system bus, only tests using the fake system can run
         pytest.service_name = "yggdrasil"
 
 
+@pytest.fixture(scope="session")
+def yggdrasil_service():
+    """SystemdUnit of yggdrasil/rhcd service using one D-Bus connection
+    for the whole test session
+    """
+    return service_unit()
+
+
 @pytest.fixture(scope="session", autouse=True)
 def install_katello_rpm(test_config):
     if "satellite" in test_config.environment:
@@ -39,3 +97,75 @@ def install_katello_rpm(test_config):
         cmd = "rpm -qa 'katello-ca-consumer*' | xargs rpm -e"
         subprocess.check_call(cmd, shell=True)
         logger.info("removing the katello rpm")
+
+
+@pytest.fixture(scope="session")
+def fake_system_session(tmp_path_factory):
+    """FakeSystem shared by tests of one pytest(-xdist) worker. Every worker
+    gets its own temporary directory, so workers do not share any state.
+    """
+    reason = missing_requirements()
+    if reason:
+        pytest.skip(f"fake system is not available: {reason}")
+    system = FakeSystem(tmp_path_factory.mktemp("fake-system")).start()
+    yield system
+    system.stop()
+
+
+@pytest.fixture
+def fake_system(fake_system_session):
+    """Disconnected FakeSystem with fake RHSM, systemd and insights-client"""
+    fake_system_session.reset()
+    return fake_system_session
+
+
+@pytest.fixture
+def rhc(rhc):
+    """rhc of pytest-client-tools, which records times of connect, disconnect
+    and status commands (see timing.py)
+    """
+    return TimedRhc(rhc)
+
+
+@pytest.fixture(scope="module")
+def shared_registration():
+    """Registration shared by tests of one module, which only need a connected
+    system. The system is disconnected after the last test of the module, so
+    every module starts from the same state, regardless of the order modules
+    are run by pytest-xdist workers.
+    """
+    registration = {"connected": False}
+    yield registration
+    if registration["connected"]:
+        with phase("disconnect"):
+            subprocess.run(["rhc", "disconnect"], check=False, capture_output=True)
+
+
+@pytest.fixture
+def connected_rhc(external_candlepin, rhc, test_config, shared_registration):
+    """rhc of a connected system. The system is connected only, when it is not
+    connected yet, so read-only tests of one module reuse one registration
+    instead of connecting again. The state is checked every time, so tests
+    disconnecting the system are followed by a new connect.
+    """
+    if rhc.is_registered and yggdrasil_service_is_active():
+        return rhc
+    with contextlib.suppress(Exception):
+        rhc.disconnect()
+    # rhc+satellite does not support basic auth for now
+    auth = "activation-key" if "satellite" in test_config.environment else "basic"
+    rhc.run("connect", *prepare_args_for_connect(test_config, auth=auth))
+    shared_registration["connected"] = True
+    return rhc
+
+
+@pytest.fixture
+def disconnected_rhc(rhc):
+    """rhc of a disconnected system. The system is disconnected only, when it
+    is connected, so tests following tests of failing connects do not run
+    disconnect again.
+    """
+    if rhc.is_registered or yggdrasil_service_is_active():
+        with contextlib.suppress(Exception):
+            rhc.disconnect()
+    return rhc
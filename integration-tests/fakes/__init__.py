@@ -0,0 +1,165 @@
+"""
+Local stand-ins for RHSM, systemd, insights-client and their servers. FakeSystem runs rhc
+against them, so connect, disconnect and status can be tested offline in
+seconds. Every FakeSystem has its own message bus and its own private view
+of /etc, /usr/bin and /var/cache, so tests using it can run in parallel
+under pytest-xdist.
+"""
+
+import os
+import shutil
+import subprocess
+
+from .dbus_service import PrivateBus
+from .rhsm import FakeRHSM
+from .server import FakeServer
+from .systemd import FakeSystemd
+
+INSIGHTS_CLIENT_STUB = os.path.join(os.path.dirname(__file__), "insights-client")
+
+# Directories of the host overlaid by writable per-system copies. rhc sees the
+# content of the host, but all changes are made in the copies.
+OVERLAID_DIRS = {
+    "etc": "/etc",
+    "bin": "/usr/bin",
+    "cache": "/var/cache",
+}
+
+# Configuration files pointing RHSM and insights-client to the fake server
+RHSM_CONF = """[server]
+hostname = 127.0.0.1
+port = {port}
+prefix = /candlepin
+"""
+INSIGHTS_CLIENT_CONF = """[insights-client]
+base_url = 127.0.0.1:{port}/r/insights
+auto_config = False
+"""
+
+MOUNT_SCRIPT = """
+set -e
+root=$1
+shift
+for dir in {dirs}; do
+    name=${{dir%%:*}}
+    target=${{dir#*:}}
+    mount -t overlay overlay \
+        -o "lowerdir=$target,upperdir=$root/$name/upper,workdir=$root/$name/work" "$target"
+done
+exec "$@"
+"""
+
+
+def missing_requirements():
+    """:return: reason why FakeSystem cannot be used here, or None"""
+    if os.geteuid() != 0:
+        return "rhc and overlay mounts require root"
+    for command in ("dbus-daemon", "unshare", "openssl"):
+        if shutil.which(command) is None:
+            return f"{command} is not installed"
+    if rhc_binary() is None:
+        return "rhc binary not found, set RHC_BINARY"
+    return None
+
+
+def rhc_binary():
+    """:return: path of the tested rhc binary"""
+    return os.environ.get("RHC_BINARY") or shutil.which("rhc")
+
+
+class FakeSystem:
+    """System with fake RHSM, systemd, insights-client and server"""
+
+    def __init__(self, directory):
+        """:param directory: empty directory owned by this system"""
+        self.directory = str(directory)
+        self.bus = PrivateBus(self.directory)
+        self.rhsm = FakeRHSM(self.directory)
+        self.systemd = FakeSystemd()
+        self.server = FakeServer(self.directory)
+        self.insights_log = os.path.join(self.directory, "insights-client.log")
+
+    def start(self):
+        self.bus.start()
+        self.rhsm.start(self.bus.address)
+        self.systemd.start(self.bus.address)
+        self.server.start()
+        self.reset()
+        return self
+
+    def stop(self):
+        self.server.stop()
+        self.systemd.stop()
+        self.rhsm.stop()
+        self.bus.stop()
+
+    def reset(self):
+        """Returns the system to the initial disconnected state"""
+        self.rhsm.reset()
+        self.systemd.reset()
+        for name in OVERLAID_DIRS:
+            for layer in ("upper", "work"):
+                path = os.path.join(self.directory, name, layer)
+                shutil.rmtree(path, ignore_errors=True)
+                os.makedirs(path)
+        shutil.copy(INSIGHTS_CLIENT_STUB, os.path.join(self.directory, "bin", "upper"))
+        self._write("/etc/rhsm/rhsm.conf", RHSM_CONF.format(port=self.server.port))
+        self._write(
+            "/etc/insights-client/insights-client.conf",
+            INSIGHTS_CLIENT_CONF.format(port=self.server.port),
+        )
+        open(self.insights_log, "w").close()
+
+    @property
+    def service_unit(self):
+        """:return: name of the yggdrasil/rhcd unit rhc manages"""
+        for name in ("yggdrasil.service", "rhcd.service"):
+            if name in self.systemd.units:
+                return name
+        return "rhcd.service"
+
+    @property
+    def insights_calls(self):
+        """:return: list of arguments insights-client was run with"""
+        with open(self.insights_log) as log:
+            return log.read().splitlines()
+
+    def path(self, path):
+        """:return: where the file rhc sees at path is stored, when rhc changed it"""
+        for name, target in OVERLAID_DIRS.items():
+            if path.startswith(target + "/"):
+                return os.path.join(self.directory, name, "upper", path[len(target) + 1:])
+        raise ValueError(f"{path} is not in an overlaid directory")
+
+    def _write(self, path, content):
+        """Writes the file, which rhc sees at path"""
+        filename = self.path(path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as file:
+            file.write(content)
+
+    def run_rhc(self, *args, check=True, timeout=60, wrapper=()):
+        """Runs rhc in a private mount namespace of this system
+        :param wrapper: command running rhc, e.g. strace with its arguments
+        :return: subprocess.CompletedProcess
+        """
+        dirs = " ".join(f"{name}:{target}" for name, target in OVERLAID_DIRS.items())
+        command = [
+            "unshare", "--mount", "--propagation", "private",
+            "sh", "-c", MOUNT_SCRIPT.format(dirs=dirs), "sh", self.directory,
+            *wrapper, rhc_binary(), *args,
+        ]
+        env = dict(
+            os.environ,
+            DBUS_SYSTEM_BUS_ADDRESS=self.bus.address,
+            FAKE_INSIGHTS_LOG=self.insights_log,
+        )
+        return subprocess.run(
+            command,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            timeout=timeout,
+            check=check,
+        )
@@ -0,0 +1,264 @@
+"""
+Building blocks of the fake D-Bus services: a private message bus used
+instead of the system bus, a base class of fake services, and a minimal
+peer-to-peer D-Bus server.
+"""
+
+import contextlib
+import itertools
+import os
+import socket
+import subprocess
+import threading
+import time
+import uuid
+
+from jeepney import (
+    DBusAddress,
+    HeaderFields,
+    MessageFlag,
+    MessageType,
+    new_error,
+    new_method_return,
+    new_signal,
+)
+from jeepney.bus_messages import message_bus
+from jeepney.io.blocking import open_dbus_connection
+from jeepney.low_level import Parser
+from jeepney.wrappers import unwrap_msg
+
+BUS_CONFIG = """<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>system</type>
+  <listen>unix:path={socket_path}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow user="*"/>
+    <allow own="*"/>
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+  </policy>
+</busconfig>
+"""
+
+
+class PrivateBus:
+    """dbus-daemon listening on a socket in the given directory. Its address
+    is passed to rhc in DBUS_SYSTEM_BUS_ADDRESS instead of the system bus.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.socket_path = os.path.join(self.directory, "system_bus_socket")
+        self.address = f"unix:path={self.socket_path}"
+        self._proc = None
+
+    def start(self):
+        config_path = os.path.join(self.directory, "bus.conf")
+        with open(config_path, "w") as config:
+            config.write(BUS_CONFIG.format(socket_path=self.socket_path))
+        with open(os.path.join(self.directory, "bus.log"), "w") as log:
+            self._proc = subprocess.Popen(
+                ["dbus-daemon", "--nofork", "--config-file", config_path, "--print-address"],
+                stdout=subprocess.PIPE,
+                stderr=log,
+            )
+        # The address is printed when the bus is ready to accept connections
+        self._proc.stdout.readline()
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc = None
+
+
+class MethodCallError(Exception):
+    """Raised by handlers of fake services to reply with a D-Bus error"""
+
+    def __init__(self, name, message):
+        super().__init__(message)
+        self.name = name
+        self.message = message
+
+
+class FakeService:
+    """Base class of fake D-Bus services. Subclasses set bus_name and
+    implement handle(), which returns the signature and the body of the
+    reply or raises MethodCallError. Signals emitted by a handler are sent
+    after the reply, like real services do. Methods listed in delays are
+    handled after the given number of seconds, like a slow server would.
+    """
+
+    bus_name = None
+
+    def __init__(self):
+        self.calls = []
+        self.delays = {}
+        self._lock = threading.Lock()
+        self._signals = []
+        self._connection = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def handle(self, path, interface, member, body):
+        raise NotImplementedError
+
+    def reset(self):
+        """Drops the recorded calls and delays, subclasses reset their state too"""
+        with self._lock:
+            self.calls.clear()
+            self.delays.clear()
+
+    def emit(self, path, interface, member, signature, body):
+        """Emits a signal, can be called only from handle()"""
+        address = DBusAddress(path, interface=interface)
+        self._signals.append(new_signal(address, member, signature, body))
+
+    def dispatch(self, msg):
+        """Calls the handler of a method call message
+        :return: list of messages to be sent as the response
+        """
+        fields = msg.header.fields
+        interface = fields.get(HeaderFields.interface)
+        member = fields[HeaderFields.member]
+        delay = self.delays.get(member)
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.calls.append(member)
+            self._signals = []
+            try:
+                signature, body = self.handle(fields[HeaderFields.path], interface, member, msg.body)
+                reply = new_method_return(msg, signature, body)
+            except MethodCallError as exc:
+                reply = new_error(msg, exc.name, "s", (exc.message,))
+            signals, self._signals = self._signals, []
+        if msg.header.flags & MessageFlag.no_reply_expected:
+            return signals
+        return [reply] + signals
+
+    def start(self, bus_address):
+        """Connects to the bus, takes the bus name and serves method calls"""
+        self._connection = open_dbus_connection(bus=bus_address)
+        unwrap_msg(self._connection.send_and_get_reply(message_bus.RequestName(self.bus_name)))
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._connection.close()
+            self._thread = None
+
+    def _serve(self):
+        while not self._stopping.is_set():
+            try:
+                msg = self._connection.receive(timeout=0.1)
+            except TimeoutError:
+                continue
+            except OSError:
+                return
+            if msg.header.message_type != MessageType.method_call:
+                continue
+            for response in self.dispatch(msg):
+                self._connection.send(response)
+
+
+class PeerServer:
+    """Peer-to-peer D-Bus server (without a message bus) passing method calls
+    to a FakeService. It implements just enough of the protocol for godbus
+    clients using Dial() and Auth(). Every method call is handled in its own
+    thread, so calls sent without waiting for replies overlap.
+    """
+
+    def __init__(self, service, socket_path):
+        self.service = service
+        self.socket_path = str(socket_path)
+        self.address = f"unix:path={self.socket_path}"
+        self._guid = uuid.uuid4().hex.encode()
+        self._socket = None
+
+    def start(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.socket_path)
+        self._socket.listen()
+        threading.Thread(target=self._accept, args=(self._socket,), daemon=True).start()
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+
+    def _accept(self, listener):
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _authenticate(self, conn):
+        """Performs the SASL handshake
+        :return: data received after BEGIN
+        """
+        data = b""
+        while True:
+            while b"\r\n" not in data:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    raise ConnectionError("client closed connection during authentication")
+                data += chunk
+            line, data = data.split(b"\r\n", 1)
+            line = line.lstrip(b"\0")
+            if line.startswith(b"AUTH EXTERNAL"):
+                conn.sendall(b"OK " + self._guid + b"\r\n")
+            elif line.startswith(b"AUTH"):
+                conn.sendall(b"REJECTED EXTERNAL\r\n")
+            elif line == b"NEGOTIATE_UNIX_FD":
+                conn.sendall(b"AGREE_UNIX_FD\r\n")
+            elif line == b"BEGIN":
+                return data
+            else:
+                conn.sendall(b"ERROR\r\n")
+
+    def _reply(self, conn, send_lock, serials, msg):
+        try:
+            for response in self.service.dispatch(msg):
+                if response.header.message_type != MessageType.signal:
+                    with send_lock:
+                        conn.sendall(response.serialise(serial=next(serials)))
+        except OSError:
+            # The client closed the connection without waiting for the reply
+            return
+
+    def _serve(self, conn):
+        serials = itertools.count(1)
+        send_lock = threading.Lock()
+        with conn:
+            try:
+                parser = Parser()
+                parser.add_data(self._authenticate(conn))
+                while True:
+                    msg = parser.get_next_message()
+                    if msg is None:
+                        data = conn.recv(65536)
+                        if not data:
+                            return
+                        parser.add_data(data)
+                        continue
+                    if msg.header.message_type != MessageType.method_call:
+                        continue
+                    threading.Thread(
+                        target=self._reply, args=(conn, send_lock, serials, msg), daemon=True
+                    ).start()
+            except OSError:
+                return
+
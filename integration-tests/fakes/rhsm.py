@@ -0,0 +1,129 @@
+"""
+Fake com.redhat.RHSM1 service. It keeps the registration state in memory
+and implements the methods used by rhc.
+"""
+
+import json
+import os
+import uuid
+
+from .dbus_service import FakeService, MethodCallError, PeerServer
+
+RHSM_ERROR = "com.redhat.RHSM1.Error"
+
+
+def rhsm_error(exception, message):
+    """Error in the format of RHSM: a JSON document describing the exception"""
+    document = {"exception": exception, "severity": "error", "message": message}
+    return MethodCallError(RHSM_ERROR, json.dumps(document))
+
+
+class FakeRHSM(FakeService):
+    """Fake RHSM accepting the given credentials. Register methods are served
+    on a peer-to-peer socket returned by RegisterServer.Start, like the real
+    RHSM does.
+    """
+
+    bus_name = "com.redhat.RHSM1"
+
+    def __init__(
+        self,
+        directory,
+        username="admin",
+        password="secret",
+        organizations=("donaldduck",),
+        activation_keys=("act-key",),
+    ):
+        super().__init__()
+        self.username = username
+        self.password = password
+        self.organizations = list(organizations)
+        self._default_organizations = list(organizations)
+        self.activation_keys = list(activation_keys)
+        self.uuid = ""
+        self.config = {}
+        self._register_server = PeerServer(self, os.path.join(str(directory), "rhsm-register"))
+
+    def reset(self):
+        super().reset()
+        with self._lock:
+            self.uuid = ""
+            self.config = {}
+            self.organizations = list(self._default_organizations)
+
+    def stop(self):
+        self._register_server.stop()
+        super().stop()
+
+    @property
+    def is_registered(self):
+        return self.uuid != ""
+
+    def _check_organization(self, organization):
+        if organization == "":
+            if len(self.organizations) > 1:
+                raise rhsm_error(
+                    "OrgNotSpecifiedException",
+                    "User is member of more organizations, but no organization was selected",
+                )
+        elif organization not in self.organizations:
+            raise rhsm_error("RestlibException", f"Organization {organization} does not exist.")
+
+    def _register(self):
+        if self.is_registered:
+            raise rhsm_error("Exception", "This system is already registered.")
+        self.uuid = str(uuid.uuid4())
+        return "s", (json.dumps({"uuid": self.uuid}),)
+
+    def handle(self, path, interface, member, body):
+        if interface == "com.redhat.RHSM1.Consumer" and member == "GetUuid":
+            return "s", (self.uuid,)
+
+        if interface == "com.redhat.RHSM1.RegisterServer":
+            if member == "Start":
+                self._register_server.start()
+                return "s", (self._register_server.address,)
+            if member == "Stop":
+                self._register_server.stop()
+                return "b", (True,)
+
+        if interface == "com.redhat.RHSM1.Register":
+            if member == "Register":
+                organization, username, password, _options, _connection, _locale = body
+                if (username, password) != (self.username, self.password):
+                    raise rhsm_error("RestlibException", "Invalid Credentials")
+                self._check_organization(organization)
+                return self._register()
+            if member == "RegisterWithActivationKeys":
+                organization, keys, _options, _connection, _locale = body
+                self._check_organization(organization)
+                if not set(keys) & set(self.activation_keys):
+                    raise rhsm_error("RestlibException", "None of the activation keys specified exist for this org.")
+                return self._register()
+            if member == "GetOrgs":
+                username, password, _connection, _locale = body
+                if (username, password) != (self.username, self.password):
+                    raise rhsm_error("RestlibException", "Invalid Credentials")
+                orgs = [{"key": org, "displayName": org} for org in self.organizations]
+                return "s", (json.dumps(orgs),)
+
+        if interface == "com.redhat.RHSM1.Unregister" and member == "Unregister":
+            if not self.is_registered:
+                raise rhsm_error("Exception", "This system is currently not registered.")
+            self.uuid = ""
+            return None, ()
+
+        if interface == "com.redhat.RHSM1.Config":
+            if member == "Set":
+                key, (_signature, value), _locale = body
+                self.config[key] = value
+                return None, ()
+            if member == "SetAll":
+                settings, _locale = body
+                self.config.update({key: value for key, (_signature, value) in settings.items()})
+                return None, ()
+
+        raise MethodCallError(
+            "org.freedesktop.DBus.Error.UnknownMethod",
+            f"Unknown method {interface}.{member} on {path}",
+        )
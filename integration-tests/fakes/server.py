@@ -0,0 +1,73 @@
+"""
+Fake server of RHSM and Red Hat Insights. rhc only checks that the servers
+are reachable before connecting, so the fake server completes TLS handshakes
+and closes connections; requests are not served.
+"""
+
+import os
+import socket
+import ssl
+import subprocess
+import threading
+
+
+class FakeServer:
+    """TLS server listening on a free port of localhost"""
+
+    def __init__(self, directory):
+        """:param directory: directory for the self-signed certificate"""
+        self.cert_file = os.path.join(directory, "server.crt")
+        self.key_file = os.path.join(directory, "server.key")
+        self.port = None
+        self._socket = None
+        self._thread = None
+
+    @property
+    def address(self):
+        """:return: host:port of the server"""
+        return f"127.0.0.1:{self.port}"
+
+    def start(self):
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                "-subj", "/CN=localhost", "-keyout", self.key_file, "-out", self.cert_file,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.cert_file, self.key_file)
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen()
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve, args=(context,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _serve(self, context):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                # The socket was closed by stop()
+                return
+            threading.Thread(
+                target=self._handshake, args=(context, connection), daemon=True
+            ).start()
+
+    @staticmethod
+    def _handshake(context, connection):
+        connection.settimeout(5)
+        try:
+            with context.wrap_socket(connection, server_side=True):
+                pass
+        except (OSError, ssl.SSLError):
+            connection.close()
@@ -0,0 +1,167 @@
+"""
+Fake org.freedesktop.systemd1 service. Units are started and stopped
+instantly; the signals go-systemd waits for are emitted like systemd does.
+"""
+
+import time
+
+from .dbus_service import FakeService, MethodCallError
+
+MANAGER_PATH = "/org/freedesktop/systemd1"
+MANAGER_INTERFACE = "org.freedesktop.systemd1.Manager"
+UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
+UNIT_PATH_PREFIX = "/org/freedesktop/systemd1/unit/"
+
+UNIT_PROPERTY_SIGNATURES = {
+    "ActiveState": "s",
+    "LoadState": "s",
+    "SubState": "s",
+    "UnitFileState": "s",
+    "StateChangeTimestamp": "t",
+}
+
+
+def unit_path(name):
+    """Object path of the unit, escaped the way systemd does it"""
+    escaped = "".join(
+        char if char.isascii() and char.isalnum() else f"_{ord(char):02x}"
+        for char in name
+    )
+    return UNIT_PATH_PREFIX + escaped
+
+
+class FakeSystemd(FakeService):
+    """Fake systemd manager. Any unit name is accepted. Starting a unit listed
+    in failing_units fails.
+    """
+
+    bus_name = "org.freedesktop.systemd1"
+
+    def __init__(self):
+        super().__init__()
+        self.units = {}
+        self.failing_units = set()
+        self._paths = {}
+        self._job_id = 0
+
+    def reset(self):
+        super().reset()
+        with self._lock:
+            self.units = {}
+            self.failing_units = set()
+            self._paths = {}
+
+    def unit(self, name):
+        """Properties of the unit"""
+        if name not in self.units:
+            self.units[name] = {
+                "ActiveState": "inactive",
+                "LoadState": "loaded",
+                "SubState": "dead",
+                "UnitFileState": "disabled",
+                "StateChangeTimestamp": 0,
+            }
+            self._paths[unit_path(name)] = name
+        return self.units[name]
+
+    def is_active(self, name):
+        with self._lock:
+            return self.unit(name)["ActiveState"] == "active"
+
+    def is_enabled(self, name):
+        with self._lock:
+            return self.unit(name)["UnitFileState"] == "enabled"
+
+    def _set_state(self, name, active_state, sub_state):
+        unit = self.unit(name)
+        unit["ActiveState"] = active_state
+        unit["SubState"] = sub_state
+        unit["StateChangeTimestamp"] = int(time.time() * 1e6)
+        changed = {
+            key: (UNIT_PROPERTY_SIGNATURES[key], unit[key])
+            for key in ("ActiveState", "SubState", "StateChangeTimestamp")
+        }
+        self.emit(
+            unit_path(name),
+            "org.freedesktop.DBus.Properties",
+            "PropertiesChanged",
+            "sa{sv}as",
+            (UNIT_INTERFACE, changed, []),
+        )
+
+    def _run_job(self, name, active_state, sub_state, result):
+        self._job_id += 1
+        job_path = f"{MANAGER_PATH}/job/{self._job_id}"
+        self._set_state(name, active_state, sub_state)
+        self.emit(MANAGER_PATH, MANAGER_INTERFACE, "JobRemoved", "uoss", (self._job_id, job_path, name, result))
+        return "o", (job_path,)
+
+    def _handle_manager(self, member, body):
+        if member in ("Subscribe", "Unsubscribe", "Reload"):
+            return None, ()
+        if member == "EnableUnitFiles":
+            names, _runtime, _force = body
+            changes = []
+            for name in names:
+                self.unit(name)["UnitFileState"] = "enabled"
+                changes.append(("symlink", f"/etc/systemd/system/multi-user.target.wants/{name}", name))
+            return "ba(sss)", (False, changes)
+        if member == "DisableUnitFiles":
+            names, _runtime = body
+            changes = []
+            for name in names:
+                self.unit(name)["UnitFileState"] = "disabled"
+                changes.append(("unlink", f"/etc/systemd/system/multi-user.target.wants/{name}", ""))
+            return "a(sss)", (changes,)
+        if member == "StartUnit":
+            name, _mode = body
+            if name in self.failing_units:
+                return self._run_job(name, "failed", "failed", "failed")
+            return self._run_job(name, "active", "running", "done")
+        if member == "StopUnit":
+            name, _mode = body
+            return self._run_job(name, "inactive", "dead", "done")
+        if member in ("GetUnit", "LoadUnit"):
+            (name,) = body
+            self.unit(name)
+            return "o", (unit_path(name),)
+        raise MethodCallError("org.freedesktop.DBus.Error.UnknownMethod", f"Unknown method {member}")
+
+    def _handle_properties(self, path, member, body):
+        name = self._paths.get(path)
+        if name is None:
+            raise MethodCallError("org.freedesktop.DBus.Error.UnknownObject", f"Unknown object {path}")
+        unit = self.unit(name)
+        if member == "Get":
+            _interface, prop = body
+            if prop not in unit:
+                raise MethodCallError("org.freedesktop.DBus.Error.UnknownProperty", f"Unknown property {prop}")
+            return "v", ((UNIT_PROPERTY_SIGNATURES[prop], unit[prop]),)
+        if member == "GetAll":
+            return "a{sv}", ({key: (UNIT_PROPERTY_SIGNATURES[key], value) for key, value in unit.items()},)
+        raise MethodCallError("org.freedesktop.DBus.Error.UnknownMethod", f"Unknown method {member}")
+
+    def handle(self, path, interface, member, body):
+        if path == MANAGER_PATH and interface in (MANAGER_INTERFACE, None):
+            return self._handle_manager(member, body)
+        if path.startswith(UNIT_PATH_PREFIX) and interface == "org.freedesktop.DBus.Properties":
+            if path not in self._paths:
+                # go-systemd computes paths of units it has not asked about
+                self._load_unit_by_path(path)
+            return self._handle_properties(path, member, body)
+        raise MethodCallError(
+            "org.freedesktop.DBus.Error.UnknownMethod",
+            f"Unknown method {interface}.{member} on {path}",
+        )
+
+    def _load_unit_by_path(self, path):
+        escaped = path[len(UNIT_PATH_PREFIX):]
+        name, i = "", 0
+        while i < len(escaped):
+            if escaped[i] == "_":
+                name += chr(int(escaped[i + 1:i + 3], 16))
+                i += 3
+            else:
+                name += escaped[i]
+                i += 1
+        self.unit(name)
@@ -8,13 +8,12 @@ import contextlib
 import time
 import logging
 import pytest
-from datetime import datetime
 import sh
 
 from utils import (
     yggdrasil_service_is_active,
     prepare_args_for_connect,
-    check_yggdrasil_journalctl_logs,
+    JournalFollower,
 )
 
 logger = logging.getLogger(__name__)
@@ -135,17 +134,16 @@ def test_connect(external_candlepin, rhc, test_config, auth, output_format):
     ],
 )
 def test_connect_wrong_parameters(
-    external_candlepin, rhc, test_config, credentials, server
+    external_candlepin, disconnected_rhc, test_config, credentials, server
 ):
-    """Test if RHC handles invalid credentials properly"""
-    # An attempt to bring system in disconnected state in case it is not.
-    with contextlib.suppress(Exception):
-        rhc.disconnect()
+    """Test if RHC handles invalid credentials properly. Failed connects do
+    not change the system, so it is disconnected only before the first case.
+    """
     command_args = prepare_args_for_connect(
         test_config, credentials=credentials, server=server
     )
     command = ["connect"] + command_args
-    result = rhc.run(*command, check=False)
+    result = disconnected_rhc.run(*command, check=False)
     assert result.returncode != 0
     assert not yggdrasil_service_is_active()
 
@@ -170,31 +168,22 @@ def test_rhc_worker_playbook_install_after_rhc_connect(
     with contextlib.suppress(Exception):
         rhc.disconnect()
 
-    start_date_time = datetime.now().strftime(
-        "%Y-%m-%d %H:%M:%S"
-    )  # current date and time for observing yggdrasil/rhcd logs
+    start_time = time.monotonic()
     command_args = prepare_args_for_connect(test_config, auth=auth)
     command = ["connect"] + command_args
-    rhc.run(*command, check=False)
-    assert rhc.is_registered
+    with JournalFollower(pytest.service_name) as journal:
+        rhc.run(*command, check=False)
+        assert rhc.is_registered
 
-    # Verifying if rhc-worker-playbook was installed successfully
-    t_end = time.time() + 60 * 5  # maximum time to wait for installation
-    while time.time() < t_end:
-        installed_status = check_yggdrasil_journalctl_logs(
-            str_to_check=success_message,
-            since_datetime=start_date_time,
-            must_exist_in_log=True,
+        # Verifying if rhc-worker-playbook was installed successfully
+        installed_status = journal.wait_for(
+            success_message, timeout=60 * 5  # maximum time to wait for installation
         )
-        if installed_status:
-            break
     assert (
         installed_status
     ), "rhc connect is expected to install rhc_worker_playbook package"
 
-    total_runtime = datetime.now() - datetime.strptime(
-        start_date_time, "%Y-%m-%d %H:%M:%S"
-    )
+    total_runtime = time.monotonic() - start_time
     pkg_version = sh.rpm("-qa", "rhc-worker-playbook")
     logger.info(f"successfully installed rhc_worker_playbook package {pkg_version}")
     logger.info(
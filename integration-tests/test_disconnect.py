@@ -9,7 +9,7 @@ import pytest
 from utils import yggdrasil_service_is_active
 
 
-def test_rhc_disconnect(external_candlepin, rhc, test_config):
+def test_rhc_disconnect(connected_rhc):
     """Verify that RHC disconnect command disconnects host from server
     and deactivates yggdrasil service.
     test_steps:
@@ -23,15 +23,11 @@ def test_rhc_disconnect(external_candlepin, rhc, test_config):
             "Disconnected from Red Hat Subscription Management"
     """
     # Connect first to perform disconnect operation
-    rhc.connect(
-        username=test_config.get("candlepin.username"),
-        password=test_config.get("candlepin.password"),
-    )
-    assert rhc.is_registered
+    assert connected_rhc.is_registered
     assert yggdrasil_service_is_active()
-    disconnect_result = rhc.run("disconnect", check=False)
+    disconnect_result = connected_rhc.run("disconnect", check=False)
     assert disconnect_result.returncode == 0
-    assert not rhc.is_registered
+    assert not connected_rhc.is_registered
     assert not yggdrasil_service_is_active()
     if pytest.service_name == "rhcd":
         assert (
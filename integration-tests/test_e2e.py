@@ -7,6 +7,7 @@ module could be found: https://github.com/RedHatInsights/pytest-client-tools/
 import contextlib
 import pytest
 import time
+from timing import WAIT_PHASE, phase
 from utils import (
     yggdrasil_service_is_active,
     prepare_args_for_connect,
@@ -34,12 +35,13 @@ def test_rhc_client_connect_e2e(rhc, test_config, auth, external_inventory, subm
     assert yggdrasil_service_is_active()
     timeout = 60.0
     start = time.time()
-    while True:
-        system_profile = external_inventory.this_system_profile()
-        if "rhc_client_id" in system_profile:
-            assert system_profile["rhc_client_id"] == str(subman.uuid)
-            break
-        current = time.time()
-        if current - start > timeout:
-            raise ValueError("timeout")
-        time.sleep(10)
+    with phase(WAIT_PHASE):
+        while True:
+            system_profile = external_inventory.this_system_profile()
+            if "rhc_client_id" in system_profile:
+                assert system_profile["rhc_client_id"] == str(subman.uuid)
+                break
+            current = time.time()
+            if current - start > timeout:
+                raise ValueError("timeout")
+            time.sleep(10)
@@ -0,0 +1,239 @@
+"""
+This Python module contains tests of rhc running against local stand-ins
+of RHSM, systemd and insights-client (see the fakes package). They do not
+need any server, and every pytest-xdist worker uses its own fake system.
+"""
+
+import json
+import os
+import time
+
+
+def connect(fake_system, *args, check=True):
+    return fake_system.run_rhc(
+        "connect", "--username", "admin", "--password", "secret", *args, check=check
+    )
+
+
+def test_connect_basic_auth(fake_system):
+    """
+    Test that rhc connect registers the system in RHSM and insights-client,
+    and enables and starts the yggdrasil/rhcd service.
+    """
+    connect(fake_system)
+    assert fake_system.rhsm.is_registered
+    assert "GetOrgs" not in fake_system.rhsm.calls
+    assert "--register" in fake_system.insights_calls
+    assert fake_system.systemd.is_enabled(fake_system.service_unit)
+    assert fake_system.systemd.is_active(fake_system.service_unit)
+
+
+def test_connect_activation_key(fake_system):
+    """
+    Test that rhc connect registers the system using an activation key
+    """
+    fake_system.run_rhc(
+        "connect", "--organization", "donaldduck", "--activation-key", "act-key"
+    )
+    assert fake_system.rhsm.is_registered
+    assert "RegisterWithActivationKeys" in fake_system.rhsm.calls
+    assert fake_system.systemd.is_active(fake_system.service_unit)
+
+
+def test_connect_invalid_credentials(fake_system):
+    """
+    Test that rhc connect with invalid credentials fails, and neither
+    insights-client nor the service are touched.
+    """
+    result = fake_system.run_rhc(
+        "connect", "--username", "admin", "--password", "wrong", check=False
+    )
+    assert result.returncode != 0
+    assert not fake_system.rhsm.is_registered
+    assert "--register" not in fake_system.insights_calls
+    assert not fake_system.systemd.is_active(fake_system.service_unit)
+
+
+def test_connect_json(fake_system):
+    """
+    Test the JSON document printed by rhc connect --format json
+    """
+    result = connect(fake_system, "--format", "json")
+    document = json.loads(result.stdout or result.stderr)
+    assert document["rhsm_connected"] is True
+    assert document["features"]["analytics"]["successful"] is True
+    assert document["features"]["remote_management"]["successful"] is True
+    assert [timing["name"] for timing in document["timings"]] == ["connect"]
+
+
+def test_connect_ndjson(fake_system):
+    """
+    Test that rhc connect --format ndjson streams events of every step
+    followed by the summary
+    """
+    result = connect(fake_system, "--format", "ndjson")
+    events = [json.loads(line) for line in result.stdout.splitlines()]
+    started = [event["step"] for event in events if event["event"] == "start"]
+    finished = [event["step"] for event in events if event["event"] == "finish"]
+    assert started[:2] == ["preflight", "rhsm"]
+    assert sorted(started) == sorted(finished)
+    assert all("duration_ms" in event for event in events if event["event"] == "finish")
+    assert events[-1]["event"] == "summary"
+    assert events[-1]["result"]["rhsm_connected"] is True
+
+
+def test_disconnect(fake_system):
+    """
+    Test that rhc disconnect reverts everything done by rhc connect
+    """
+    connect(fake_system)
+    fake_system.run_rhc("disconnect")
+    assert not fake_system.rhsm.is_registered
+    assert "--unregister" in fake_system.insights_calls
+    assert not fake_system.systemd.is_enabled(fake_system.service_unit)
+    assert not fake_system.systemd.is_active(fake_system.service_unit)
+
+
+def test_status(fake_system):
+    """
+    Test rhc status --format json on disconnected and connected system
+    """
+    result = fake_system.run_rhc("status", "--format", "json", check=False)
+    document = json.loads(result.stdout)
+    assert document["rhsm_connected"] is False
+    assert document["insights_connected"] is False
+    assert document["yggdrasil_running"] is False
+
+    connect(fake_system)
+    result = fake_system.run_rhc("status", "--format", "json")
+    document = json.loads(result.stdout)
+    assert document["rhsm_connected"] is True
+    assert document["insights_connected"] is True
+    assert document["yggdrasil_running"] is True
+
+
+def test_trace(fake_system, tmp_path):
+    """
+    Test that rhc --trace writes spans of the command in the Chrome trace format
+    """
+    trace_file = tmp_path / "trace.json"
+    fake_system.run_rhc("--trace", str(trace_file), "status", "--no-cache", check=False)
+    with open(trace_file) as trace:
+        events = json.load(trace)["traceEvents"]
+    names = {event["name"] for event in events}
+    assert "status" in names
+    assert "dbus com.redhat.RHSM1.Consumer.GetUuid" in names
+    assert all(event["ph"] == "X" for event in events)
+
+
+def test_status_insights_markers(fake_system):
+    """
+    Test that rhc status reads the state files of insights-client, and runs
+    insights-client only when --insights-client-status is used
+    """
+    connect(fake_system)
+    fake_system.run_rhc("status", "--no-cache")
+    assert "--status" not in fake_system.insights_calls
+
+    fake_system.run_rhc("status", "--no-cache", "--insights-client-status")
+    assert "--status" in fake_system.insights_calls
+
+
+def test_connect_timeout(fake_system):
+    """
+    Test that rhc connect --timeout gives up waiting for a slow registration,
+    and that it stops the register server of RHSM anyway
+    """
+    fake_system.rhsm.delays["Register"] = 10
+    start = time.monotonic()
+    result = connect(fake_system, "--timeout", "1s", check=False)
+    assert time.monotonic() - start < 5
+    assert result.returncode != 0
+    assert "com.redhat.RHSM1.Register.Register timed out" in result.stdout + result.stderr
+    assert "Stop" in fake_system.rhsm.calls
+
+
+def test_disconnect_timeout(fake_system):
+    """
+    Test that rhc disconnect --timeout gives up waiting for a slow unregistration
+    """
+    connect(fake_system)
+    # Methods on the system bus are handled one by one, short delays do not
+    # hold up following tests. The command has to give up before the reply
+    # is sent, the time of starting it is not limited.
+    delay = 4
+    fake_system.rhsm.delays["Unregister"] = delay
+    start = time.monotonic()
+    result = fake_system.run_rhc("disconnect", "--timeout", "2s", check=False)
+    assert time.monotonic() - start < delay
+    assert result.returncode != 0
+    assert "com.redhat.RHSM1.Unregister.Unregister timed out" in result.stdout + result.stderr
+
+
+def test_status_timeout(fake_system):
+    """
+    Test that rhc status --timeout reports RHSM as failed, when it does not reply in time
+    """
+    # The command has to give up before the reply is sent
+    delay = 3
+    fake_system.rhsm.delays["GetUuid"] = delay
+    start = time.monotonic()
+    result = fake_system.run_rhc(
+        "status", "--format", "json", "--no-cache", "--timeout", "1s", check=False
+    )
+    assert time.monotonic() - start < delay
+    assert result.returncode != 0
+    document = json.loads(result.stdout)
+    assert document["rhsm_connected"] is False
+
+
+def test_connect_organizations(fake_system):
+    """
+    Test that rhc connect requests the list of organizations only after the
+    registration failed, because the user is member of more organizations and
+    no organization was given
+    """
+    fake_system.rhsm.organizations = ["donaldduck", "mickeymouse"]
+    result = connect(fake_system, "--format", "json", check=False)
+    assert result.returncode != 0
+    assert "no organization specified" in result.stdout + result.stderr
+    calls = fake_system.rhsm.calls
+    assert calls.index("GetOrgs") > calls.index("Register")
+    assert not fake_system.rhsm.is_registered
+
+
+def test_connect_unreachable_server(fake_system):
+    """
+    Test that rhc connect fails fast, when the server of RHSM is not reachable,
+    and it does not change anything on the system
+    """
+    start = time.monotonic()
+    result = connect(fake_system, "--server", "https://127.0.0.1:1", check=False)
+    assert time.monotonic() - start < 5
+    assert result.returncode != 0
+    assert "cannot connect to server 127.0.0.1:1" in result.stdout + result.stderr
+    assert "Register" not in fake_system.rhsm.calls
+    assert "SetAll" not in fake_system.rhsm.calls
+    assert not os.path.exists(fake_system.path("/etc/rhsm/rhsm.conf.orig"))
+    assert fake_system.insights_calls == []
+
+
+def test_diagnose(fake_system):
+    """
+    Test that rhc diagnose --format json reports latency of the servers of
+    RHSM and Red Hat Insights, and fails when a server is not reachable
+    """
+    result = fake_system.run_rhc("diagnose", "--format", "json")
+    endpoints = json.loads(result.stdout)["endpoints"]
+    assert [endpoint["name"] for endpoint in endpoints] == ["rhsm", "insights"]
+    for endpoint in endpoints:
+        assert endpoint["address"] == fake_system.server.address
+        assert "error" not in endpoint
+        assert endpoint["total_ms"] >= endpoint["tls_ms"] > 0
+
+    result = fake_system.run_rhc(
+        "diagnose", "--format", "json", "--server", "https://127.0.0.1:1", check=False
+    )
+    assert result.returncode == 1
+    endpoints = json.loads(result.stdout)["endpoints"]
+    assert endpoints[0]["error_stage"] == "connect"
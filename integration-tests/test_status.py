@@ -9,10 +9,10 @@ from pytest_client_tools import util
 from utils import yggdrasil_service_is_active
 
 
-def test_status_connected(external_candlepin, rhc, test_config):
+def test_status_connected(connected_rhc):
     """Test RHC Status command when the host is connected.
     test_steps:
-        1- rhc connect
+        1- rhc connect (registration is shared by tests of the module)
         2- rhc status
     expected_output:
         1- Validate following strings in status command output
@@ -20,12 +20,8 @@ def test_status_connected(external_candlepin, rhc, test_config):
             "Connected to Red Hat Insights"
             "The yggdrasil/rhcd service is active"
     """
-    rhc.connect(
-        username=test_config.get("candlepin.username"),
-        password=test_config.get("candlepin.password"),
-    )
     assert yggdrasil_service_is_active()
-    status_result = rhc.run("status", check=False)
+    status_result = connected_rhc.run("status", check=False)
     assert status_result.returncode == 0
     assert "Connected to Red Hat Subscription Management" in status_result.stdout
     assert "Connected to Red Hat Insights" in status_result.stdout
@@ -35,21 +31,17 @@ def test_status_connected(external_candlepin, rhc, test_config):
         assert "The yggdrasil service is active" in status_result.stdout
 
 
-def test_status_connected_format_json(external_candlepin, rhc, test_config):
+def test_status_connected_format_json(connected_rhc):
     """
     Test 'rhc status --format json' command, when host is connected
     test_steps:
-        1 - rhc connect
+        1 - rhc connect (registration is shared by tests of the module)
         2 - rhc status
     expected_output:
         1 - Validate that output is valid JSON document
         2 - Validate that JSON document contains expected data
     """
-    rhc.connect(
-        username=test_config.get("candlepin.username"),
-        password=test_config.get("candlepin.password")
-    )
-    status_result = rhc.run("status", "--format", "json", check=False)
+    status_result = connected_rhc.run("status", "--format", "json", check=False)
     assert status_result.returncode == 0
     status_json = json.loads(status_result.stdout)
     assert "hostname" in status_json
@@ -65,7 +57,7 @@ def test_status_connected_format_json(external_candlepin, rhc, test_config):
         assert type(status_json["yggdrasil_running"]) == bool
 
 
-def test_status_disconnected(rhc):
+def test_status_disconnected(disconnected_rhc):
     """Test RHC Status command when the host is disconnected.
     Ref: https://issues.redhat.com/browse/CCT-525
     test_steps:
@@ -77,9 +69,7 @@ def test_status_disconnected(rhc):
             "Not connected to Red Hat Insights"
             "The yggdrasil/rhc service is inactive"
     """
-    # 'rhc disconnect' to ensure system is already disconnected
-    rhc.run("disconnect", check=False)
-    status_result = rhc.run("status", check=False)
+    status_result = disconnected_rhc.run("status", check=False)
     assert status_result.returncode != 0
     assert "Not connected to Red Hat Subscription Management" in status_result.stdout
     assert "Not connected to Red Hat Insights" in status_result.stdout
@@ -93,7 +83,7 @@ def test_status_disconnected(rhc):
     pytest.service_name != "rhcd",
     reason="This test only supports restart of rhcd and not yggdrasil",
 )
-def test_rhcd_service_restart(external_candlepin, rhc, test_config):
+def test_rhcd_service_restart(external_candlepin, rhc, test_config, yggdrasil_service):
     """
     Test rhcd service can be restarted on connected and  not on disconnected system.
     test_steps:
@@ -111,7 +101,9 @@ def test_rhcd_service_restart(external_candlepin, rhc, test_config):
     try:
 
         util.logged_run("systemctl restart rhcd".split())
-        assert not yggdrasil_service_is_active()
+        # rhcd cannot start on a disconnected system, wait until it gives up
+        yggdrasil_service.wait_for_state(("inactive", "failed"), timeout=30)
+        assert not yggdrasil_service.is_active()
     except AssertionError as exc:
         # for debugging lets check current state of rhcd service
         util.logged_run("systemctl status rhcd --no-pager".split())
@@ -125,7 +117,7 @@ def test_rhcd_service_restart(external_candlepin, rhc, test_config):
     assert rhc.is_registered
     try:
         util.logged_run("systemctl restart rhcd".split())
-        assert yggdrasil_service_is_active()
+        assert yggdrasil_service.wait_for_state("active", timeout=30)
     except AssertionError as exc:
         util.logged_run("systemctl status rhcd --no-pager".split())
         raise exc
@@ -0,0 +1,126 @@
+"""
+pytest plugin recording how long tests spend in the slow phases of testing
+rhc on a real system: rhc connect, disconnect and status, and waits for
+backend services. Times of every test are written as properties of the test
+case to junit.xml (--junit-xml), e.g.
+
+    <property name="timing.connect" value="12.345"/>
+    <property name="timing.connect.calls" value="1"/>
+
+and totals of the whole run are reported in the terminal summary. It works
+with pytest-xdist too, workers send the properties to the controller with
+test reports.
+"""
+
+import contextlib
+import time
+
+import pytest
+
+# Phases of rhc commands, which are timed
+RHC_PHASES = ("connect", "disconnect", "status")
+
+# Phase of waiting for backend services, e.g. yggdrasil or inventory
+WAIT_PHASE = "wait"
+
+PROPERTY_PREFIX = "timing."
+
+# Phases of the running test: name -> [seconds, calls]
+_current = None
+
+# Phases of all finished tests: name -> [seconds, calls]
+_totals = {}
+
+# Slowest test of every phase: name -> (seconds, nodeid)
+_slowest = {}
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Records the time spent in the block as the phase of the running test.
+    Nothing is recorded outside of tests.
+    :param name: name of the phase, e.g. 'connect' or 'wait'
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if _current is not None:
+            record = _current.setdefault(name, [0.0, 0])
+            record[0] += time.monotonic() - start
+            record[1] += 1
+
+
+class TimedRhc:
+    """Wraps the rhc fixture of pytest-client-tools, so rhc connect,
+    disconnect and status are timed as phases of the running test
+    """
+
+    def __init__(self, rhc):
+        self._rhc = rhc
+
+    def __getattr__(self, name):
+        return getattr(self._rhc, name)
+
+    def run(self, *args, **kwargs):
+        if args and args[0] in RHC_PHASES:
+            with phase(args[0]):
+                return self._rhc.run(*args, **kwargs)
+        return self._rhc.run(*args, **kwargs)
+
+    def connect(self, *args, **kwargs):
+        with phase("connect"):
+            return self._rhc.connect(*args, **kwargs)
+
+    def disconnect(self, *args, **kwargs):
+        with phase("disconnect"):
+            return self._rhc.disconnect(*args, **kwargs)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    global _current
+    _current = {}
+    try:
+        yield
+    finally:
+        _current = None
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    # junit.xml gets properties of the teardown report, it is made after all
+    # fixtures of the test were finalized, so their phases are included.
+    if call.when == "teardown" and _current:
+        for name, (seconds, calls) in sorted(_current.items()):
+            item.user_properties.append((f"{PROPERTY_PREFIX}{name}", f"{seconds:.3f}"))
+            item.user_properties.append((f"{PROPERTY_PREFIX}{name}.calls", calls))
+    yield
+
+
+def pytest_runtest_logreport(report):
+    if report.when != "teardown":
+        return
+    for name, value in report.user_properties:
+        if not name.startswith(PROPERTY_PREFIX) or name.endswith(".calls"):
+            continue
+        phase_name = name[len(PROPERTY_PREFIX):]
+        seconds = float(value)
+        calls = dict(report.user_properties).get(f"{name}.calls", 1)
+        total = _totals.setdefault(phase_name, [0.0, 0])
+        total[0] += seconds
+        total[1] += int(calls)
+        if seconds > _slowest.get(phase_name, (0.0, None))[0]:
+            _slowest[phase_name] = (seconds, report.nodeid)
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _totals:
+        return
+    terminalreporter.write_sep("=", "phase timings")
+    for name, (seconds, calls) in sorted(_totals.items(), key=lambda item: -item[1][0]):
+        slowest_seconds, slowest_test = _slowest.get(name, (0.0, None))
+        line = f"{name:<12} {seconds:9.3f}s in {calls} calls"
+        if slowest_test:
+            line += f", slowest {slowest_seconds:.3f}s {slowest_test}"
+        terminalreporter.write_line(line)
@@ -1,5 +1,128 @@
+import functools
+import json
+import os
+import select
+import subprocess
+import time
+
 import pytest
 import sh
+from jeepney import DBusAddress, MatchRule, Properties, new_method_call
+from jeepney.bus_messages import message_bus
+from jeepney.io.blocking import open_dbus_connection
+from jeepney.wrappers import unwrap_msg
+
+from timing import WAIT_PHASE, phase
+
+
+SYSTEMD_BUS_NAME = "org.freedesktop.systemd1"
+SYSTEMD_MANAGER = DBusAddress(
+    "/org/freedesktop/systemd1",
+    bus_name=SYSTEMD_BUS_NAME,
+    interface="org.freedesktop.systemd1.Manager",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def systemd_connection():
+    """Returns the connection to the system bus shared by the whole test session.
+    systemd is asked to emit signals about changes of units on the connection.
+    """
+    connection = open_dbus_connection(bus="SYSTEM")
+    unwrap_msg(connection.send_and_get_reply(new_method_call(SYSTEMD_MANAGER, "Subscribe")))
+    return connection
+
+
+class SystemdUnit:
+    """Queries the state of a systemd unit over D-Bus without forking systemctl"""
+
+    def __init__(self, name, connection=None):
+        """
+        :param name: full name of the unit, e.g. 'rhcd.service'
+        :param connection: D-Bus connection, defaults to systemd_connection()
+        """
+        self.name = name
+        self._connection = connection or systemd_connection()
+        reply = self._connection.send_and_get_reply(
+            new_method_call(SYSTEMD_MANAGER, "LoadUnit", "s", (name,))
+        )
+        self.path = unwrap_msg(reply)[0]
+        self._unit = DBusAddress(
+            self.path,
+            bus_name=SYSTEMD_BUS_NAME,
+            interface="org.freedesktop.systemd1.Unit",
+        )
+
+    def _get_property(self, name):
+        reply = self._connection.send_and_get_reply(Properties(self._unit).get(name))
+        _signature, value = unwrap_msg(reply)[0]
+        return value
+
+    def exists(self):
+        """:return: True if the unit file of the unit was found"""
+        return self._get_property("LoadState") != "not-found"
+
+    def active_state(self):
+        """:return: ActiveState of the unit, e.g. 'active', 'inactive' or 'failed'"""
+        return self._get_property("ActiveState")
+
+    def is_active(self):
+        return self.active_state() == "active"
+
+    def wait_for_state(self, state, timeout):
+        """Waits until ActiveState of the unit is one of the given states.
+        Changes are received as D-Bus signals, the state is not polled.
+        :param state: state or a tuple of states to wait for
+        :param timeout: maximum time to wait in seconds
+        :return: True if the unit reached the state else False
+        """
+        states = {state} if isinstance(state, str) else set(state)
+        # Signals carry the unique name of systemd as the sender, which the
+        # rule cannot be matched against locally, so the sender is not used.
+        rule = MatchRule(
+            type="signal",
+            interface="org.freedesktop.DBus.Properties",
+            member="PropertiesChanged",
+            path=self.path,
+        )
+        unwrap_msg(self._connection.send_and_get_reply(message_bus.AddMatch(rule)))
+        try:
+            with phase(WAIT_PHASE), self._connection.filter(rule, bufsize=64) as signals:
+                # The state is read after the filter is installed, so no
+                # change can be missed between reading and waiting.
+                current = self.active_state()
+                deadline = time.monotonic() + timeout
+                while current not in states:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    try:
+                        signal = self._connection.recv_until_filtered(
+                            signals, timeout=remaining
+                        )
+                    except TimeoutError:
+                        return False
+                    _interface, changed, _invalidated = signal.body
+                    if "ActiveState" in changed:
+                        current = changed["ActiveState"][1]
+                return True
+        finally:
+            self._connection.send_and_get_reply(message_bus.RemoveMatch(rule))
+
+
+def detect_service_name():
+    """Returns the name of the service available on the system with rhc installed.
+    Name of the service in upstream package is 'yggdrasil' and downstream is 'rhcd'
+    """
+    if SystemdUnit("yggdrasil.service").exists():
+        return "yggdrasil"
+    return "rhcd"
+
+
+@functools.lru_cache(maxsize=None)
+def service_unit():
+    """Returns the SystemdUnit of yggdrasil/rhcd shared by the whole test session"""
+    return SystemdUnit(f"{pytest.service_name}.service")
 
 
 def yggdrasil_service_is_active():
@@ -7,32 +130,109 @@ def yggdrasil_service_is_active():
     :return: True if yggdrasil/rhcd in active state else False
     Note: upstream name of service is yggdrasil and downstream is rhcd
     """
-    try:
-        stdout = sh.systemctl(f"is-active {pytest.service_name}".split()).strip()
-        return stdout == "active"
-    except sh.ErrorReturnCode_3:
-        return False
+    return service_unit().is_active()
 
 
-def check_yggdrasil_journalctl_logs(
-    str_to_check, since_datetime=None, must_exist_in_log=True
-):
-    """This method helps in verifying strings in journalctl logs
-    :param str_to_check: string to be searched in logs
-    :param since_datetime: start time for logs
-    :param must_exist_in_log: True if str_to_check should exist in log else false
-    :return: True/False
-    Note: upstream name of service is yggdrasil and downstream is rhcd
+class JournalFollower:
+    """Streams journal entries of a systemd unit from one long-running
+    `journalctl -f -o json` process. Entries are read incrementally and
+    the cursor of the last read entry is kept, so each wait continues where
+    the previous one stopped instead of re-reading the whole journal.
+    Use it as a context manager:
+
+        with JournalFollower(pytest.service_name) as journal:
+            ...
+            assert journal.wait_for("some message", timeout=60)
     """
-    if since_datetime:
-        logs = sh.journalctl("-u", pytest.service_name, "--since", since_datetime)
-    else:
-        logs = sh.journalctl("-u", pytest.service_name)
-
-    if must_exist_in_log:
-        return str_to_check in logs
-    else:
-        return str_to_check not in logs
+
+    def __init__(self, unit=None, cursor=None):
+        """
+        :param unit: name of the unit, defaults to yggdrasil/rhcd
+        :param cursor: journal cursor to start after; when not given,
+            entries logged since starting the follower are read
+        """
+        self.unit = unit or pytest.service_name
+        self.cursor = cursor
+        self.entries = []
+        self._position = 0
+        self._buffer = b""
+        self._proc = None
+
+    def start(self):
+        args = ["journalctl", "--follow", "--output", "json", "--unit", self.unit]
+        if self.cursor:
+            args.extend(["--after-cursor", self.cursor])
+        else:
+            # --since is used instead of --lines 0, so entries logged before
+            # journalctl opens the journal are not lost
+            args.extend(["--since", f"@{int(time.time())}"])
+        self._proc = subprocess.Popen(
+            args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        return self
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _read(self, timeout):
+        """Reads available entries, waiting at most timeout seconds for data
+        :return: False when journalctl exited, else True
+        """
+        fd = self._proc.stdout.fileno()
+        ready, _, _ = select.select([fd], [], [], max(timeout, 0))
+        if not ready:
+            return True
+        data = os.read(fd, 65536)
+        if not data:
+            return False
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            self.cursor = entry.get("__CURSOR", self.cursor)
+            message = entry.get("MESSAGE", "")
+            # journalctl encodes messages, which are not valid UTF-8, as byte arrays
+            if isinstance(message, list):
+                message = bytes(message).decode(errors="replace")
+            self.entries.append(message)
+        return True
+
+    def wait_for(self, pattern, timeout):
+        """Waits until a journal entry matching the pattern is logged
+        :param pattern: substring or compiled regular expression to search for
+        :param timeout: maximum time to wait in seconds
+        :return: the matching message or None, when the timeout expired
+        """
+        if isinstance(pattern, str):
+            matches = lambda message: pattern in message  # noqa: E731
+        else:
+            matches = lambda message: pattern.search(message) is not None  # noqa: E731
+        with phase(WAIT_PHASE):
+            return self._wait_for(matches, timeout)
+
+    def _wait_for(self, matches, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            while self._position < len(self.entries):
+                message = self.entries[self._position]
+                self._position += 1
+                if matches(message):
+                    return message
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._read(remaining):
+                return None
 
 
 def prepare_args_for_connect(
@@ -1,12 +1,18 @@
 package main
 
 import (
+	"context"
+	"encoding/json"
 	"fmt"
+	"io"
 	"os"
+	"strings"
+	"sync"
 	"text/tabwriter"
 	"time"
 
 	"github.com/briandowns/spinner"
+	"github.com/redhatinsights/rhc/internal/trace"
 	"github.com/subpop/go-log"
 	"github.com/urfave/cli/v2"
 )
@@ -28,6 +34,9 @@ const mediumIndent = "  "
 type userInterfaceSettings struct {
 	// isMachineReadable describes the machine-readable mode (e.g., `--format json`)
 	isMachineReadable bool
+	// streamEvents describes the streaming machine-readable mode (e.g.,
+	// `--format ndjson`), which reports every step as it starts and finishes
+	streamEvents bool
 	// isRich describes the ability to display colors and animations
 	isRich    bool
 	iconOK    string
@@ -85,14 +94,46 @@ func showProgress(
 	return function()
 }
 
-// showTimeDuration shows table with duration of each sub-action
-func showTimeDuration(durations map[string]time.Duration) {
+// pipelineProgress returns a function, which can be passed to runPipeline. It
+// displays a spinner with progress messages of running steps, when it is
+// possible.
+func pipelineProgress(prefixSpaces string) func(messages []string) {
+	var s *spinner.Spinner
+	return func(messages []string) {
+		if !uiSettings.isRich {
+			return
+		}
+		if s != nil {
+			s.Stop()
+			s = nil
+		}
+		if len(messages) > 0 {
+			s = spinner.New(spinner.CharSets[9], 100*time.Millisecond)
+			s.Prefix = prefixSpaces + "["
+			s.Suffix = "] " + strings.Join(messages, ", ") + "..."
+			s.Start()
+		}
+	}
+}
+
+// showTimeDuration shows table with duration of each sub-action and the
+// operations done by it, in the order they were started
+func showTimeDuration(timings []trace.Timing) {
 	if log.CurrentLevel() >= log.LevelDebug {
 		fmt.Println()
 		w := tabwriter.NewWriter(os.Stdout, 0, 0, 2, ' ', 0)
 		_, _ = fmt.Fprintln(w, "STEP\tDURATION\t")
-		for step, duration := range durations {
-			_, _ = fmt.Fprintf(w, "%v\t%v\t\n", step, duration.Truncate(time.Millisecond))
+		var writeTimings func(timings []trace.Timing, indent string)
+		writeTimings = func(timings []trace.Timing, indent string) {
+			for _, timing := range timings {
+				duration := time.Duration(timing.DurationMs * float64(time.Millisecond))
+				_, _ = fmt.Fprintf(w, "%v%v\t%v\t\n", indent, timing.Name, duration.Truncate(time.Millisecond))
+				writeTimings(timing.Children, indent+mediumIndent)
+			}
+		}
+		// Skip the root span of the command
+		for _, timing := range timings {
+			writeTimings(timing.Children, "")
 		}
 		_ = w.Flush()
 	}
@@ -127,3 +168,77 @@ func interactivePrintf(format string, a ...interface{}) {
 		fmt.Printf(format, a...)
 	}
 }
+
+// progressEvent is a line of the `--format ndjson` output. A "start" and a
+// "finish" event is written for every step of the command, and a "summary"
+// event carrying the result of the command is written as the last line.
+type progressEvent struct {
+	Event      string      `json:"event"`
+	Step       string      `json:"step,omitempty"`
+	Time       time.Time   `json:"time"`
+	DurationMs *int64      `json:"duration_ms,omitempty"`
+	Skipped    bool        `json:"skipped,omitempty"`
+	Error      string      `json:"error,omitempty"`
+	Result     interface{} `json:"result,omitempty"`
+}
+
+// eventWriter is where the events are written to.
+var eventWriter io.Writer = os.Stdout
+
+// eventMutex serializes writing events of steps running in parallel.
+var eventMutex sync.Mutex
+
+// emitEvent writes the event as a single line of JSON, when events are
+// streamed. Otherwise, it does nothing.
+func emitEvent(event progressEvent) {
+	if !uiSettings.streamEvents {
+		return
+	}
+	if event.Time.IsZero() {
+		event.Time = time.Now()
+	}
+	data, err := json.Marshal(event)
+	if err != nil {
+		log.Debugf("cannot encode event: %v", err)
+		return
+	}
+	eventMutex.Lock()
+	defer eventMutex.Unlock()
+	_, _ = eventWriter.Write(append(data, '\n'))
+}
+
+// streamStep wraps the function running the step, so "start" and "finish"
+// events are written around it.
+func streamStep(step string, run func(ctx context.Context) error) func(ctx context.Context) error {
+	return func(ctx context.Context) error {
+		start := time.Now()
+		emitEvent(progressEvent{Event: "start", Step: step, Time: start})
+		err := run(ctx)
+		finish := progressEvent{Event: "finish", Step: step}
+		finish.Time = time.Now()
+		durationMs := finish.Time.Sub(start).Milliseconds()
+		finish.DurationMs = &durationMs
+		if err != nil {
+			finish.Error = err.Error()
+		}
+		emitEvent(finish)
+		return err
+	}
+}
+
+// emitSkippedStep writes the "finish" event of a step, which was not run.
+func emitSkippedStep(step string) {
+	emitEvent(progressEvent{Event: "finish", Step: step, Skipped: true})
+}
+
+// exitWithResult returns the result of the command as the error handled by
+// the CLI library. When events are streamed, the result is written as the
+// "summary" event instead, so the whole output is a stream of JSON lines on
+// standard output.
+func exitWithResult(result error, exitCode int) error {
+	if uiSettings.streamEvents {
+		emitEvent(progressEvent{Event: "summary", Result: result})
+		return cli.Exit("", exitCode)
+	}
+	return cli.Exit(result, exitCode)
+}
@@ -0,0 +1,95 @@
+package main
+
+import (
+	"bytes"
+	"context"
+	"encoding/json"
+	"fmt"
+	"strings"
+	"testing"
+
+	"github.com/google/go-cmp/cmp"
+	"github.com/urfave/cli/v2"
+)
+
+func TestStreamEvents(t *testing.T) {
+	var buf bytes.Buffer
+	savedSettings, savedWriter := uiSettings, eventWriter
+	defer func() { uiSettings, eventWriter = savedSettings, savedWriter }()
+	uiSettings = userInterfaceSettings{isMachineReadable: true, streamEvents: true}
+	eventWriter = &buf
+
+	err := streamStep("rhsm", func(ctx context.Context) error { return nil })(context.Background())
+	if err != nil {
+		t.Fatal(err)
+	}
+	err = streamStep("insights", func(ctx context.Context) error { return fmt.Errorf("failed") })(context.Background())
+	if err == nil || err.Error() != "failed" {
+		t.Fatalf("error of step was not returned: %v", err)
+	}
+	emitSkippedStep(ServiceName)
+	result := ConnectResult{Hostname: "localhost", RHSMConnected: true, format: "ndjson"}
+	exitErr := exitWithResult(result, 1)
+	if exitCoder, ok := exitErr.(cli.ExitCoder); !ok || exitCoder.ExitCode() != 1 || exitErr.Error() != "" {
+		t.Errorf("unexpected exit error: %#v", exitErr)
+	}
+
+	type event struct {
+		Event      string                 `json:"event"`
+		Step       string                 `json:"step"`
+		DurationMs *int64                 `json:"duration_ms"`
+		Skipped    bool                   `json:"skipped"`
+		Error      string                 `json:"error"`
+		Result     map[string]interface{} `json:"result"`
+	}
+	var got []event
+	for _, line := range strings.Split(strings.TrimSuffix(buf.String(), "\n"), "\n") {
+		var e event
+		if err := json.Unmarshal([]byte(line), &e); err != nil {
+			t.Fatalf("invalid line %q: %v", line, err)
+		}
+		if e.Event == "finish" && !e.Skipped && e.DurationMs == nil {
+			t.Errorf("duration is missing in event: %q", line)
+		}
+		e.DurationMs = nil
+		got = append(got, e)
+	}
+	want := []event{
+		{Event: "start", Step: "rhsm"},
+		{Event: "finish", Step: "rhsm"},
+		{Event: "start", Step: "insights"},
+		{Event: "finish", Step: "insights", Error: "failed"},
+		{Event: "finish", Step: ServiceName, Skipped: true},
+		{Event: "summary", Result: map[string]interface{}{
+			"hostname":       "localhost",
+			"uid":            float64(0),
+			"rhsm_connected": true,
+			"features": map[string]interface{}{
+				"content":           map[string]interface{}{"enabled": false, "successful": false},
+				"analytics":         map[string]interface{}{"enabled": false, "successful": false},
+				"remote_management": map[string]interface{}{"enabled": false, "successful": false},
+			},
+			"durations_ms": nil,
+		}},
+	}
+	if diff := cmp.Diff(want, got); diff != "" {
+		t.Errorf("unexpected events: %v", diff)
+	}
+}
+
+func TestStreamEventsDisabled(t *testing.T) {
+	var buf bytes.Buffer
+	savedSettings, savedWriter := uiSettings, eventWriter
+	defer func() { uiSettings, eventWriter = savedSettings, savedWriter }()
+	uiSettings = userInterfaceSettings{isMachineReadable: true}
+	eventWriter = &buf
+
+	_ = streamStep("rhsm", func(ctx context.Context) error { return nil })(context.Background())
+	exitErr := exitWithResult(ConnectResult{format: "json"}, 0)
+	if buf.Len() != 0 {
+		t.Errorf("events were written: %q", buf.String())
+	}
+	if !strings.Contains(exitErr.Error(), `"hostname": ""`) {
+		t.Errorf("result is missing in exit error: %q", exitErr.Error())
+	}
+}
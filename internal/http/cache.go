@@ -0,0 +1,215 @@
+package http
+
+import (
+	"bytes"
+	"crypto/sha256"
+	"encoding/hex"
+	"encoding/json"
+	"fmt"
+	"io"
+	"net/http"
+	"os"
+	"path/filepath"
+	"sort"
+	"sync"
+	"time"
+
+	"github.com/subpop/go-log"
+)
+
+// Cache is a bounded on-disk cache of HTTP responses. Every response is kept
+// in its own file, and the least recently used responses are removed, when
+// the total size of the files exceeds the limit.
+type Cache struct {
+	dir     string
+	maxSize int64
+
+	mu      sync.Mutex
+	size    int64
+	entries map[string]*cacheIndexEntry
+}
+
+// cacheIndexEntry is the in-memory record of a file in the cache directory.
+type cacheIndexEntry struct {
+	size int64
+	used time.Time
+}
+
+// cacheEntry is the on-disk representation of a cached response.
+type cacheEntry struct {
+	URL        string      `json:"url"`
+	StatusCode int         `json:"status_code"`
+	Header     http.Header `json:"header"`
+	Body       []byte      `json:"body"`
+}
+
+// NewCache creates a cache of at most maxSize bytes in dir. The directory is
+// created, when it does not exist, and responses cached by previous processes
+// are reused.
+func NewCache(dir string, maxSize int64) (*Cache, error) {
+	if err := os.MkdirAll(dir, 0700); err != nil {
+		return nil, fmt.Errorf("cannot create cache directory: %w", err)
+	}
+	files, err := os.ReadDir(dir)
+	if err != nil {
+		return nil, fmt.Errorf("cannot read cache directory: %w", err)
+	}
+	cache := &Cache{
+		dir:     dir,
+		maxSize: maxSize,
+		entries: make(map[string]*cacheIndexEntry, len(files)),
+	}
+	for _, file := range files {
+		info, err := file.Info()
+		if err != nil || !info.Mode().IsRegular() || filepath.Ext(file.Name()) != ".json" {
+			continue
+		}
+		key := file.Name()[:len(file.Name())-len(".json")]
+		cache.entries[key] = &cacheIndexEntry{size: info.Size(), used: info.ModTime()}
+		cache.size += info.Size()
+	}
+	cache.mu.Lock()
+	defer cache.mu.Unlock()
+	cache.evict()
+	return cache, nil
+}
+
+// cacheKey returns the name of the cache file of the request.
+func cacheKey(req *http.Request) string {
+	sum := sha256.Sum256([]byte(req.Method + " " + req.URL.String()))
+	return hex.EncodeToString(sum[:])
+}
+
+// path returns the path of the cache file with given key.
+func (c *Cache) path(key string) string {
+	return filepath.Join(c.dir, key+".json")
+}
+
+// get reads the cached response with given key. It returns nil, when there is
+// no such response or it cannot be read.
+func (c *Cache) get(key string) *cacheEntry {
+	c.mu.Lock()
+	_, ok := c.entries[key]
+	c.mu.Unlock()
+	if !ok {
+		return nil
+	}
+
+	data, err := os.ReadFile(c.path(key))
+	if err == nil {
+		var entry cacheEntry
+		if err = json.Unmarshal(data, &entry); err == nil {
+			return &entry
+		}
+	}
+	log.Debugf("cannot read cached response %v: %v", key, err)
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	c.remove(key)
+	return nil
+}
+
+// touch marks the cached response with given key as recently used.
+func (c *Cache) touch(key string) {
+	now := time.Now()
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if entry, ok := c.entries[key]; ok {
+		entry.used = now
+		// The modification time keeps the order of use for other processes.
+		_ = os.Chtimes(c.path(key), now, now)
+	}
+}
+
+// put stores the response under given key and evicts the least recently used
+// responses, when the cache is full.
+func (c *Cache) put(key string, entry *cacheEntry) {
+	data, err := json.Marshal(entry)
+	if err != nil {
+		log.Debugf("cannot encode cached response of %v: %v", entry.URL, err)
+		return
+	}
+	size := int64(len(data))
+	if size > c.maxSize {
+		return
+	}
+
+	// The file is renamed into place, so concurrent readers never see
+	// a partially written response.
+	file, err := os.CreateTemp(c.dir, ".tmp-")
+	if err != nil {
+		log.Debugf("cannot cache response of %v: %v", entry.URL, err)
+		return
+	}
+	_, err = file.Write(data)
+	if closeErr := file.Close(); err == nil {
+		err = closeErr
+	}
+	if err == nil {
+		err = os.Rename(file.Name(), c.path(key))
+	}
+	if err != nil {
+		_ = os.Remove(file.Name())
+		log.Debugf("cannot cache response of %v: %v", entry.URL, err)
+		return
+	}
+
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if old, ok := c.entries[key]; ok {
+		c.size -= old.size
+	}
+	c.entries[key] = &cacheIndexEntry{size: size, used: time.Now()}
+	c.size += size
+	c.evict()
+}
+
+// remove deletes the cached response with given key. The caller has to hold
+// the mutex.
+func (c *Cache) remove(key string) {
+	entry, ok := c.entries[key]
+	if !ok {
+		return
+	}
+	if err := os.Remove(c.path(key)); err != nil && !os.IsNotExist(err) {
+		log.Debugf("cannot remove cached response %v: %v", key, err)
+	}
+	c.size -= entry.size
+	delete(c.entries, key)
+}
+
+// evict removes the least recently used responses until the cache fits into
+// its limit. The caller has to hold the mutex.
+func (c *Cache) evict() {
+	if c.size <= c.maxSize {
+		return
+	}
+	keys := make([]string, 0, len(c.entries))
+	for key := range c.entries {
+		keys = append(keys, key)
+	}
+	sort.Slice(keys, func(i, j int) bool {
+		return c.entries[keys[i]].used.Before(c.entries[keys[j]].used)
+	})
+	for _, key := range keys {
+		if c.size <= c.maxSize {
+			break
+		}
+		c.remove(key)
+	}
+}
+
+// response creates a response of the request from the cached one.
+func (entry *cacheEntry) response(req *http.Request) *http.Response {
+	return &http.Response{
+		Status:        fmt.Sprintf("%d %s", entry.StatusCode, http.StatusText(entry.StatusCode)),
+		StatusCode:    entry.StatusCode,
+		Proto:         "HTTP/1.1",
+		ProtoMajor:    1,
+		ProtoMinor:    1,
+		Header:        entry.Header.Clone(),
+		Body:          io.NopCloser(bytes.NewReader(entry.Body)),
+		ContentLength: int64(len(entry.Body)),
+		Request:       req,
+	}
+}
@@ -1,34 +1,324 @@
+// Package http provides the HTTP client rhc uses to talk to platform services.
+// All requests share one pool of keep-alive connections, failed idempotent
+// requests are retried with jittered exponential backoff, and responses to GET
+// requests can be kept in an on-disk cache and revalidated with conditional
+// requests.
 package http
 
 import (
+	"bytes"
+	"context"
 	"crypto/tls"
 	"fmt"
+	"io"
+	"math/rand"
 	"net/http"
+	"net/http/httptrace"
+	"strings"
+	"sync"
+	"time"
+
+	"github.com/redhatinsights/rhc/internal/trace"
+)
+
+// Defaults of the retry policy of a new Client.
+const (
+	DefaultRetries    = 2
+	DefaultRetryDelay = 250 * time.Millisecond
 )
 
+// Client is an HTTP client with pooled connections, retries and an optional
+// response cache. It is safe for concurrent use, and one Client should be
+// shared by all requests to the same services.
 type Client struct {
 	client http.Client
+
+	// Cache, when not nil, keeps responses to GET requests carrying an ETag
+	// or a Last-Modified header. Cached responses are revalidated with
+	// If-None-Match and If-Modified-Since.
+	Cache *Cache
+	// Retries is the number of times a request with an idempotent method is
+	// repeated after a network error or a temporary server error.
+	Retries int
+	// RetryDelay is the base delay before the first retry. It doubles with
+	// every further retry, and a random jitter is applied to it.
+	RetryDelay time.Duration
+	// OnTiming, when not nil, is called after every attempt of a request.
+	OnTiming func(timing Timing)
 }
 
-func NewHTTPClient(tlsConfig *tls.Config) *Client {
+// Timing describes the phases of one attempt of a request.
+type Timing struct {
+	Method     string
+	URL        string
+	Attempt    int
+	StatusCode int
+	// ReusedConn is true, when an idle connection from the pool was used.
+	ReusedConn bool
+	// Revalidated is true, when the server confirmed the cached response is
+	// still valid.
+	Revalidated  bool
+	DNS          time.Duration
+	Connect      time.Duration
+	TLSHandshake time.Duration
+	// FirstByte is the time from the start of the attempt to the first byte
+	// of the response.
+	FirstByte time.Duration
+	Total     time.Duration
+	Err       error
+}
 
-	// Create a httpClient with the configured tlsConfig.
+// NewHTTPClient creates a Client using tlsConfig for its connections. The
+// connections are kept alive and shared, and HTTP/2 is negotiated when the
+// server supports it.
+func NewHTTPClient(tlsConfig *tls.Config) *Client {
 	// Use the DefaultTransport, as it has some configuration by default.
-	client := http.Client{
-		Transport: http.DefaultTransport.(*http.Transport).Clone(),
+	transport := http.DefaultTransport.(*http.Transport).Clone()
+	if tlsConfig != nil {
+		transport.TLSClientConfig = tlsConfig.Clone()
 	}
-	client.Transport.(*http.Transport).TLSClientConfig = tlsConfig.Clone()
+	// A custom TLS config disables HTTP/2, unless it is forced.
+	transport.ForceAttemptHTTP2 = true
+	transport.MaxIdleConns = 32
+	transport.MaxIdleConnsPerHost = 8
+	transport.IdleConnTimeout = 90 * time.Second
+	transport.TLSHandshakeTimeout = 10 * time.Second
+	transport.ResponseHeaderTimeout = 30 * time.Second
 
 	return &Client{
-		client: client,
+		client:     http.Client{Transport: transport},
+		Retries:    DefaultRetries,
+		RetryDelay: DefaultRetryDelay,
 	}
 }
 
+// Get issues a GET request to url.
 func (c *Client) Get(url string) (*http.Response, error) {
-	req, err := http.NewRequest(http.MethodGet, url, nil)
+	return c.GetContext(context.Background(), url)
+}
+
+// GetContext issues a GET request to url with the given context.
+func (c *Client) GetContext(ctx context.Context, url string) (*http.Response, error) {
+	req, err := http.NewRequestWithContext(ctx, http.MethodGet, url, nil)
 	if err != nil {
 		return nil, fmt.Errorf("cannot create HTTP request: %w", err)
 	}
 
-	return c.client.Do(req)
+	return c.Do(req)
+}
+
+// Do sends the request. Requests with an idempotent method are retried, and
+// GET requests are answered from the cache, when the server confirms the
+// cached response is still valid.
+func (c *Client) Do(req *http.Request) (*http.Response, error) {
+	if c.Cache == nil || req.Method != http.MethodGet || req.Header.Get("Range") != "" {
+		return c.doWithRetries(req, false)
+	}
+
+	key := cacheKey(req)
+	entry := c.Cache.get(key)
+	if entry != nil {
+		req = req.Clone(req.Context())
+		if etag := entry.Header.Get("ETag"); etag != "" {
+			req.Header.Set("If-None-Match", etag)
+		}
+		if lastModified := entry.Header.Get("Last-Modified"); lastModified != "" {
+			req.Header.Set("If-Modified-Since", lastModified)
+		}
+	}
+
+	resp, err := c.doWithRetries(req, entry != nil)
+	if err != nil {
+		return nil, err
+	}
+	if resp.StatusCode == http.StatusNotModified && entry != nil {
+		_, _ = io.Copy(io.Discard, resp.Body)
+		_ = resp.Body.Close()
+		c.Cache.touch(key)
+		return entry.response(req), nil
+	}
+	if resp.StatusCode == http.StatusOK && isCacheable(resp) {
+		return c.store(key, resp)
+	}
+	return resp, nil
+}
+
+// store reads the body of the response and puts the response into the cache.
+// Bodies larger than the cache are passed through without being cached.
+func (c *Client) store(key string, resp *http.Response) (*http.Response, error) {
+	if resp.ContentLength > c.Cache.maxSize {
+		return resp, nil
+	}
+	body, err := io.ReadAll(io.LimitReader(resp.Body, c.Cache.maxSize+1))
+	if err != nil {
+		_ = resp.Body.Close()
+		return nil, fmt.Errorf("cannot read HTTP response: %w", err)
+	}
+	if int64(len(body)) > c.Cache.maxSize {
+		resp.Body = readCloser{io.MultiReader(bytes.NewReader(body), resp.Body), resp.Body}
+		return resp, nil
+	}
+	_ = resp.Body.Close()
+	c.Cache.put(key, &cacheEntry{
+		URL:        resp.Request.URL.String(),
+		StatusCode: resp.StatusCode,
+		Header:     resp.Header,
+		Body:       body,
+	})
+	resp.Body = io.NopCloser(bytes.NewReader(body))
+	return resp, nil
+}
+
+// readCloser reads from one reader and closes another one.
+type readCloser struct {
+	io.Reader
+	io.Closer
+}
+
+// isCacheable returns true, when the response can be revalidated and the
+// server does not forbid storing it.
+func isCacheable(resp *http.Response) bool {
+	if resp.Header.Get("ETag") == "" && resp.Header.Get("Last-Modified") == "" {
+		return false
+	}
+	for _, directive := range resp.Header.Values("Cache-Control") {
+		if strings.Contains(directive, "no-store") {
+			return false
+		}
+	}
+	return true
+}
+
+// doWithRetries sends the request and repeats it, when it fails temporarily
+// and its method is idempotent.
+func (c *Client) doWithRetries(req *http.Request, conditional bool) (*http.Response, error) {
+	ctx := req.Context()
+	retries := c.Retries
+	if !isIdempotent(req) {
+		retries = 0
+	}
+	for attempt := 0; ; attempt++ {
+		resp, err := c.attempt(req, attempt, conditional)
+		if attempt >= retries || !isTemporary(ctx, resp, err) {
+			return resp, err
+		}
+		if resp != nil {
+			_, _ = io.Copy(io.Discard, resp.Body)
+			_ = resp.Body.Close()
+		}
+		timer := time.NewTimer(backoff(c.RetryDelay, attempt))
+		select {
+		case <-ctx.Done():
+			timer.Stop()
+			return nil, ctx.Err()
+		case <-timer.C:
+		}
+	}
+}
+
+// attempt sends the request once in a span, and reports its timing.
+func (c *Client) attempt(req *http.Request, attempt int, conditional bool) (*http.Response, error) {
+	ctx, span := trace.Start(req.Context(), "http "+req.Method+" "+req.URL.Host+req.URL.Path)
+	defer span.End()
+
+	// The hooks can be called from goroutines of the transport, e.g. when
+	// a connection is dialed in parallel to the request.
+	var mu sync.Mutex
+	timing := Timing{Method: req.Method, URL: req.URL.String(), Attempt: attempt}
+	var dnsStart, connectStart, tlsStart time.Time
+	start := time.Now()
+	record := func(f func()) {
+		mu.Lock()
+		defer mu.Unlock()
+		f()
+	}
+	clientTrace := &httptrace.ClientTrace{
+		GotConn: func(info httptrace.GotConnInfo) {
+			record(func() { timing.ReusedConn = info.Reused })
+		},
+		DNSStart: func(httptrace.DNSStartInfo) {
+			record(func() { dnsStart = time.Now() })
+		},
+		DNSDone: func(httptrace.DNSDoneInfo) {
+			record(func() { timing.DNS = time.Since(dnsStart) })
+		},
+		ConnectStart: func(string, string) {
+			record(func() { connectStart = time.Now() })
+		},
+		ConnectDone: func(string, string, error) {
+			record(func() { timing.Connect = time.Since(connectStart) })
+		},
+		TLSHandshakeStart: func() {
+			record(func() { tlsStart = time.Now() })
+		},
+		TLSHandshakeDone: func(tls.ConnectionState, error) {
+			record(func() { timing.TLSHandshake = time.Since(tlsStart) })
+		},
+		GotFirstResponseByte: func() {
+			record(func() { timing.FirstByte = time.Since(start) })
+		},
+	}
+
+	resp, err := c.client.Do(req.WithContext(httptrace.WithClientTrace(ctx, clientTrace)))
+	mu.Lock()
+	result := timing
+	mu.Unlock()
+	result.Total = time.Since(start)
+	result.Err = err
+	span.SetAttribute("attempt", fmt.Sprint(attempt))
+	span.SetAttribute("reused_conn", fmt.Sprint(result.ReusedConn))
+	span.SetError(err)
+	if resp != nil {
+		result.StatusCode = resp.StatusCode
+		result.Revalidated = conditional && resp.StatusCode == http.StatusNotModified
+		span.SetAttribute("status", fmt.Sprint(resp.StatusCode))
+		span.SetAttribute("proto", resp.Proto)
+	}
+	if c.OnTiming != nil {
+		c.OnTiming(result)
+	}
+	return resp, err
+}
+
+// isIdempotent returns true, when the request can be safely repeated.
+func isIdempotent(req *http.Request) bool {
+	switch req.Method {
+	case http.MethodGet, http.MethodHead, http.MethodOptions:
+		return req.Body == nil || req.Body == http.NoBody
+	default:
+		return false
+	}
+}
+
+// isTemporary returns true, when the request failed and can succeed when it
+// is repeated.
+func isTemporary(ctx context.Context, resp *http.Response, err error) bool {
+	if err != nil {
+		return ctx.Err() == nil
+	}
+	switch resp.StatusCode {
+	case http.StatusTooManyRequests, http.StatusBadGateway, http.StatusServiceUnavailable, http.StatusGatewayTimeout:
+		return true
+	default:
+		return false
+	}
+}
+
+// jitter is the source of randomness of backoff delays. It is seeded, so that
+// clients on many hosts do not retry in lockstep.
+var jitter = struct {
+	sync.Mutex
+	*rand.Rand
+}{Rand: rand.New(rand.NewSource(time.Now().UnixNano()))}
+
+// backoff returns the delay before the retry following the attempt: the base
+// delay doubled for every previous retry, of which a random half is used.
+func backoff(base time.Duration, attempt int) time.Duration {
+	delay := base << uint(attempt)
+	if delay <= 0 {
+		return 0
+	}
+	jitter.Lock()
+	defer jitter.Unlock()
+	return delay/2 + time.Duration(jitter.Int63n(int64(delay/2)+1))
 }
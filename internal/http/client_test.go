@@ -0,0 +1,269 @@
+package http
+
+import (
+	"context"
+	"crypto/tls"
+	"fmt"
+	"io"
+	"net/http"
+	"net/http/httptest"
+	"os"
+	"sync"
+	"testing"
+	"time"
+
+	"github.com/google/go-cmp/cmp"
+)
+
+// newTestClient creates a client trusting the TLS server.
+func newTestClient(server *httptest.Server) *Client {
+	tlsConfig := &tls.Config{}
+	if server.TLS != nil {
+		tlsConfig.RootCAs = server.Client().Transport.(*http.Transport).TLSClientConfig.RootCAs
+	}
+	client := NewHTTPClient(tlsConfig)
+	client.RetryDelay = time.Millisecond
+	return client
+}
+
+// get requests the URL and returns the body of the response.
+func get(t *testing.T, client *Client, url string) (int, string) {
+	t.Helper()
+	resp, err := client.Get(url)
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer resp.Body.Close()
+	body, err := io.ReadAll(resp.Body)
+	if err != nil {
+		t.Fatal(err)
+	}
+	return resp.StatusCode, string(body)
+}
+
+func TestHTTP2KeepAlive(t *testing.T) {
+	server := httptest.NewUnstartedServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		fmt.Fprint(w, r.Proto)
+	}))
+	server.EnableHTTP2 = true
+	server.StartTLS()
+	defer server.Close()
+
+	client := newTestClient(server)
+	var timings []Timing
+	client.OnTiming = func(timing Timing) { timings = append(timings, timing) }
+	for i := 0; i < 3; i++ {
+		if _, body := get(t, client, server.URL); body != "HTTP/2.0" {
+			t.Errorf("unexpected protocol: %v", body)
+		}
+	}
+
+	if len(timings) != 3 {
+		t.Fatalf("unexpected number of timings: %v", len(timings))
+	}
+	if timings[0].ReusedConn || timings[0].TLSHandshake == 0 {
+		t.Errorf("first request did not open a connection: %+v", timings[0])
+	}
+	for _, timing := range timings[1:] {
+		if !timing.ReusedConn || timing.TLSHandshake != 0 {
+			t.Errorf("connection was not reused: %+v", timing)
+		}
+	}
+}
+
+func TestCacheRevalidation(t *testing.T) {
+	var mu sync.Mutex
+	var conditional []string
+	version := "1"
+	lastModified := time.Date(2024, 1, 2, 3, 4, 5, 0, time.UTC).Format(http.TimeFormat)
+	server := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		mu.Lock()
+		defer mu.Unlock()
+		conditional = append(conditional, r.Header.Get("If-None-Match")+"|"+r.Header.Get("If-Modified-Since"))
+		switch r.URL.Path {
+		case "/etag":
+			etag := `"` + version + `"`
+			if r.Header.Get("If-None-Match") == etag {
+				w.WriteHeader(http.StatusNotModified)
+				return
+			}
+			w.Header().Set("ETag", etag)
+		case "/last-modified":
+			if r.Header.Get("If-Modified-Since") == lastModified {
+				w.WriteHeader(http.StatusNotModified)
+				return
+			}
+			w.Header().Set("Last-Modified", lastModified)
+		case "/no-store":
+			w.Header().Set("ETag", `"`+version+`"`)
+			w.Header().Set("Cache-Control", "no-store")
+		}
+		fmt.Fprint(w, "version "+version)
+	}))
+	defer server.Close()
+
+	cache, err := NewCache(t.TempDir(), 1<<20)
+	if err != nil {
+		t.Fatal(err)
+	}
+	client := newTestClient(server)
+	client.Cache = cache
+	var revalidated int
+	client.OnTiming = func(timing Timing) {
+		if timing.Revalidated {
+			revalidated++
+		}
+	}
+
+	for _, path := range []string{"/etag", "/etag", "/last-modified", "/last-modified", "/no-store", "/no-store"} {
+		status, body := get(t, client, server.URL+path)
+		if status != http.StatusOK || body != "version 1" {
+			t.Errorf("unexpected response of %v: %v %q", path, status, body)
+		}
+	}
+	mu.Lock()
+	version = "2"
+	mu.Unlock()
+	if _, body := get(t, client, server.URL+"/etag"); body != "version 2" {
+		t.Errorf("changed response was not fetched: %q", body)
+	}
+
+	want := []string{
+		"|", `"1"|`,
+		"|", "|" + lastModified,
+		"|", "|",
+		`"1"|`,
+	}
+	if diff := cmp.Diff(want, conditional); diff != "" {
+		t.Errorf("unexpected conditional requests: %v", diff)
+	}
+	if revalidated != 2 {
+		t.Errorf("got %v revalidated responses, want 2", revalidated)
+	}
+}
+
+func TestCacheEviction(t *testing.T) {
+	server := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		w.Header().Set("ETag", `"`+r.URL.Path+`"`)
+		fmt.Fprint(w, r.URL.Path)
+	}))
+	defer server.Close()
+
+	dir := t.TempDir()
+	cache, err := NewCache(dir, 1<<20)
+	if err != nil {
+		t.Fatal(err)
+	}
+	client := newTestClient(server)
+	client.Cache = cache
+
+	get(t, client, server.URL+"/a")
+	entrySize := cache.size
+	// Make room for two responses only.
+	cache.maxSize = 2*entrySize + entrySize/2
+	get(t, client, server.URL+"/b")
+	get(t, client, server.URL+"/a")
+	get(t, client, server.URL+"/c")
+
+	key := func(path string) string {
+		req, _ := http.NewRequest(http.MethodGet, server.URL+path, nil)
+		return cacheKey(req)
+	}
+	got := make(map[string]bool)
+	for _, path := range []string{"/a", "/b", "/c"} {
+		_, err := os.Stat(cache.path(key(path)))
+		got[path] = err == nil
+	}
+	if diff := cmp.Diff(map[string]bool{"/a": true, "/b": false, "/c": true}, got); diff != "" {
+		t.Errorf("least recently used response was not evicted: %v", diff)
+	}
+
+	reopened, err := NewCache(dir, cache.maxSize)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if len(reopened.entries) != 2 || reopened.size != cache.size {
+		t.Errorf("cache was not reloaded: %v entries, %v bytes", len(reopened.entries), reopened.size)
+	}
+}
+
+func TestRetries(t *testing.T) {
+	var mu sync.Mutex
+	requests := make(map[string]int)
+	server := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		mu.Lock()
+		requests[r.Method+" "+r.URL.Path]++
+		count := requests[r.Method+" "+r.URL.Path]
+		mu.Unlock()
+		switch {
+		case r.URL.Path == "/flaky" && count < 3:
+			w.WriteHeader(http.StatusServiceUnavailable)
+		case r.URL.Path == "/down":
+			w.WriteHeader(http.StatusBadGateway)
+		case r.URL.Path == "/missing":
+			w.WriteHeader(http.StatusNotFound)
+		}
+	}))
+	defer server.Close()
+
+	client := newTestClient(server)
+	tests := []struct {
+		method     string
+		path       string
+		wantStatus int
+		wantCount  int
+	}{
+		{method: http.MethodGet, path: "/flaky", wantStatus: http.StatusOK, wantCount: 3},
+		{method: http.MethodGet, path: "/down", wantStatus: http.StatusBadGateway, wantCount: 3},
+		{method: http.MethodGet, path: "/missing", wantStatus: http.StatusNotFound, wantCount: 1},
+		{method: http.MethodPost, path: "/down", wantStatus: http.StatusBadGateway, wantCount: 1},
+	}
+	for _, test := range tests {
+		t.Run(test.method+" "+test.path, func(t *testing.T) {
+			req, err := http.NewRequest(test.method, server.URL+test.path, nil)
+			if err != nil {
+				t.Fatal(err)
+			}
+			resp, err := client.Do(req)
+			if err != nil {
+				t.Fatal(err)
+			}
+			resp.Body.Close()
+			if resp.StatusCode != test.wantStatus {
+				t.Errorf("got status %v, want %v", resp.StatusCode, test.wantStatus)
+			}
+			mu.Lock()
+			defer mu.Unlock()
+			if count := requests[test.method+" "+test.path]; count != test.wantCount {
+				t.Errorf("got %v requests, want %v", count, test.wantCount)
+			}
+		})
+	}
+}
+
+func TestRetriesCanceled(t *testing.T) {
+	server := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		w.WriteHeader(http.StatusServiceUnavailable)
+	}))
+	defer server.Close()
+
+	client := newTestClient(server)
+	client.Retries = 10
+	client.RetryDelay = time.Hour
+	ctx, cancel := context.WithTimeout(context.Background(), 50*time.Millisecond)
+	defer cancel()
+	if _, err := client.GetContext(ctx, server.URL); err != context.DeadlineExceeded {
+		t.Errorf("backoff was not interrupted: %v", err)
+	}
+}
+
+func TestBackoff(t *testing.T) {
+	for attempt := 0; attempt < 4; attempt++ {
+		full := 100 * time.Millisecond << uint(attempt)
+		for i := 0; i < 100; i++ {
+			if delay := backoff(100*time.Millisecond, attempt); delay < full/2 || delay > full {
+				t.Fatalf("delay %v of attempt %v is out of range", delay, attempt)
+			}
+		}
+	}
+}
@@ -0,0 +1,103 @@
+package http
+
+import (
+	"context"
+	"crypto/tls"
+	"fmt"
+	"net"
+	"net/http"
+	"net/url"
+	"time"
+)
+
+// Stages of a probe, in the order they are run.
+const (
+	StageDNS     = "dns"
+	StageConnect = "connect"
+	StageTLS     = "tls"
+)
+
+// ProbeResult describes a probe of a network endpoint.
+type ProbeResult struct {
+	// Address is the probed endpoint in the form host:port.
+	Address string
+	// IP is the address the connection was established to.
+	IP           string
+	DNS          time.Duration
+	Connect      time.Duration
+	TLSHandshake time.Duration
+	Total        time.Duration
+	// Stage is the stage, which failed, when Err is not nil.
+	Stage string
+	Err   error
+}
+
+// Probe checks that the endpoint at address (host:port) is reachable: it
+// resolves the host, connects to it over TCP and, when tlsConfig is not nil,
+// it performs a TLS handshake. The connection is closed right after that, no
+// request is sent. Every resolved address is tried until a connection is
+// established, and the probe stops, when ctx is done.
+func Probe(ctx context.Context, address string, tlsConfig *tls.Config) ProbeResult {
+	result := ProbeResult{Address: address}
+	start := time.Now()
+
+	done := func() ProbeResult {
+		result.Total = time.Since(start)
+		return result
+	}
+	fail := func(stage string, err error) ProbeResult {
+		result.Stage = stage
+		result.Err = err
+		return done()
+	}
+
+	host, port, err := net.SplitHostPort(address)
+	if err != nil {
+		return fail(StageDNS, err)
+	}
+
+	ips, err := net.DefaultResolver.LookupHost(ctx, host)
+	result.DNS = time.Since(start)
+	if err != nil {
+		return fail(StageDNS, err)
+	}
+
+	var dialer net.Dialer
+	var conn net.Conn
+	connectStart := time.Now()
+	for _, ip := range ips {
+		conn, err = dialer.DialContext(ctx, "tcp", net.JoinHostPort(ip, port))
+		if err == nil {
+			result.IP = ip
+			break
+		}
+	}
+	result.Connect = time.Since(connectStart)
+	if conn == nil {
+		return fail(StageConnect, err)
+	}
+	defer conn.Close()
+
+	if tlsConfig == nil {
+		return done()
+	}
+	config := tlsConfig.Clone()
+	if config.ServerName == "" {
+		config.ServerName = host
+	}
+	tlsConn := tls.Client(conn, config)
+	handshakeStart := time.Now()
+	err = tlsConn.HandshakeContext(ctx)
+	result.TLSHandshake = time.Since(handshakeStart)
+	if err != nil {
+		return fail(StageTLS, fmt.Errorf("TLS handshake failed: %w", err))
+	}
+	return done()
+}
+
+// ProxyURL returns the URL of the proxy server, which is used for HTTPS
+// connections to address (host:port) according to the HTTPS_PROXY and
+// NO_PROXY environment variables. It returns nil, when no proxy is used.
+func ProxyURL(address string) (*url.URL, error) {
+	return http.ProxyFromEnvironment(&http.Request{URL: &url.URL{Scheme: "https", Host: address}})
+}
@@ -0,0 +1,73 @@
+package http
+
+import (
+	"context"
+	"crypto/tls"
+	"net"
+	"net/http"
+	"net/http/httptest"
+	"strings"
+	"testing"
+	"time"
+)
+
+func TestProbe(t *testing.T) {
+	tlsServer := httptest.NewTLSServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {}))
+	defer tlsServer.Close()
+	server := httptest.NewServer(http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {}))
+	defer server.Close()
+	// Port of a closed listener refuses connections
+	listener, err := net.Listen("tcp", "127.0.0.1:0")
+	if err != nil {
+		t.Fatal(err)
+	}
+	closedAddress := listener.Addr().String()
+	listener.Close()
+
+	address := func(server *httptest.Server) string {
+		return strings.TrimPrefix(strings.TrimPrefix(server.URL, "https://"), "http://")
+	}
+	tlsConfig := &tls.Config{InsecureSkipVerify: true}
+
+	tests := []struct {
+		description string
+		address     string
+		tlsConfig   *tls.Config
+		wantStage   string
+	}{
+		{description: "tls", address: address(tlsServer), tlsConfig: tlsConfig},
+		{description: "tcp", address: address(server)},
+		{description: "not tls", address: address(server), tlsConfig: tlsConfig, wantStage: StageTLS},
+		{description: "refused", address: closedAddress, wantStage: StageConnect},
+		{description: "missing port", address: "localhost", wantStage: StageDNS},
+	}
+
+	for _, test := range tests {
+		t.Run(test.description, func(t *testing.T) {
+			ctx, cancel := context.WithTimeout(context.Background(), 5*time.Second)
+			defer cancel()
+			result := Probe(ctx, test.address, test.tlsConfig)
+			if result.Stage != test.wantStage {
+				t.Fatalf("got stage %q, want %q: %v", result.Stage, test.wantStage, result.Err)
+			}
+			if test.wantStage != "" {
+				if result.Err == nil {
+					t.Errorf("probe did not fail")
+				}
+				return
+			}
+			if result.Err != nil {
+				t.Fatal(result.Err)
+			}
+			if result.IP != "127.0.0.1" {
+				t.Errorf("unexpected IP: %v", result.IP)
+			}
+			if (test.tlsConfig != nil) != (result.TLSHandshake > 0) {
+				t.Errorf("unexpected TLS handshake time: %v", result.TLSHandshake)
+			}
+			if result.Total < result.DNS+result.Connect+result.TLSHandshake {
+				t.Errorf("total %v is shorter than stages: %+v", result.Total, result)
+			}
+		})
+	}
+}
@@ -0,0 +1,428 @@
+package systemd
+
+import (
+	"context"
+	"fmt"
+	"path/filepath"
+	"strings"
+	"sync"
+	"time"
+
+	"github.com/subpop/go-log"
+)
+
+// Timeouts of waiting for the state of units after their jobs completed. They
+// match StartUnit and StopUnit.
+const (
+	applyStartTimeout = 1 * time.Second
+	applyStopTimeout  = 5 * time.Second
+)
+
+// UnitOp is an operation on one unit applied by Conn.Apply.
+type UnitOp struct {
+	// Unit is the name of the unit.
+	Unit string
+	// Enable or Disable changes the unit file persistently (/etc).
+	Enable  bool
+	Disable bool
+	// Start or Stop queues a job of the unit.
+	Start bool
+	Stop  bool
+	// Wait makes Apply wait until the unit becomes "active" after it was
+	// started, or "inactive" after it was stopped.
+	Wait bool
+	// After lists units of the same Apply, whose jobs have to complete,
+	// before the job of this unit is queued.
+	After []string
+}
+
+// job returns the verb of the job of the operation, or an empty string.
+func (op *UnitOp) job() string {
+	switch {
+	case op.Start:
+		return "start"
+	case op.Stop:
+		return "stop"
+	default:
+		return ""
+	}
+}
+
+// checkUnitOps returns an error, when the operations contradict themselves or
+// their order cannot be satisfied.
+func checkUnitOps(ops []UnitOp) error {
+	jobs := make(map[string]bool, len(ops))
+	for _, op := range ops {
+		if op.Enable && op.Disable {
+			return fmt.Errorf("unit %v cannot be enabled and disabled at once", op.Unit)
+		}
+		if op.Start && op.Stop {
+			return fmt.Errorf("unit %v cannot be started and stopped at once", op.Unit)
+		}
+		if _, seen := jobs[op.Unit]; seen {
+			return fmt.Errorf("unit %v is listed more than once", op.Unit)
+		}
+		jobs[op.Unit] = op.job() != ""
+	}
+	for _, op := range ops {
+		for _, unit := range op.After {
+			if !jobs[unit] {
+				return fmt.Errorf("unit %v is ordered after %v, which has no job", op.Unit, unit)
+			}
+		}
+	}
+
+	// Remove operations, whose units are ordered after removed units only,
+	// until nothing can be removed. The remaining operations form a cycle.
+	ordered := make(map[string]bool, len(ops))
+	for changed := true; changed; {
+		changed = false
+		for _, op := range ops {
+			if ordered[op.Unit] {
+				continue
+			}
+			ready := true
+			for _, unit := range op.After {
+				ready = ready && ordered[unit]
+			}
+			if ready {
+				ordered[op.Unit] = true
+				changed = true
+			}
+		}
+	}
+	if len(ordered) < len(ops) {
+		return fmt.Errorf("order of units is cyclic")
+	}
+	return nil
+}
+
+// Apply enables and disables unit files, and starts and stops units, as one
+// transaction. All unit files are changed in one call for each direction, and
+// systemd is reloaded once. The jobs are queued concurrently, as soon as the
+// jobs of units they are ordered after complete, and their completion and the
+// changes of unit states are received from the shared signal subscription.
+//
+// When any operation fails, the changes already made are rolled back: units
+// started by Apply are stopped, stopped units are started, and unit file
+// changes are reverted. The returned error describes all failed operations.
+func (c *Conn) Apply(ops []UnitOp) error {
+	if err := checkUnitOps(ops); err != nil {
+		return err
+	}
+	tx := &transaction{conn: c, ops: ops}
+	err := tx.run()
+	if err == nil {
+		return nil
+	}
+	if rollbackErr := tx.rollback(); rollbackErr != nil {
+		return fmt.Errorf("%v; rollback failed: %v", err, rollbackErr)
+	}
+	return err
+}
+
+// transaction records the changes made by Apply, so they can be rolled back.
+type transaction struct {
+	conn *Conn
+	ops  []UnitOp
+
+	// enabled and disabled are the units whose unit files were changed.
+	enabled  []string
+	disabled []string
+	// started and stopped are the units whose active state was changed.
+	started []string
+	stopped []string
+}
+
+func (tx *transaction) run() error {
+	if err := tx.changeUnitFiles(); err != nil {
+		return err
+	}
+	return tx.runJobs()
+}
+
+// changeUnitFiles enables and disables the unit files and reloads systemd,
+// when any unit file was changed.
+func (tx *transaction) changeUnitFiles() error {
+	var enable, disable []string
+	for _, op := range tx.ops {
+		if op.Enable {
+			enable = append(enable, op.Unit)
+		}
+		if op.Disable {
+			disable = append(disable, op.Unit)
+		}
+	}
+
+	c := tx.conn
+	if len(enable) > 0 {
+		_, changes, err := c.conn.EnableUnitFilesContext(c.ctx, enable, false, true)
+		if err != nil {
+			return fmt.Errorf("cannot enable units %v: %v", strings.Join(enable, ", "), err)
+		}
+		for _, change := range changes {
+			tx.enabled = appendChangedUnit(tx.enabled, enable, change.Filename, change.Destination)
+		}
+	}
+	if len(disable) > 0 {
+		changes, err := c.conn.DisableUnitFilesContext(c.ctx, disable, false)
+		if err != nil {
+			return fmt.Errorf("cannot disable units %v: %v", strings.Join(disable, ", "), err)
+		}
+		for _, change := range changes {
+			tx.disabled = appendChangedUnit(tx.disabled, disable, change.Filename, change.Destination)
+		}
+	}
+	if len(tx.enabled) > 0 || len(tx.disabled) > 0 {
+		if err := c.conn.ReloadContext(c.ctx); err != nil {
+			return fmt.Errorf("cannot reload systemd: %v", err)
+		}
+	}
+	return nil
+}
+
+// appendChangedUnit appends the unit of the changed symlink to changed, when
+// it is one of the units and it is not there yet. systemd reports only the
+// units, whose unit files were actually changed.
+func appendChangedUnit(changed []string, units []string, filename string, destination string) []string {
+	for _, unit := range units {
+		if unit != filepath.Base(filename) && unit != filepath.Base(destination) {
+			continue
+		}
+		for _, known := range changed {
+			if known == unit {
+				return changed
+			}
+		}
+		return append(changed, unit)
+	}
+	return changed
+}
+
+// jobResult is the outcome of the job of an operation.
+type jobResult struct {
+	op *UnitOp
+	// changed is true, when the job changed the active state of the unit.
+	changed bool
+	err     error
+}
+
+// runJobs queues the jobs of all operations and waits for all of them, even
+// when some of them fail, so the transaction knows every change it made.
+func (tx *transaction) runJobs() error {
+	c := tx.conn
+	var jobs []*UnitOp
+	for i := range tx.ops {
+		if tx.ops[i].job() != "" {
+			jobs = append(jobs, &tx.ops[i])
+		}
+	}
+	if len(jobs) == 0 {
+		return nil
+	}
+
+	// Unit states are watched before they are read, so no change can be
+	// missed between both actions.
+	watches := make(map[string]<-chan string, len(jobs))
+	if err := c.subscribe(); err != nil {
+		log.Debugf("%v, polling unit states", err)
+	} else {
+		for _, op := range jobs {
+			states, unwatch, err := c.WatchUnitState(op.Unit)
+			if err != nil {
+				return err
+			}
+			defer unwatch()
+			watches[op.Unit] = states
+		}
+	}
+	initial := make(map[string]string, len(jobs))
+	for _, op := range jobs {
+		state, err := c.GetUnitState(op.Unit)
+		if err != nil {
+			return fmt.Errorf("cannot get state of unit %v: %v", op.Unit, err)
+		}
+		initial[op.Unit] = state
+	}
+
+	results := make(chan jobResult)
+	queued := make(map[string]bool, len(jobs))
+	finished := make(map[string]bool, len(jobs))
+	failed := make(map[string]bool)
+	var errs []string
+	running := 0
+	for len(finished) < len(jobs) {
+		for _, op := range jobs {
+			if queued[op.Unit] {
+				continue
+			}
+			ready, skipped := true, false
+			for _, unit := range op.After {
+				if failed[unit] {
+					skipped = true
+				}
+				if !finished[unit] {
+					ready = false
+				}
+			}
+			switch {
+			case skipped:
+				// The transaction fails anyway, there is no point
+				// in changing more units.
+				queued[op.Unit] = true
+				finished[op.Unit] = true
+				failed[op.Unit] = true
+			case ready:
+				queued[op.Unit] = true
+				running++
+				go func(op *UnitOp) {
+					results <- tx.runJob(op, initial[op.Unit], watches[op.Unit])
+				}(op)
+			}
+		}
+		if running == 0 {
+			continue
+		}
+
+		result := <-results
+		running--
+		finished[result.op.Unit] = true
+		if result.changed {
+			if result.op.Start {
+				tx.started = append(tx.started, result.op.Unit)
+			} else {
+				tx.stopped = append(tx.stopped, result.op.Unit)
+			}
+		}
+		if result.err != nil {
+			failed[result.op.Unit] = true
+			errs = append(errs, result.err.Error())
+		}
+	}
+
+	if len(errs) > 0 {
+		return fmt.Errorf("%v", strings.Join(errs, "; "))
+	}
+	return nil
+}
+
+// runJob queues the job of the operation and waits for its completion and,
+// when requested, for the expected state of the unit.
+func (tx *transaction) runJob(op *UnitOp, initialState string, states <-chan string) jobResult {
+	c := tx.conn
+	result := jobResult{op: op}
+	wantState, timeout := "active", applyStartTimeout
+	queue := c.conn.StartUnitContext
+	if op.Stop {
+		wantState, timeout = "inactive", applyStopTimeout
+		queue = c.conn.StopUnitContext
+	}
+
+	jobComplete := make(chan string, 1)
+	if _, err := queue(c.ctx, op.Unit, "replace", jobComplete); err != nil {
+		result.err = fmt.Errorf("cannot %v unit %v: %v", op.job(), op.Unit, err)
+		return result
+	}
+	outcome := <-jobComplete
+	// Even a failed job can change the state, e.g. a unit started and then
+	// failed. It is rolled back as if it succeeded.
+	result.changed = initialState != wantState
+	if outcome != "done" {
+		result.err = fmt.Errorf("failed to %v unit %v with reason: %v", op.job(), op.Unit, outcome)
+		return result
+	}
+	if !op.Wait {
+		return result
+	}
+
+	ctx, cancel := context.WithTimeout(c.ctx, timeout)
+	defer cancel()
+	var err error
+	if states == nil {
+		err = c.pollForState(ctx, op.Unit, wantState, timeout)
+	} else {
+		err = waitForStateChange(ctx, c, op.Unit, wantState, states)
+	}
+	if err != nil {
+		result.err = fmt.Errorf("cannot %v unit %v: %v", op.job(), op.Unit, err)
+	}
+	return result
+}
+
+// waitForStateChange waits until the unit gets into the wanted state. The
+// current state is read, because the change could have been signaled before
+// the job completed.
+func waitForStateChange(ctx context.Context, c *Conn, unit string, wantState string, states <-chan string) error {
+	state, err := c.GetUnitState(unit)
+	if err != nil {
+		return fmt.Errorf("cannot get unit state: %v", err)
+	}
+	for state != wantState {
+		select {
+		case <-ctx.Done():
+			return fmt.Errorf("timed out waiting for unit state '%v'", wantState)
+		case state = <-states:
+		}
+	}
+	return nil
+}
+
+// rollback reverts the changes recorded by the transaction in the reverse
+// order: the active states of units first, and the unit files last.
+func (tx *transaction) rollback() error {
+	c := tx.conn
+	var errs []string
+	var wg sync.WaitGroup
+	var mu sync.Mutex
+	revert := func(unit string, start bool) {
+		defer wg.Done()
+		queue, verb := c.conn.StopUnitContext, "stop"
+		if start {
+			queue, verb = c.conn.StartUnitContext, "start"
+		}
+		jobComplete := make(chan string, 1)
+		_, err := queue(c.ctx, unit, "replace", jobComplete)
+		if err == nil {
+			if result := <-jobComplete; result != "done" {
+				err = fmt.Errorf("job %v", result)
+			}
+		}
+		if err != nil {
+			mu.Lock()
+			defer mu.Unlock()
+			errs = append(errs, fmt.Sprintf("cannot %v unit %v: %v", verb, unit, err))
+		}
+	}
+	for _, unit := range tx.started {
+		log.Debugf("rolling back start of unit %v", unit)
+		wg.Add(1)
+		go revert(unit, false)
+	}
+	for _, unit := range tx.stopped {
+		log.Debugf("rolling back stop of unit %v", unit)
+		wg.Add(1)
+		go revert(unit, true)
+	}
+	wg.Wait()
+
+	if len(tx.enabled) > 0 {
+		if _, err := c.conn.DisableUnitFilesContext(c.ctx, tx.enabled, false); err != nil {
+			errs = append(errs, fmt.Sprintf("cannot disable units %v: %v", strings.Join(tx.enabled, ", "), err))
+		}
+	}
+	if len(tx.disabled) > 0 {
+		if _, _, err := c.conn.EnableUnitFilesContext(c.ctx, tx.disabled, false, true); err != nil {
+			errs = append(errs, fmt.Sprintf("cannot enable units %v: %v", strings.Join(tx.disabled, ", "), err))
+		}
+	}
+	if len(tx.enabled) > 0 || len(tx.disabled) > 0 {
+		if err := c.conn.ReloadContext(c.ctx); err != nil {
+			errs = append(errs, fmt.Sprintf("cannot reload systemd: %v", err))
+		}
+	}
+
+	if len(errs) > 0 {
+		return fmt.Errorf("%v", strings.Join(errs, "; "))
+	}
+	return nil
+}
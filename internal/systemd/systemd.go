@@ -6,6 +6,8 @@ package systemd
 import (
 	"context"
 	"fmt"
+	"strings"
+	"sync"
 	"time"
 
 	systemd "github.com/coreos/go-systemd/v22/dbus"
@@ -19,9 +21,32 @@ const (
 	ConnectionTypeUser
 )
 
+// dbusConn is the subset of the go-systemd D-Bus API used by Conn.
+type dbusConn interface {
+	Close()
+	ReloadContext(ctx context.Context) error
+	EnableUnitFilesContext(ctx context.Context, files []string, runtime bool, force bool) (bool, []systemd.EnableUnitFileChange, error)
+	DisableUnitFilesContext(ctx context.Context, files []string, runtime bool) ([]systemd.DisableUnitFileChange, error)
+	LinkUnitFilesContext(ctx context.Context, files []string, runtime bool, force bool) ([]systemd.LinkUnitFileChange, error)
+	StartUnitContext(ctx context.Context, name string, mode string, ch chan<- string) (int, error)
+	StopUnitContext(ctx context.Context, name string, mode string, ch chan<- string) (int, error)
+	GetUnitPropertyContext(ctx context.Context, unit string, propertyName string) (*systemd.Property, error)
+	Subscribe() error
+	SetPropertiesSubscriber(updateCh chan<- *systemd.PropertiesUpdate, errCh chan<- error)
+}
+
 type Conn struct {
 	ctx  context.Context
-	conn *systemd.Conn
+	conn dbusConn
+
+	// subscribeOnce guards the subscription to unit property changes, which
+	// is established on first use and kept until the connection is closed.
+	subscribeOnce sync.Once
+	subscribeErr  error
+	done          chan struct{}
+
+	mu       sync.Mutex
+	watchers map[string]map[chan string]struct{}
 }
 
 // NewConnectionContext creates a new connection to the given systemd service.
@@ -37,13 +62,20 @@ func NewConnectionContext(ctx context.Context, connectionType ConnectionType) (*
 		return nil, fmt.Errorf("cannot establish connection to systemd: %v", err)
 	}
 
+	return newConn(ctx, conn), nil
+}
+
+func newConn(ctx context.Context, conn dbusConn) *Conn {
 	return &Conn{
-		ctx:  ctx,
-		conn: conn,
-	}, nil
+		ctx:      ctx,
+		conn:     conn,
+		done:     make(chan struct{}),
+		watchers: make(map[string]map[chan string]struct{}),
+	}
 }
 
 func (c *Conn) Close() {
+	close(c.done)
 	c.conn.Close()
 }
 
@@ -69,6 +101,16 @@ func (c *Conn) EnableUnit(name string, activate bool, runtime bool) error {
 	return nil
 }
 
+// EnableUnits enables all named units at once. If runtime is true, the units
+// are enabled for the runtime only (/run). If false, they are enabled
+// persistently (/etc). The units are not started.
+func (c *Conn) EnableUnits(names []string, runtime bool) error {
+	if _, _, err := c.conn.EnableUnitFilesContext(c.ctx, names, runtime, true); err != nil {
+		return fmt.Errorf("cannot enable units %v: %v", strings.Join(names, ", "), err)
+	}
+	return nil
+}
+
 // StartUnit starts the named unit. If wait is true, the method waits until the
 // unit state becomes "active".
 func (c *Conn) StartUnit(name string, wait bool) error {
@@ -112,6 +154,16 @@ func (c *Conn) DisableUnit(name string, deactivate bool, runtime bool) error {
 	return nil
 }
 
+// DisableUnits disables all named units at once. If runtime is true, the units
+// are disabled for the runtime only (/run). If false, they are disabled
+// persistently (/etc). The units are not stopped.
+func (c *Conn) DisableUnits(names []string, runtime bool) error {
+	if _, err := c.conn.DisableUnitFilesContext(c.ctx, names, runtime); err != nil {
+		return fmt.Errorf("cannot disable units %v: %v", strings.Join(names, ", "), err)
+	}
+	return nil
+}
+
 // StopUnit stops the named unit. If wait is true, the method waits until the
 // unit state becomes "inactive".
 func (c *Conn) StopUnit(name string, wait bool) error {
@@ -139,7 +191,13 @@ func (c *Conn) StopUnit(name string, wait bool) error {
 
 // GetUnitState checks the given unit's "ActiveState" property.
 func (c *Conn) GetUnitState(name string) (string, error) {
-	prop, err := c.conn.GetUnitPropertyContext(c.ctx, name, "ActiveState")
+	return c.GetUnitStateContext(c.ctx, name)
+}
+
+// GetUnitStateContext checks the given unit's "ActiveState" property. The
+// context limits only this call, not the connection.
+func (c *Conn) GetUnitStateContext(ctx context.Context, name string) (string, error) {
+	prop, err := c.conn.GetUnitPropertyContext(ctx, name, "ActiveState")
 	if err != nil {
 		return "", fmt.Errorf("cannot get unit property 'ActiveState': %v", err)
 	}
@@ -150,24 +208,153 @@ func (c *Conn) GetUnitState(name string) (string, error) {
 	return state, nil
 }
 
-// waitForState checks the unit state, waiting until it matches the given state,
-// or the timeout occurs.
+// GetUnitPropertyContext returns value of the given property of the unit. The
+// context limits only this call, not the connection.
+func (c *Conn) GetUnitPropertyContext(ctx context.Context, name string, property string) (interface{}, error) {
+	prop, err := c.conn.GetUnitPropertyContext(ctx, name, property)
+	if err != nil {
+		return nil, fmt.Errorf("cannot get unit property '%v': %v", property, err)
+	}
+	return prop.Value.Value(), nil
+}
+
+// subscribe asks systemd to emit signals about changes of units and starts
+// dispatching changes of the "ActiveState" property to the unit watchers.
+func (c *Conn) subscribe() error {
+	c.subscribeOnce.Do(func() {
+		if err := c.conn.Subscribe(); err != nil {
+			c.subscribeErr = fmt.Errorf("cannot subscribe to systemd signals: %v", err)
+			return
+		}
+		// go-systemd blocks its signal dispatching until updates are received,
+		// so the channels have to be drained for the whole life of the connection.
+		updates := make(chan *systemd.PropertiesUpdate, 64)
+		errs := make(chan error, 1)
+		c.conn.SetPropertiesSubscriber(updates, errs)
+		go func() {
+			for {
+				select {
+				case <-c.done:
+					return
+				case err := <-errs:
+					log.Debugf("cannot receive systemd signal: %v", err)
+				case update := <-updates:
+					c.dispatch(update)
+				}
+			}
+		}()
+	})
+	return c.subscribeErr
+}
+
+// dispatch sends the new "ActiveState" of the unit to all its watchers. A slow
+// watcher gets only the most recent state.
+func (c *Conn) dispatch(update *systemd.PropertiesUpdate) {
+	variant, has := update.Changed["ActiveState"]
+	if !has {
+		return
+	}
+	var state string
+	if err := variant.Store(&state); err != nil {
+		return
+	}
+
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	for ch := range c.watchers[update.UnitName] {
+		select {
+		case <-ch:
+		default:
+		}
+		ch <- state
+	}
+}
+
+// WatchUnitState returns a channel receiving new values of the unit's
+// "ActiveState" property. The returned function has to be called, when the
+// channel is no longer used.
+func (c *Conn) WatchUnitState(unit string) (<-chan string, func(), error) {
+	if err := c.subscribe(); err != nil {
+		return nil, nil, err
+	}
+	ch := make(chan string, 1)
+	c.mu.Lock()
+	if c.watchers[unit] == nil {
+		c.watchers[unit] = make(map[chan string]struct{})
+	}
+	c.watchers[unit][ch] = struct{}{}
+	c.mu.Unlock()
+
+	unwatch := func() {
+		c.mu.Lock()
+		defer c.mu.Unlock()
+		delete(c.watchers[unit], ch)
+		if len(c.watchers[unit]) == 0 {
+			delete(c.watchers, unit)
+		}
+	}
+	return ch, unwatch, nil
+}
+
+// waitForState waits until the unit state matches the given state, or the
+// timeout occurs. The state is checked once, and then changes are received as
+// D-Bus signals. When it is not possible to subscribe to the signals, the state
+// is polled with increasing interval.
 func (c *Conn) waitForState(unit string, wantState string, timeout time.Duration) error {
-	after := time.After(timeout)
+	ctx, cancel := context.WithTimeout(c.ctx, timeout)
+	defer cancel()
+
+	states, unwatch, err := c.WatchUnitState(unit)
+	if err != nil {
+		log.Debugf("%v, polling unit state", err)
+		return c.pollForState(ctx, unit, wantState, timeout)
+	}
+	defer unwatch()
+
+	// The watcher is registered before the state is read, so no change can
+	// be missed between both actions.
+	state, err := c.GetUnitState(unit)
+	if err != nil {
+		return fmt.Errorf("cannot get unit state: %v", err)
+	}
+	for state != wantState {
+		log.Tracef("got unit state %v", state)
+		select {
+		case <-ctx.Done():
+			return fmt.Errorf("timed out waiting %v for unit state '%v'", timeout, wantState)
+		case state = <-states:
+		}
+	}
+	return nil
+}
+
+const (
+	pollIntervalMin = 10 * time.Millisecond
+	pollIntervalMax = 500 * time.Millisecond
+)
+
+// pollForState checks the unit state with exponentially increasing interval,
+// until it matches the given state, or the context is done.
+func (c *Conn) pollForState(ctx context.Context, unit string, wantState string, timeout time.Duration) error {
+	interval := pollIntervalMin
 	for {
+		state, err := c.GetUnitState(unit)
+		if err != nil {
+			return fmt.Errorf("cannot get unit state: %v", err)
+		}
+		if state == wantState {
+			return nil
+		}
+		log.Tracef("got unit state %v", state)
+
 		select {
-		case <-after:
+		case <-ctx.Done():
 			return fmt.Errorf("timed out waiting %v for unit state '%v'", timeout, wantState)
-		default:
-			state, err := c.GetUnitState(unit)
-			if err != nil {
-				return fmt.Errorf("cannot get unit state: %v", err)
-			}
-			if state == wantState {
-				return nil
-			} else {
-				log.Tracef("got unit state %v", state)
-			}
+		case <-time.After(interval):
+		}
+		interval *= 2
+		if interval > pollIntervalMax {
+			interval = pollIntervalMax
 		}
 	}
 }
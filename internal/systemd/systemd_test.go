@@ -2,10 +2,15 @@ package systemd
 
 import (
 	"context"
+	"fmt"
 	"os"
 	"path/filepath"
+	"sync"
 	"testing"
+	"time"
 
+	systemd "github.com/coreos/go-systemd/v22/dbus"
+	"github.com/godbus/dbus/v5"
 	"github.com/google/go-cmp/cmp"
 	"github.com/google/go-cmp/cmp/cmpopts"
 )
@@ -82,3 +87,365 @@ func TestUnit(t *testing.T) {
 		})
 	}
 }
+
+// fakeConn is a local stand-in for the systemd D-Bus API with any number of
+// units. Jobs complete asynchronously, and they emit changes of unit states
+// like systemd does. Jobs of units listed in failing fail. It records the
+// calls changing units and the completion of jobs, and it counts the calls of
+// GetUnitPropertyContext.
+type fakeConn struct {
+	mu           sync.Mutex
+	states       map[string]string
+	enabled      map[string]bool
+	failing      map[string]bool
+	calls        []string
+	getCalls     int
+	subscribeErr error
+	updates      chan<- *systemd.PropertiesUpdate
+	// barrier is the number of jobs, which have to be queued before any job
+	// completes. released is closed, when they are queued.
+	barrier  int
+	queued   int
+	released chan struct{}
+}
+
+func newFakeConn(failing ...string) *fakeConn {
+	fake := &fakeConn{
+		states:   make(map[string]string),
+		enabled:  make(map[string]bool),
+		failing:  make(map[string]bool),
+		released: make(chan struct{}),
+	}
+	for _, unit := range failing {
+		fake.failing[unit] = true
+	}
+	return fake
+}
+
+func (f *fakeConn) record(call string) {
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	f.calls = append(f.calls, call)
+}
+
+func (f *fakeConn) Close() {}
+func (f *fakeConn) ReloadContext(ctx context.Context) error {
+	f.record("Reload")
+	return nil
+}
+func (f *fakeConn) EnableUnitFilesContext(ctx context.Context, files []string, runtime bool, force bool) (bool, []systemd.EnableUnitFileChange, error) {
+	f.record("EnableUnitFiles " + fmt.Sprint(files))
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	var changes []systemd.EnableUnitFileChange
+	for _, file := range files {
+		if !f.enabled[file] {
+			f.enabled[file] = true
+			changes = append(changes, systemd.EnableUnitFileChange{
+				Type:        "symlink",
+				Filename:    "/etc/systemd/system/multi-user.target.wants/" + file,
+				Destination: "/usr/lib/systemd/system/" + file,
+			})
+		}
+	}
+	return false, changes, nil
+}
+func (f *fakeConn) DisableUnitFilesContext(ctx context.Context, files []string, runtime bool) ([]systemd.DisableUnitFileChange, error) {
+	f.record("DisableUnitFiles " + fmt.Sprint(files))
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	var changes []systemd.DisableUnitFileChange
+	for _, file := range files {
+		if f.enabled[file] {
+			delete(f.enabled, file)
+			changes = append(changes, systemd.DisableUnitFileChange{
+				Type:     "unlink",
+				Filename: "/etc/systemd/system/multi-user.target.wants/" + file,
+			})
+		}
+	}
+	return changes, nil
+}
+func (f *fakeConn) LinkUnitFilesContext(ctx context.Context, files []string, runtime bool, force bool) ([]systemd.LinkUnitFileChange, error) {
+	return nil, nil
+}
+func (f *fakeConn) StartUnitContext(ctx context.Context, name string, mode string, ch chan<- string) (int, error) {
+	return f.queue("StartUnit "+name, name, "active", ch)
+}
+func (f *fakeConn) StopUnitContext(ctx context.Context, name string, mode string, ch chan<- string) (int, error) {
+	return f.queue("StopUnit "+name, name, "inactive", ch)
+}
+
+// queue runs the job in the background. When the barrier is set, the job waits
+// until the barrier is reached. It changes the state of the unit, records the
+// completion, and then it reports the completion of the job.
+func (f *fakeConn) queue(call string, unit string, state string, ch chan<- string) (int, error) {
+	f.record(call)
+	f.mu.Lock()
+	f.queued++
+	if f.queued == f.barrier {
+		close(f.released)
+	}
+	barrier := f.barrier
+	f.mu.Unlock()
+	go func() {
+		if barrier > 0 {
+			<-f.released
+		}
+		f.mu.Lock()
+		result := "done"
+		if state == "active" && f.failing[unit] {
+			state, result = "failed", "failed"
+		}
+		f.mu.Unlock()
+		f.setState(unit, state)
+		f.record("Done " + call)
+		ch <- result
+	}()
+	return 1, nil
+}
+
+func (f *fakeConn) GetUnitPropertyContext(ctx context.Context, unit string, propertyName string) (*systemd.Property, error) {
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	f.getCalls++
+	state := f.states[unit]
+	if state == "" {
+		state = "inactive"
+	}
+	return &systemd.Property{Name: propertyName, Value: dbus.MakeVariant(state)}, nil
+}
+
+func (f *fakeConn) Subscribe() error {
+	return f.subscribeErr
+}
+
+func (f *fakeConn) SetPropertiesSubscriber(updateCh chan<- *systemd.PropertiesUpdate, errCh chan<- error) {
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	f.updates = updateCh
+}
+
+// setState changes the state of the unit and emits the change, when there is
+// a subscriber.
+func (f *fakeConn) setState(unit string, state string) {
+	f.mu.Lock()
+	f.states[unit] = state
+	updates := f.updates
+	f.mu.Unlock()
+	if updates != nil {
+		updates <- &systemd.PropertiesUpdate{
+			UnitName: unit,
+			Changed:  map[string]dbus.Variant{"ActiveState": dbus.MakeVariant(state)},
+		}
+	}
+}
+
+// propertyCalls returns the number of calls of GetUnitPropertyContext.
+func (f *fakeConn) propertyCalls() int {
+	f.mu.Lock()
+	defer f.mu.Unlock()
+	return f.getCalls
+}
+
+func TestWaitForState(t *testing.T) {
+	tests := []struct {
+		description  string
+		subscribeErr error
+		states       []string
+		wantMaxCalls int
+	}{
+		{
+			description:  "already in state",
+			wantMaxCalls: 1,
+		},
+		{
+			description:  "signals",
+			states:       []string{"activating", "reloading", "active"},
+			wantMaxCalls: 1,
+		},
+		{
+			description:  "polling fallback",
+			subscribeErr: fmt.Errorf("subscription refused"),
+			states:       []string{"activating", "active"},
+			wantMaxCalls: 10,
+		},
+	}
+
+	for _, test := range tests {
+		t.Run(test.description, func(t *testing.T) {
+			fake := newFakeConn()
+			fake.subscribeErr = test.subscribeErr
+			if len(test.states) == 0 {
+				fake.states["test.service"] = "active"
+			}
+			conn := newConn(context.Background(), fake)
+			defer conn.Close()
+
+			go func(states []string, signals bool) {
+				for _, state := range states {
+					time.Sleep(50 * time.Millisecond)
+					if !signals {
+						// No one listens for signals, only change the state
+						fake.mu.Lock()
+						fake.states["test.service"] = state
+						fake.mu.Unlock()
+					} else {
+						fake.setState("test.service", state)
+					}
+				}
+			}(test.states, test.subscribeErr == nil)
+
+			if err := conn.waitForState("test.service", "active", 5*time.Second); err != nil {
+				t.Fatal(err)
+			}
+			if got := fake.propertyCalls(); got > test.wantMaxCalls {
+				t.Errorf("got %v D-Bus calls, want at most %v", got, test.wantMaxCalls)
+			}
+		})
+	}
+}
+
+func TestWaitForStateTimeout(t *testing.T) {
+	fake := newFakeConn()
+	conn := newConn(context.Background(), fake)
+	defer conn.Close()
+
+	err := conn.waitForState("test.service", "active", 100*time.Millisecond)
+	if err == nil {
+		t.Fatal("expected timeout error")
+	}
+	if got := fake.propertyCalls(); got != 1 {
+		t.Errorf("got %v D-Bus calls, want 1", got)
+	}
+}
+
+// activateOps are the operations activating rhc units.
+var activateOps = []UnitOp{
+	{Unit: "rhc-canonical-facts.timer", Enable: true, Start: true, Wait: true},
+	{Unit: "rhc-canonical-facts.service", Start: true},
+	{Unit: "yggdrasil.service", Enable: true, Start: true, Wait: true, After: []string{"rhc-canonical-facts.service"}},
+	{Unit: "rhc-extra.service", Start: true, Wait: true},
+}
+
+func TestApply(t *testing.T) {
+	fake := newFakeConn()
+	// No job completes before the three jobs without order are queued, so
+	// Apply does not return, unless it queues them at once.
+	fake.barrier = 3
+	conn := newConn(context.Background(), fake)
+	defer conn.Close()
+
+	done := make(chan error, 1)
+	go func() { done <- conn.Apply(activateOps) }()
+	select {
+	case err := <-done:
+		if err != nil {
+			t.Fatal(err)
+		}
+	case <-time.After(5 * time.Second):
+		fake.mu.Lock()
+		defer fake.mu.Unlock()
+		t.Fatalf("jobs were not queued at once: %v", fake.calls)
+	}
+
+	wantStates := map[string]string{
+		"rhc-canonical-facts.timer":   "active",
+		"rhc-canonical-facts.service": "active",
+		"yggdrasil.service":           "active",
+		"rhc-extra.service":           "active",
+	}
+	if diff := cmp.Diff(wantStates, fake.states); diff != "" {
+		t.Errorf("unexpected unit states: %v", diff)
+	}
+	if diff := cmp.Diff(map[string]bool{"rhc-canonical-facts.timer": true, "yggdrasil.service": true}, fake.enabled); diff != "" {
+		t.Errorf("unexpected enabled units: %v", diff)
+	}
+
+	index := make(map[string]int, len(fake.calls))
+	var reloads int
+	for i, call := range fake.calls {
+		index[call] = i
+		if call == "Reload" {
+			reloads++
+		}
+	}
+	if reloads != 1 {
+		t.Errorf("systemd was reloaded %v times, want 1", reloads)
+	}
+	// yggdrasil.service is queued only after the canonical facts are
+	// generated.
+	factsDone, factsOK := index["Done StartUnit rhc-canonical-facts.service"]
+	yggdrasil, yggdrasilOK := index["StartUnit yggdrasil.service"]
+	if !factsOK || !yggdrasilOK || yggdrasil < factsDone {
+		t.Errorf("yggdrasil.service was started before rhc-canonical-facts.service finished: %v", fake.calls)
+	}
+}
+
+func TestApplyRollback(t *testing.T) {
+	fake := newFakeConn("rhc-extra.service")
+	// The timer was enabled and active before, it must stay so.
+	fake.enabled["rhc-canonical-facts.timer"] = true
+	fake.states["rhc-canonical-facts.timer"] = "active"
+	conn := newConn(context.Background(), fake)
+	defer conn.Close()
+
+	err := conn.Apply(activateOps)
+	if err == nil || err.Error() != "failed to start unit rhc-extra.service with reason: failed" {
+		t.Fatalf("unexpected error: %v", err)
+	}
+
+	wantStates := map[string]string{
+		"rhc-canonical-facts.timer":   "active",
+		"rhc-canonical-facts.service": "inactive",
+		"yggdrasil.service":           "inactive",
+		"rhc-extra.service":           "inactive",
+	}
+	if diff := cmp.Diff(wantStates, fake.states); diff != "" {
+		t.Errorf("unit states were not rolled back: %v", diff)
+	}
+	if diff := cmp.Diff(map[string]bool{"rhc-canonical-facts.timer": true}, fake.enabled); diff != "" {
+		t.Errorf("unit files were not rolled back: %v", diff)
+	}
+}
+
+func TestApplyInvalid(t *testing.T) {
+	tests := []struct {
+		description string
+		ops         []UnitOp
+		wantError   string
+	}{
+		{
+			description: "start and stop",
+			ops:         []UnitOp{{Unit: "a.service", Start: true, Stop: true}},
+			wantError:   "unit a.service cannot be started and stopped at once",
+		},
+		{
+			description: "unknown order",
+			ops:         []UnitOp{{Unit: "a.service", Start: true, After: []string{"b.service"}}},
+			wantError:   "unit a.service is ordered after b.service, which has no job",
+		},
+		{
+			description: "cyclic order",
+			ops: []UnitOp{
+				{Unit: "a.service", Start: true, After: []string{"b.service"}},
+				{Unit: "b.service", Start: true, After: []string{"a.service"}},
+			},
+			wantError: "order of units is cyclic",
+		},
+	}
+	for _, test := range tests {
+		t.Run(test.description, func(t *testing.T) {
+			fake := newFakeConn()
+			conn := newConn(context.Background(), fake)
+			defer conn.Close()
+			err := conn.Apply(test.ops)
+			if err == nil || err.Error() != test.wantError {
+				t.Errorf("got error %v, want %v", err, test.wantError)
+			}
+			if len(fake.calls) > 0 {
+				t.Errorf("invalid operations were applied: %v", fake.calls)
+			}
+		})
+	}
+}
@@ -0,0 +1,423 @@
+// Package trace records nested, timed spans of the work done by one rhc
+// command. Spans are kept in memory, and they can be returned as a tree of
+// timings or written to a file in the Chrome trace event format or in the
+// OTLP JSON format.
+package trace
+
+import (
+	"context"
+	"crypto/rand"
+	"encoding/hex"
+	"encoding/json"
+	"fmt"
+	"io"
+	"os"
+	"sort"
+	"strconv"
+	"sync"
+	"time"
+)
+
+// Supported formats of files written by Recorder.WriteFile.
+const (
+	FormatChrome = "chrome"
+	FormatOTLP   = "otlp"
+)
+
+// Span is a single timed operation. It is started by Start and it has to be
+// finished by calling End.
+type Span struct {
+	recorder *Recorder
+	id       uint64
+	parentID uint64
+	name     string
+	start    time.Time
+
+	// The fields below are protected by the mutex of the recorder.
+	end   time.Time
+	attrs map[string]string
+	err   string
+}
+
+// Recorder collects spans. It is safe to use it from many goroutines.
+type Recorder struct {
+	mu      sync.Mutex
+	traceID [16]byte
+	spans   []*Span
+}
+
+// DefaultRecorder records spans started by Start, when the context does not
+// carry any span.
+var DefaultRecorder = NewRecorder()
+
+type spanKey struct{}
+
+// NewRecorder returns an empty recorder with a random trace ID.
+func NewRecorder() *Recorder {
+	r := &Recorder{}
+	_, _ = rand.Read(r.traceID[:])
+	return r
+}
+
+// Start starts a new span. It is a child of the span carried by ctx, or a root
+// span of DefaultRecorder, when ctx does not carry any span. The returned
+// context carries the new span.
+func Start(ctx context.Context, name string) (context.Context, *Span) {
+	if parent, ok := ctx.Value(spanKey{}).(*Span); ok {
+		return parent.recorder.start(ctx, parent.id, name)
+	}
+	return DefaultRecorder.start(ctx, 0, name)
+}
+
+// Start starts a new root span recorded by r.
+func (r *Recorder) Start(ctx context.Context, name string) (context.Context, *Span) {
+	return r.start(ctx, 0, name)
+}
+
+func (r *Recorder) start(ctx context.Context, parentID uint64, name string) (context.Context, *Span) {
+	r.mu.Lock()
+	span := &Span{
+		recorder: r,
+		id:       uint64(len(r.spans) + 1),
+		parentID: parentID,
+		name:     name,
+		start:    time.Now(),
+	}
+	r.spans = append(r.spans, span)
+	r.mu.Unlock()
+	return context.WithValue(ctx, spanKey{}, span), span
+}
+
+// Run calls f in a new span. The error returned by f is recorded in the span
+// and returned.
+func Run(ctx context.Context, name string, f func(ctx context.Context) error) error {
+	ctx, span := Start(ctx, name)
+	defer span.End()
+	err := f(ctx)
+	span.SetError(err)
+	return err
+}
+
+// SetAttribute attaches a key-value pair to the span.
+func (s *Span) SetAttribute(key, value string) {
+	s.recorder.mu.Lock()
+	defer s.recorder.mu.Unlock()
+	if s.attrs == nil {
+		s.attrs = make(map[string]string)
+	}
+	s.attrs[key] = value
+}
+
+// SetError marks the span as failed, when err is not nil.
+func (s *Span) SetError(err error) {
+	if err == nil {
+		return
+	}
+	s.recorder.mu.Lock()
+	defer s.recorder.mu.Unlock()
+	s.err = err.Error()
+}
+
+// End finishes the span. Only the first call has any effect.
+func (s *Span) End() {
+	now := time.Now()
+	s.recorder.mu.Lock()
+	defer s.recorder.mu.Unlock()
+	if s.end.IsZero() {
+		s.end = now
+	}
+}
+
+// spanRecord is a snapshot of a span. Spans, which have not ended yet, end at
+// the time of the snapshot.
+type spanRecord struct {
+	id       uint64
+	parentID uint64
+	name     string
+	start    time.Time
+	end      time.Time
+	attrs    map[string]string
+	err      string
+}
+
+// snapshot returns copies of all recorded spans ordered by their start time.
+func (r *Recorder) snapshot() []spanRecord {
+	now := time.Now()
+	r.mu.Lock()
+	records := make([]spanRecord, len(r.spans))
+	for i, span := range r.spans {
+		records[i] = spanRecord{
+			id:       span.id,
+			parentID: span.parentID,
+			name:     span.name,
+			start:    span.start,
+			end:      span.end,
+			err:      span.err,
+		}
+		if records[i].end.IsZero() {
+			records[i].end = now
+		}
+		if len(span.attrs) > 0 {
+			records[i].attrs = make(map[string]string, len(span.attrs))
+			for key, value := range span.attrs {
+				records[i].attrs[key] = value
+			}
+		}
+	}
+	r.mu.Unlock()
+	sort.SliceStable(records, func(i, j int) bool {
+		return records[i].start.Before(records[j].start)
+	})
+	return records
+}
+
+// Timing is the JSON representation of a span and its children. Times are in
+// milliseconds; start_ms is relative to the start of the first span.
+type Timing struct {
+	Name       string            `json:"name"`
+	StartMs    float64           `json:"start_ms"`
+	DurationMs float64           `json:"duration_ms"`
+	Attributes map[string]string `json:"attributes,omitempty"`
+	Error      string            `json:"error,omitempty"`
+	Children   []Timing          `json:"children,omitempty"`
+}
+
+// milliseconds converts d to milliseconds rounded to microseconds.
+func milliseconds(d time.Duration) float64 {
+	return float64(d.Microseconds()) / 1000
+}
+
+// Timings returns the trees of spans recorded by DefaultRecorder.
+func Timings() []Timing {
+	return DefaultRecorder.Timings()
+}
+
+// Timings returns the trees of recorded spans. Roots and children are ordered
+// by their start time.
+func (r *Recorder) Timings() []Timing {
+	records := r.snapshot()
+	if len(records) == 0 {
+		return nil
+	}
+	origin := records[0].start
+	children := make(map[uint64][]spanRecord, len(records))
+	for _, record := range records {
+		children[record.parentID] = append(children[record.parentID], record)
+	}
+	var build func(parentID uint64) []Timing
+	build = func(parentID uint64) []Timing {
+		var timings []Timing
+		for _, record := range children[parentID] {
+			timings = append(timings, Timing{
+				Name:       record.name,
+				StartMs:    milliseconds(record.start.Sub(origin)),
+				DurationMs: milliseconds(record.end.Sub(record.start)),
+				Attributes: record.attrs,
+				Error:      record.err,
+				Children:   build(record.id),
+			})
+		}
+		return timings
+	}
+	return build(0)
+}
+
+// WriteFile writes all recorded spans to filename in the given format.
+func (r *Recorder) WriteFile(filename, format string) error {
+	var write func(w io.Writer) error
+	switch format {
+	case FormatChrome:
+		write = r.WriteChromeTrace
+	case FormatOTLP:
+		write = r.WriteOTLP
+	default:
+		return fmt.Errorf("unsupported trace format: %v", format)
+	}
+	file, err := os.Create(filename)
+	if err != nil {
+		return err
+	}
+	if err := write(file); err != nil {
+		_ = file.Close()
+		return err
+	}
+	return file.Close()
+}
+
+// chromeEvent is a complete event ("ph": "X") of the Chrome trace event format.
+type chromeEvent struct {
+	Name      string            `json:"name"`
+	Phase     string            `json:"ph"`
+	Timestamp float64           `json:"ts"`
+	Duration  float64           `json:"dur"`
+	PID       int               `json:"pid"`
+	TID       int               `json:"tid"`
+	Args      map[string]string `json:"args,omitempty"`
+}
+
+// assignTracks distributes spans to tracks, so that spans on the same track
+// are either disjoint or nested. Concurrent siblings get separate tracks,
+// otherwise trace viewers would draw them as nested. Spans start on the track
+// of their parent, when possible.
+func assignTracks(records []spanRecord) []int {
+	tracks := make([]int, len(records))
+	index := make(map[uint64]int, len(records))
+	isAncestor := func(ancestorID uint64, i int) bool {
+		for id := records[i].parentID; id != 0; {
+			if id == ancestorID {
+				return true
+			}
+			j, ok := index[id]
+			if !ok {
+				return false
+			}
+			id = records[j].parentID
+		}
+		return false
+	}
+	fits := func(i, track int) bool {
+		for j := 0; j < i; j++ {
+			if tracks[j] == track && records[j].end.After(records[i].start) && !isAncestor(records[j].id, i) {
+				return false
+			}
+		}
+		return true
+	}
+	for i, record := range records {
+		index[record.id] = i
+		track := 0
+		if j, ok := index[record.parentID]; ok {
+			track = tracks[j]
+		}
+		if !fits(i, track) {
+			track = 0
+			for !fits(i, track) {
+				track++
+			}
+		}
+		tracks[i] = track
+	}
+	return tracks
+}
+
+// WriteChromeTrace writes all recorded spans in the Chrome trace event format.
+// The file can be opened by chrome://tracing or https://ui.perfetto.dev.
+func (r *Recorder) WriteChromeTrace(w io.Writer) error {
+	records := r.snapshot()
+	tracks := assignTracks(records)
+	pid := os.Getpid()
+	events := make([]chromeEvent, 0, len(records))
+	for i, record := range records {
+		args := record.attrs
+		if record.err != "" {
+			if args == nil {
+				args = make(map[string]string, 1)
+			}
+			args["error"] = record.err
+		}
+		events = append(events, chromeEvent{
+			Name:      record.name,
+			Phase:     "X",
+			Timestamp: float64(record.start.UnixNano()) / 1000,
+			Duration:  float64(record.end.Sub(record.start).Nanoseconds()) / 1000,
+			PID:       pid,
+			TID:       tracks[i] + 1,
+			Args:      args,
+		})
+	}
+	return json.NewEncoder(w).Encode(struct {
+		TraceEvents     []chromeEvent `json:"traceEvents"`
+		DisplayTimeUnit string        `json:"displayTimeUnit"`
+	}{events, "ms"})
+}
+
+// The types below are the subset of the OTLP JSON encoding of traces used by
+// WriteOTLP.
+type otlpValue struct {
+	StringValue string `json:"stringValue"`
+}
+
+type otlpAttribute struct {
+	Key   string    `json:"key"`
+	Value otlpValue `json:"value"`
+}
+
+type otlpStatus struct {
+	Code    int    `json:"code,omitempty"`
+	Message string `json:"message,omitempty"`
+}
+
+type otlpSpan struct {
+	TraceID           string          `json:"traceId"`
+	SpanID            string          `json:"spanId"`
+	ParentSpanID      string          `json:"parentSpanId,omitempty"`
+	Name              string          `json:"name"`
+	Kind              int             `json:"kind"`
+	StartTimeUnixNano string          `json:"startTimeUnixNano"`
+	EndTimeUnixNano   string          `json:"endTimeUnixNano"`
+	Attributes        []otlpAttribute `json:"attributes,omitempty"`
+	Status            otlpStatus      `json:"status"`
+}
+
+type otlpScopeSpans struct {
+	Scope struct {
+		Name string `json:"name"`
+	} `json:"scope"`
+	Spans []otlpSpan `json:"spans"`
+}
+
+type otlpResourceSpans struct {
+	Resource struct {
+		Attributes []otlpAttribute `json:"attributes"`
+	} `json:"resource"`
+	ScopeSpans []otlpScopeSpans `json:"scopeSpans"`
+}
+
+// otlpAttributes converts attributes to OTLP attributes sorted by key.
+func otlpAttributes(attrs map[string]string) []otlpAttribute {
+	var attributes []otlpAttribute
+	for key, value := range attrs {
+		attributes = append(attributes, otlpAttribute{Key: key, Value: otlpValue{value}})
+	}
+	sort.Slice(attributes, func(i, j int) bool {
+		return attributes[i].Key < attributes[j].Key
+	})
+	return attributes
+}
+
+// spanID returns the 8-byte OTLP span ID of the span with given ID.
+func spanID(id uint64) string {
+	return fmt.Sprintf("%016x", id)
+}
+
+// WriteOTLP writes all recorded spans as an OTLP JSON trace export request,
+// which can be sent to an OpenTelemetry collector.
+func (r *Recorder) WriteOTLP(w io.Writer) error {
+	records := r.snapshot()
+	traceID := hex.EncodeToString(r.traceID[:])
+	scope := otlpScopeSpans{Spans: make([]otlpSpan, 0, len(records))}
+	scope.Scope.Name = "rhc"
+	for _, record := range records {
+		span := otlpSpan{
+			TraceID:           traceID,
+			SpanID:            spanID(record.id),
+			Name:              record.name,
+			Kind:              1, // SPAN_KIND_INTERNAL
+			StartTimeUnixNano: strconv.FormatInt(record.start.UnixNano(), 10),
+			EndTimeUnixNano:   strconv.FormatInt(record.end.UnixNano(), 10),
+			Attributes:        otlpAttributes(record.attrs),
+		}
+		if record.parentID != 0 {
+			span.ParentSpanID = spanID(record.parentID)
+		}
+		if record.err != "" {
+			span.Status = otlpStatus{Code: 2, Message: record.err} // STATUS_CODE_ERROR
+		}
+		scope.Spans = append(scope.Spans, span)
+	}
+	resource := otlpResourceSpans{ScopeSpans: []otlpScopeSpans{scope}}
+	resource.Resource.Attributes = otlpAttributes(map[string]string{"service.name": "rhc"})
+	return json.NewEncoder(w).Encode(struct {
+		ResourceSpans []otlpResourceSpans `json:"resourceSpans"`
+	}{[]otlpResourceSpans{resource}})
+}
@@ -0,0 +1,171 @@
+package trace
+
+import (
+	"bytes"
+	"context"
+	"encoding/json"
+	"fmt"
+	"testing"
+	"time"
+
+	"github.com/google/go-cmp/cmp"
+)
+
+// names returns the tree of span names of timings, e.g. "a(b,c(d))".
+func names(timings []Timing) string {
+	var s string
+	for i, timing := range timings {
+		if i > 0 {
+			s += ","
+		}
+		s += timing.Name
+		if len(timing.Children) > 0 {
+			s += "(" + names(timing.Children) + ")"
+		}
+	}
+	return s
+}
+
+func TestTimings(t *testing.T) {
+	r := NewRecorder()
+	ctx, root := r.Start(context.Background(), "connect")
+	stepCtx, step := Start(ctx, "rhsm")
+	_ = Run(stepCtx, "dbus GetUuid", func(ctx context.Context) error {
+		return nil
+	})
+	err := Run(stepCtx, "dbus Register", func(ctx context.Context) error {
+		return fmt.Errorf("invalid credentials")
+	})
+	step.SetAttribute("organization", "donaldduck")
+	step.End()
+	_, service := Start(ctx, "rhcd")
+	service.End()
+	root.End()
+
+	if err == nil {
+		t.Fatal("error of Run was not returned")
+	}
+	timings := r.Timings()
+	if got, want := names(timings), "connect(rhsm(dbus GetUuid,dbus Register),rhcd)"; got != want {
+		t.Errorf("unexpected tree of spans: got %v, want %v", got, want)
+	}
+	rhsm := timings[0].Children[0]
+	if got := rhsm.Children[1].Error; got != "invalid credentials" {
+		t.Errorf("unexpected error of span: %q", got)
+	}
+	if diff := cmp.Diff(map[string]string{"organization": "donaldduck"}, rhsm.Attributes); diff != "" {
+		t.Errorf("unexpected attributes: %v", diff)
+	}
+	if timings[0].StartMs != 0 || rhsm.StartMs < 0 || rhsm.DurationMs > timings[0].DurationMs {
+		t.Errorf("child span is not within its parent: %+v", timings[0])
+	}
+}
+
+func TestTimingsConcurrent(t *testing.T) {
+	r := NewRecorder()
+	ctx, root := r.Start(context.Background(), "status")
+	done := make(chan struct{})
+	for _, name := range []string{"rhsm", "insights", "rhcd"} {
+		go func(name string) {
+			_ = Run(ctx, name, func(ctx context.Context) error {
+				_ = Run(ctx, "probe", func(ctx context.Context) error { return nil })
+				return nil
+			})
+			done <- struct{}{}
+		}(name)
+	}
+	for i := 0; i < 3; i++ {
+		<-done
+	}
+	root.End()
+
+	timings := r.Timings()
+	if len(timings) != 1 || len(timings[0].Children) != 3 {
+		t.Fatalf("unexpected tree of spans: %v", names(timings))
+	}
+	for _, child := range timings[0].Children {
+		if names(child.Children) != "probe" {
+			t.Errorf("unexpected children of %v: %v", child.Name, names(child.Children))
+		}
+	}
+}
+
+func TestAssignTracks(t *testing.T) {
+	origin := time.Now()
+	at := func(ms int) time.Time { return origin.Add(time.Duration(ms) * time.Millisecond) }
+	records := []spanRecord{
+		{id: 1, name: "connect", start: at(0), end: at(100)},
+		{id: 2, parentID: 1, name: "rhsm", start: at(0), end: at(40)},
+		{id: 3, parentID: 2, name: "dbus", start: at(10), end: at(20)},
+		{id: 4, parentID: 1, name: "insights", start: at(40), end: at(90)},
+		{id: 5, parentID: 1, name: "rhcd", start: at(45), end: at(60)},
+		{id: 6, parentID: 5, name: "systemd", start: at(50), end: at(55)},
+	}
+	want := []int{0, 0, 0, 0, 1, 1}
+	if diff := cmp.Diff(want, assignTracks(records)); diff != "" {
+		t.Errorf("unexpected tracks: %v", diff)
+	}
+}
+
+func TestWriteChromeTrace(t *testing.T) {
+	r := NewRecorder()
+	ctx, root := r.Start(context.Background(), "disconnect")
+	_ = Run(ctx, "rhsm", func(ctx context.Context) error { return fmt.Errorf("failed") })
+	root.End()
+
+	var buf bytes.Buffer
+	if err := r.WriteChromeTrace(&buf); err != nil {
+		t.Fatal(err)
+	}
+	var got struct {
+		TraceEvents []chromeEvent `json:"traceEvents"`
+	}
+	if err := json.Unmarshal(buf.Bytes(), &got); err != nil {
+		t.Fatal(err)
+	}
+	if len(got.TraceEvents) != 2 {
+		t.Fatalf("unexpected number of events: %v", len(got.TraceEvents))
+	}
+	for _, event := range got.TraceEvents {
+		if event.Phase != "X" || event.TID != 1 {
+			t.Errorf("unexpected event: %+v", event)
+		}
+	}
+	if got.TraceEvents[1].Args["error"] != "failed" {
+		t.Errorf("error is missing in event: %+v", got.TraceEvents[1])
+	}
+}
+
+func TestWriteOTLP(t *testing.T) {
+	r := NewRecorder()
+	ctx, root := r.Start(context.Background(), "status")
+	_, child := Start(ctx, "rhsm")
+	child.SetAttribute("cached", "true")
+	child.End()
+	root.End()
+
+	var buf bytes.Buffer
+	if err := r.WriteOTLP(&buf); err != nil {
+		t.Fatal(err)
+	}
+	var got struct {
+		ResourceSpans []otlpResourceSpans `json:"resourceSpans"`
+	}
+	if err := json.Unmarshal(buf.Bytes(), &got); err != nil {
+		t.Fatal(err)
+	}
+	spans := got.ResourceSpans[0].ScopeSpans[0].Spans
+	if len(spans) != 2 {
+		t.Fatalf("unexpected number of spans: %v", len(spans))
+	}
+	if len(spans[0].TraceID) != 32 || spans[0].TraceID != spans[1].TraceID {
+		t.Errorf("invalid trace IDs: %v, %v", spans[0].TraceID, spans[1].TraceID)
+	}
+	if spans[0].ParentSpanID != "" || spans[1].ParentSpanID != spans[0].SpanID {
+		t.Errorf("invalid parent of span: %+v", spans[1])
+	}
+	want := []otlpAttribute{{Key: "cached", Value: otlpValue{"true"}}}
+	if diff := cmp.Diff(want, spans[1].Attributes); diff != "" {
+		t.Errorf("unexpected attributes: %v", diff)
+	}
+}
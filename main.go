@@ -2,11 +2,13 @@ package main
 
 import (
 	"fmt"
+	"github.com/redhatinsights/rhc/internal/trace"
 	"github.com/subpop/go-log"
 	"github.com/urfave/cli/v2"
 	"github.com/urfave/cli/v2/altsrc"
 	"os"
 	"strings"
+	"time"
 )
 
 // mainAction is triggered in the case, when no sub-command is specified
@@ -28,16 +30,43 @@ func mainAction(c *cli.Context) error {
 	return nil
 }
 
-// beforeAction is triggered before other actions are triggered
-func beforeAction(c *cli.Context) error {
-	/* Load the configuration values from the config file specified*/
+// commandsWithoutConfig is a set of commands, which do not read the config
+// file. They are run often by timers, and they use only default values of the
+// options stored in the config file.
+var commandsWithoutConfig = map[string]bool{
+	"canonical-facts": true,
+}
+
+// loadConfigFile applies values from the config file to the global options,
+// which were not set on the command line. When --config is not used, the
+// default config file is read, if it exists.
+func loadConfigFile(c *cli.Context) error {
 	filePath := c.String("config")
-	if filePath != "" {
-		inputSource, err := altsrc.NewTomlSourceFromFile(filePath)
+	if filePath == "" {
+		var err error
+		filePath, err = ConfigPath()
 		if err != nil {
 			return err
 		}
-		if err := altsrc.ApplyInputSourceValues(c, inputSource, c.App.Flags); err != nil {
+		if filePath == "" {
+			return nil
+		}
+	}
+	inputSource, err := altsrc.NewTomlSourceFromFile(filePath)
+	if err != nil {
+		return err
+	}
+	return altsrc.ApplyInputSourceValues(c, inputSource, c.App.Flags)
+}
+
+// beforeAction is triggered before other actions are triggered
+func beforeAction(c *cli.Context) error {
+	/* Connections shared by all calls of the command are closed by afterAction */
+	c.Context = withSystemdConn(c.Context)
+
+	/* Load the configuration values from the config file, when the command uses them */
+	if !commandsWithoutConfig[c.Args().First()] {
+		if err := loadConfigFile(c); err != nil {
 			return err
 		}
 	}
@@ -48,6 +77,16 @@ func beforeAction(c *cli.Context) error {
 		KeyFile:  c.String(cliKeyFile),
 	}
 
+	switch c.String("trace-format") {
+	case trace.FormatChrome, trace.FormatOTLP:
+	default:
+		return cli.Exit(
+			fmt.Errorf("unsupported trace format: %s (supported formats: \"%s\", \"%s\")",
+				c.String("trace-format"), trace.FormatChrome, trace.FormatOTLP),
+			ExitCodeUsage,
+		)
+	}
+
 	level, err := log.ParseLevel(config.LogLevel)
 	if err != nil {
 		return cli.Exit(err, 1)
@@ -72,6 +111,15 @@ func beforeAction(c *cli.Context) error {
 	return nil
 }
 
+// afterAction is triggered after the action of the command. It closes the
+// connections shared by all calls of the command. It is not run, when the
+// action returns an exit error, because rhc terminates right away then, and
+// the connections are closed with it.
+func afterAction(c *cli.Context) error {
+	closeSystemdConn(c.Context)
+	return nil
+}
+
 func main() {
 	app := cli.NewApp()
 	app.Name = ShortName
@@ -95,11 +143,6 @@ func main() {
 	}
 	featureIDs := strings.Join(featureIdSlice, ", ")
 
-	defaultConfigFilePath, err := ConfigPath()
-	if err != nil {
-		log.Fatal(err)
-	}
-
 	app.Flags = []cli.Flag{
 		&cli.BoolFlag{
 			Name:   "generate-man-page",
@@ -115,10 +158,19 @@ func main() {
 			Value:   false,
 			EnvVars: []string{"NO_COLOR"},
 		},
+		&cli.StringFlag{
+			Name:      "trace",
+			TakesFile: true,
+			Usage:     "write timings of all operations of the command to `FILE`",
+		},
+		&cli.StringFlag{
+			Name:  "trace-format",
+			Value: trace.FormatChrome,
+			Usage: "write the trace in `FORMAT` (supported formats: \"chrome\", \"otlp\")",
+		},
 		&cli.StringFlag{
 			Name:      "config",
 			Hidden:    true,
-			Value:     defaultConfigFilePath,
 			TakesFile: true,
 			Usage:     "Read config values from `FILE`",
 		},
@@ -140,6 +192,50 @@ func main() {
 		}),
 	}
 
+	// fleetFlags returns options common to all fleet commands
+	fleetFlags := func(flags ...cli.Flag) []cli.Flag {
+		return append([]cli.Flag{
+			&cli.StringFlag{
+				Name:      "hosts",
+				Usage:     "read hosts from `FILE`, one per line (\"-\" reads standard input)",
+				TakesFile: true,
+			},
+			&cli.IntFlag{
+				Name:  "parallel",
+				Value: 10,
+				Usage: "process `N` hosts at once",
+			},
+			&cli.DurationFlag{
+				Name:  "timeout",
+				Value: 5 * time.Minute,
+				Usage: "stop an attempt on a host after `DURATION`",
+			},
+			&cli.IntFlag{
+				Name:  "retries",
+				Value: 2,
+				Usage: "retry a host up to `N` times, when rhc cannot be run on it",
+			},
+			&cli.DurationFlag{
+				Name:  "retry-delay",
+				Value: 5 * time.Second,
+				Usage: "wait `DURATION` before the first retry; the delay grows with every retry",
+			},
+			&cli.StringFlag{
+				Name:  "ssh",
+				Value: "ssh",
+				Usage: "connect to hosts using `PROGRAM`",
+			},
+			&cli.StringSliceFlag{
+				Name:  "ssh-option",
+				Usage: "pass `OPTION` to ssh as -o OPTION",
+			},
+			&cli.BoolFlag{
+				Name:  "sudo",
+				Usage: "run rhc on the hosts using sudo",
+			},
+		}, flags...)
+	}
+
 	app.Commands = []*cli.Command{
 		{
 			Name: "connect",
@@ -186,9 +282,17 @@ func main() {
 				},
 				&cli.StringFlag{
 					Name:    "format",
-					Usage:   "prints output of connection in machine-readable format (supported formats: \"json\")",
+					Usage:   "prints output of connection in machine-readable format (supported formats: \"json\", \"ndjson\")",
 					Aliases: []string{"f"},
 				},
+				&cli.DurationFlag{
+					Name:  "timeout",
+					Usage: "give up connecting after `DURATION`",
+				},
+				&cli.BoolFlag{
+					Name:  "no-preflight",
+					Usage: "do not check that the servers are reachable before connecting",
+				},
 			},
 			Usage:       "Connects the system to " + Provider,
 			UsageText:   fmt.Sprintf("%v connect [command options]", app.Name),
@@ -196,14 +300,42 @@ func main() {
 			Before:      beforeConnectAction,
 			Action:      connectAction,
 		},
+		{
+			Name: "diagnose",
+			Flags: []cli.Flag{
+				&cli.StringFlag{
+					Name:   "server",
+					Hidden: true,
+					Usage:  "check `URL` instead of the server of Red Hat Subscription Management",
+				},
+				&cli.StringFlag{
+					Name:    "format",
+					Usage:   "prints results in machine-readable format (supported formats: \"json\")",
+					Aliases: []string{"f"},
+				},
+			},
+			Usage:       "Checks that the system can reach " + Provider,
+			UsageText:   fmt.Sprintf("%v diagnose", app.Name),
+			Description: "The diagnose command checks that the servers of Red Hat Subscription Management and Red Hat Insights are reachable from the system. It prints the time spent resolving, connecting and in TLS handshake with every server.",
+			Before:      beforeDiagnoseAction,
+			Action:      diagnoseAction,
+		},
 		{
 			Name: "disconnect",
 			Flags: []cli.Flag{
 				&cli.StringFlag{
 					Name:    "format",
-					Usage:   "prints output of disconnection in machine-readable format (supported formats: \"json\")",
+					Usage:   "prints output of disconnection in machine-readable format (supported formats: \"json\", \"ndjson\")",
 					Aliases: []string{"f"},
 				},
+				&cli.DurationFlag{
+					Name:  "timeout",
+					Usage: "give up disconnecting after `DURATION`",
+				},
+				&cli.BoolFlag{
+					Name:  "insights-client-status",
+					Usage: "run insights-client to detect connection to Red Hat Insights instead of reading its state files",
+				},
 			},
 			Usage:       "Disconnects the system from " + Provider,
 			UsageText:   fmt.Sprintf("%v disconnect", app.Name),
@@ -212,10 +344,22 @@ func main() {
 			Action:      disconnectAction,
 		},
 		{
-			Name:        "canonical-facts",
-			Hidden:      true,
+			Name:   "canonical-facts",
+			Hidden: true,
+			Flags: []cli.Flag{
+				&cli.StringFlag{
+					Name:      "output",
+					Usage:     "write facts to `FILE`, when they differ from its content",
+					Aliases:   []string{"o"},
+					TakesFile: true,
+				},
+				&cli.BoolFlag{
+					Name:  "watch",
+					Usage: "keep running and write facts again whenever they change",
+				},
+			},
 			Usage:       "Prints canonical facts about the system.",
-			UsageText:   fmt.Sprintf("%v canonical-facts", app.Name),
+			UsageText:   fmt.Sprintf("%v canonical-facts [--output FILE] [--watch]", app.Name),
 			Description: fmt.Sprintf("The canonical-facts command prints data that uniquely identifies the system in the %v inventory service. Use only as directed for debugging purposes.", Provider),
 			Action:      canonicalFactAction,
 		},
@@ -227,6 +371,23 @@ func main() {
 					Usage:   "prints status in machine-readable format (supported formats: \"json\")",
 					Aliases: []string{"f"},
 				},
+				&cli.DurationFlag{
+					Name:  "max-age",
+					Value: 5 * time.Minute,
+					Usage: "use cached status not older than `DURATION`",
+				},
+				&cli.BoolFlag{
+					Name:  "no-cache",
+					Usage: "do not use cached status",
+				},
+				&cli.DurationFlag{
+					Name:  "timeout",
+					Usage: "give up checking the status after `DURATION`",
+				},
+				&cli.BoolFlag{
+					Name:  "insights-client-status",
+					Usage: "run insights-client to detect connection to Red Hat Insights instead of reading its state files",
+				},
 			},
 			Usage:       "Prints status of the system's connection to " + Provider,
 			UsageText:   fmt.Sprintf("%v status", app.Name),
@@ -234,11 +395,78 @@ func main() {
 			Before:      beforeStatusAction,
 			Action:      statusAction,
 		},
+		{
+			Name: "serve",
+			Flags: []cli.Flag{
+				&cli.DurationFlag{
+					Name:  "refresh-interval",
+					Value: 5 * time.Minute,
+					Usage: "check the status every `DURATION`, even when no change was noticed",
+				},
+			},
+			Usage:       "Keeps status and canonical facts of the system up to date for other commands",
+			UsageText:   fmt.Sprintf("%v serve [--refresh-interval DURATION]", app.Name),
+			Description: fmt.Sprintf("The serve command keeps running and answers queries of the status and canonical facts of the system on the %v socket. It is usually started by systemd, when the socket is used for the first time. The status and canonical-facts commands use it, when it is running, instead of checking the system themselves. Queries are lines of text (\"status\" or \"canonical-facts\"), and every query is answered by a line of JSON.", daemonSocketPath),
+			Action:      serveAction,
+		},
+		{
+			Name:        "fleet",
+			Usage:       "Runs status or connect on many hosts over ssh",
+			UsageText:   fmt.Sprintf("%v fleet command --hosts FILE [command options]", app.Name),
+			Description: fmt.Sprintf("The fleet command runs %v status or %v connect on every host listed in a file using ssh, several hosts at once. The result of every host is printed as a line of JSON as soon as the host finishes, and the last line summarizes all hosts.", app.Name, app.Name),
+			Subcommands: []*cli.Command{
+				{
+					Name:        "status",
+					Flags:       fleetFlags(),
+					Usage:       "Prints status of the connection of all hosts",
+					UsageText:   fmt.Sprintf("%v fleet status --hosts FILE [command options]", app.Name),
+					Description: "Runs the status command on all hosts.",
+					Before:      beforeFleetAction,
+					Action:      fleetStatusAction,
+				},
+				{
+					Name: "connect",
+					Flags: fleetFlags(
+						&cli.StringFlag{
+							Name:    "organization",
+							Usage:   "register with `ID`",
+							Aliases: []string{"o"},
+						},
+						&cli.StringSliceFlag{
+							Name:    "activation-key",
+							Usage:   "register with `KEY` (visible in the process list of the hosts while rhc connect runs)",
+							Aliases: []string{"a"},
+						},
+						&cli.StringSliceFlag{
+							Name:    "content-template",
+							Usage:   "register with `CONTENT_TEMPLATE`",
+							Aliases: []string{"c"},
+						},
+						&cli.StringSliceFlag{
+							Name:    "enable-feature",
+							Usage:   fmt.Sprintf("enable `FEATURE` during connection (allowed values: %s)", featureIDs),
+							Aliases: []string{"e"},
+						},
+						&cli.StringSliceFlag{
+							Name:    "disable-feature",
+							Usage:   fmt.Sprintf("disable `FEATURE` during connection (allowed values: %s)", featureIDs),
+							Aliases: []string{"d"},
+						},
+					),
+					Usage:       "Connects all hosts to " + Provider,
+					UsageText:   fmt.Sprintf("%v fleet connect --hosts FILE --organization ID --activation-key KEY [command options]", app.Name),
+					Description: "Runs the connect command with an activation key on all hosts. Usernames and passwords are not supported, because they would be visible in the process list of the hosts. The command is sent to the hosts on the standard input of ssh, so activation keys do not appear in the process list of the local system, but they are passed to rhc connect on the hosts as arguments. Attempts, which timed out, are not retried.",
+					Before:      beforeFleetConnectAction,
+					Action:      fleetConnectAction,
+				},
+			},
+		},
 	}
 	app.EnableBashCompletion = true
 	app.BashComplete = BashComplete
 	app.Action = mainAction
 	app.Before = beforeAction
+	app.After = afterAction
 
 	if err := app.Run(os.Args); err != nil {
 		log.Error(err)
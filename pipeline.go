@@ -0,0 +1,189 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"strings"
+	"time"
+
+	"github.com/redhatinsights/rhc/internal/trace"
+)
+
+// pipelineStep is a single step of a pipeline executed by runPipeline.
+type pipelineStep struct {
+	// ID is an unique identifier of the step.
+	ID string
+	// Requires is a list of IDs of steps, which have to finish successfully
+	// before this step is started.
+	Requires []string
+	// After is a list of IDs of steps, which have to finish before this step
+	// is started. Unlike Requires, the step is run even when they failed or
+	// were skipped.
+	After []string
+	// Progress is a message describing the step while it is running. When it
+	// is empty, no progress is reported for the step.
+	Progress string
+	// Run is called when all required steps have finished successfully. The
+	// context carries the span of the step.
+	Run func(ctx context.Context) error
+
+	// Err is the error returned by Run.
+	Err error
+	// Skipped is true when Run was not called, because some required step
+	// failed or was skipped.
+	Skipped bool
+	// Duration is the time spent in Run.
+	Duration time.Duration
+}
+
+// checkPipeline returns an error when the steps cannot be scheduled: IDs are
+// not unique, a step requires or is ordered after an unknown step, or the
+// dependencies are cyclic.
+func checkPipeline(steps []*pipelineStep) error {
+	known := make(map[string]bool, len(steps))
+	for _, step := range steps {
+		if known[step.ID] {
+			return fmt.Errorf("duplicate step \"%s\"", step.ID)
+		}
+		known[step.ID] = true
+	}
+	for _, step := range steps {
+		for _, id := range step.Requires {
+			if !known[id] {
+				return fmt.Errorf("step \"%s\" requires unknown step \"%s\"", step.ID, id)
+			}
+		}
+		for _, id := range step.After {
+			if !known[id] {
+				return fmt.Errorf("step \"%s\" is ordered after unknown step \"%s\"", step.ID, id)
+			}
+		}
+	}
+
+	// Mark steps in topological order. When no step can be marked in a round,
+	// the remaining steps depend on each other.
+	resolved := make(map[string]bool, len(steps))
+	for len(resolved) < len(steps) {
+		progress := false
+		for _, step := range steps {
+			if resolved[step.ID] {
+				continue
+			}
+			ready := true
+			for _, ids := range [][]string{step.Requires, step.After} {
+				for _, id := range ids {
+					if !resolved[id] {
+						ready = false
+					}
+				}
+			}
+			if ready {
+				resolved[step.ID] = true
+				progress = true
+			}
+		}
+		if !progress {
+			var cyclic []string
+			for _, step := range steps {
+				if !resolved[step.ID] {
+					cyclic = append(cyclic, step.ID)
+				}
+			}
+			return fmt.Errorf("cyclic dependency between steps: %s", strings.Join(cyclic, ", "))
+		}
+	}
+	return nil
+}
+
+// runPipeline runs the steps of a dependency graph. Every step is started as
+// soon as all steps it requires have finished successfully, so independent
+// steps run concurrently. Steps depending on a failed or skipped step are
+// skipped. Steps ordered after other steps wait for them to finish. The results are stored in the steps. Every step runs in its own span,
+// a child of the span carried by ctx. When progress is not nil, it is called
+// with the progress messages of running steps every time the set of running
+// steps changes.
+func runPipeline(ctx context.Context, steps []*pipelineStep, progress func(messages []string)) error {
+	if err := checkPipeline(steps); err != nil {
+		return err
+	}
+
+	byID := make(map[string]*pipelineStep, len(steps))
+	for _, step := range steps {
+		byID[step.ID] = step
+	}
+	started := make(map[string]bool, len(steps))
+	finished := make(map[string]bool, len(steps))
+	running := make(map[string]bool, len(steps))
+	done := make(chan *pipelineStep)
+
+	reportProgress := func() {
+		if progress == nil {
+			return
+		}
+		var messages []string
+		for _, step := range steps {
+			if running[step.ID] && step.Progress != "" {
+				messages = append(messages, step.Progress)
+			}
+		}
+		progress(messages)
+	}
+
+	for len(finished) < len(steps) {
+		changed := false
+		for _, step := range steps {
+			if started[step.ID] {
+				continue
+			}
+			ready := true
+			for _, id := range step.Requires {
+				required := byID[id]
+				if finished[id] && (required.Err != nil || required.Skipped) {
+					step.Skipped = true
+					break
+				}
+				if !finished[id] {
+					ready = false
+				}
+			}
+			for _, id := range step.After {
+				if !finished[id] {
+					ready = false
+				}
+			}
+			if step.Skipped {
+				started[step.ID] = true
+				finished[step.ID] = true
+				continue
+			}
+			if ready {
+				started[step.ID] = true
+				running[step.ID] = true
+				changed = true
+				go func(step *pipelineStep) {
+					stepCtx, span := trace.Start(ctx, step.ID)
+					start := time.Now()
+					step.Err = step.Run(stepCtx)
+					step.Duration = time.Since(start)
+					span.SetError(step.Err)
+					span.End()
+					done <- step
+				}(step)
+			}
+		}
+		if changed {
+			reportProgress()
+		}
+		if len(running) == 0 {
+			// Skipping a step can unblock other steps
+			continue
+		}
+
+		step := <-done
+		delete(running, step.ID)
+		finished[step.ID] = true
+		reportProgress()
+	}
+
+	return nil
+}
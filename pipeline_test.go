@@ -0,0 +1,167 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"sync"
+	"testing"
+	"time"
+)
+
+func TestRunPipeline(t *testing.T) {
+	var mu sync.Mutex
+	var order []string
+	record := func(id string) {
+		mu.Lock()
+		defer mu.Unlock()
+		order = append(order, id)
+	}
+
+	// Both "left" and "right" wait for each other, so the pipeline finishes
+	// only when they run concurrently.
+	var barrier sync.WaitGroup
+	barrier.Add(2)
+	concurrent := func(id string) func(context.Context) error {
+		return func(context.Context) error {
+			record(id)
+			barrier.Done()
+			barrier.Wait()
+			return nil
+		}
+	}
+
+	root := &pipelineStep{ID: "root", Run: func(context.Context) error { record("root"); return nil }}
+	left := &pipelineStep{ID: "left", Requires: []string{"root"}, Run: concurrent("left")}
+	right := &pipelineStep{ID: "right", Requires: []string{"root"}, Run: concurrent("right")}
+	last := &pipelineStep{ID: "last", Requires: []string{"left", "right"}, Run: func(context.Context) error { record("last"); return nil }}
+
+	finished := make(chan error)
+	go func() {
+		finished <- runPipeline(context.Background(), []*pipelineStep{last, right, left, root}, nil)
+	}()
+	select {
+	case err := <-finished:
+		if err != nil {
+			t.Fatal(err)
+		}
+	case <-time.After(5 * time.Second):
+		t.Fatal("independent steps were not run concurrently")
+	}
+
+	if len(order) != 4 || order[0] != "root" || order[3] != "last" {
+		t.Errorf("unexpected order of steps: %v", order)
+	}
+}
+
+func TestRunPipelineSkip(t *testing.T) {
+	calls := 0
+	failing := &pipelineStep{ID: "failing", Run: func(context.Context) error { return fmt.Errorf("failed") }}
+	dependent := &pipelineStep{ID: "dependent", Requires: []string{"failing"}, Run: func(context.Context) error { calls++; return nil }}
+	transitive := &pipelineStep{ID: "transitive", Requires: []string{"dependent"}, Run: func(context.Context) error { calls++; return nil }}
+	independent := &pipelineStep{ID: "independent", Run: func(context.Context) error { calls++; return nil }}
+
+	if err := runPipeline(context.Background(), []*pipelineStep{transitive, dependent, failing, independent}, nil); err != nil {
+		t.Fatal(err)
+	}
+	if failing.Err == nil {
+		t.Errorf("error of failing step was not recorded")
+	}
+	if !dependent.Skipped || !transitive.Skipped {
+		t.Errorf("dependent steps were not skipped")
+	}
+	if independent.Skipped || calls != 1 {
+		t.Errorf("independent step was not run")
+	}
+}
+
+func TestRunPipelineAfter(t *testing.T) {
+	var order []string
+	failing := &pipelineStep{ID: "failing", Run: func(context.Context) error {
+		time.Sleep(20 * time.Millisecond)
+		order = append(order, "failing")
+		return fmt.Errorf("failed")
+	}}
+	ordered := &pipelineStep{ID: "ordered", After: []string{"failing"}, Run: func(context.Context) error {
+		order = append(order, "ordered")
+		return nil
+	}}
+
+	if err := runPipeline(context.Background(), []*pipelineStep{ordered, failing}, nil); err != nil {
+		t.Fatal(err)
+	}
+	if ordered.Skipped || ordered.Err != nil {
+		t.Errorf("step ordered after failed step was not run")
+	}
+	if len(order) != 2 || order[0] != "failing" || order[1] != "ordered" {
+		t.Errorf("unexpected order of steps: %v", order)
+	}
+}
+
+func TestCheckPipeline(t *testing.T) {
+	run := func(context.Context) error { return nil }
+	tests := []struct {
+		description string
+		input       []*pipelineStep
+		wantError   string
+	}{
+		{
+			description: "valid",
+			input: []*pipelineStep{
+				{ID: "a", Run: run},
+				{ID: "b", Requires: []string{"a"}, Run: run},
+			},
+		},
+		{
+			description: "duplicate",
+			input: []*pipelineStep{
+				{ID: "a", Run: run},
+				{ID: "a", Run: run},
+			},
+			wantError: "duplicate step \"a\"",
+		},
+		{
+			description: "unknown",
+			input: []*pipelineStep{
+				{ID: "a", Requires: []string{"b"}, Run: run},
+			},
+			wantError: "step \"a\" requires unknown step \"b\"",
+		},
+		{
+			description: "unknown after",
+			input: []*pipelineStep{
+				{ID: "a", After: []string{"b"}, Run: run},
+			},
+			wantError: "step \"a\" is ordered after unknown step \"b\"",
+		},
+		{
+			description: "cycle with after",
+			input: []*pipelineStep{
+				{ID: "a", Requires: []string{"b"}, Run: run},
+				{ID: "b", After: []string{"a"}, Run: run},
+			},
+			wantError: "cyclic dependency between steps: a, b",
+		},
+		{
+			description: "cycle",
+			input: []*pipelineStep{
+				{ID: "a", Run: run},
+				{ID: "b", Requires: []string{"a", "c"}, Run: run},
+				{ID: "c", Requires: []string{"b"}, Run: run},
+			},
+			wantError: "cyclic dependency between steps: b, c",
+		},
+	}
+
+	for _, test := range tests {
+		t.Run(test.description, func(t *testing.T) {
+			err := checkPipeline(test.input)
+			if test.wantError != "" {
+				if err == nil || err.Error() != test.wantError {
+					t.Errorf("%v != %v", err, test.wantError)
+				}
+			} else if err != nil {
+				t.Fatal(err)
+			}
+		})
+	}
+}
@@ -0,0 +1,252 @@
+package main
+
+import (
+	"bufio"
+	"context"
+	"crypto/tls"
+	"fmt"
+	"net"
+	"net/url"
+	"os"
+	"strings"
+	"sync"
+	"time"
+
+	"github.com/redhatinsights/rhc/internal/http"
+	"github.com/redhatinsights/rhc/internal/trace"
+	"github.com/subpop/go-log"
+)
+
+// Configuration files, which define the servers RHSM and insights-client
+// connect to.
+var (
+	rhsmConfFile           = "/etc/rhsm/rhsm.conf"
+	insightsClientConfFile = "/etc/insights-client/insights-client.conf"
+)
+
+// Servers used, when the configuration files do not set any.
+const (
+	defaultCandlepinHost   = "subscription.rhsm.redhat.com"
+	defaultInsightsBaseURL = "cert-api.access.redhat.com:443/r/insights"
+	defaultHTTPSPort       = "443"
+	defaultRHSMProxyPort   = "3128"
+)
+
+// preflightTimeout limits the probes of all endpoints. Reachable servers
+// answer much sooner, so it only bounds the wait for unreachable ones.
+const preflightTimeout = 5 * time.Second
+
+// endpoint is a server RHSM or insights-client connects to.
+type endpoint struct {
+	// name is the name of the service, "rhsm" or "insights"
+	name string
+	// address is host:port of the server
+	address string
+	// proxy is true, when address is a proxy server used to reach the
+	// service. Only TCP connection to a proxy server is checked.
+	proxy bool
+}
+
+// probeTLSConfig is used for TLS handshakes of probes. The probes check that
+// servers are reachable, the certificates are verified by RHSM and
+// insights-client with their own CA certificates.
+var probeTLSConfig = &tls.Config{
+	MinVersion:         tls.VersionTLS12,
+	InsecureSkipVerify: true,
+}
+
+// readConfFile reads the INI file used by RHSM and insights-client. It
+// returns values of keys by section.
+func readConfFile(filename string) (map[string]map[string]string, error) {
+	file, err := os.Open(filename)
+	if err != nil {
+		return nil, err
+	}
+	defer file.Close()
+
+	conf := make(map[string]map[string]string)
+	section := ""
+	scanner := bufio.NewScanner(file)
+	for scanner.Scan() {
+		line := strings.TrimSpace(scanner.Text())
+		switch {
+		case line == "" || strings.HasPrefix(line, "#") || strings.HasPrefix(line, ";"):
+			continue
+		case strings.HasPrefix(line, "[") && strings.HasSuffix(line, "]"):
+			section = strings.TrimSpace(line[1 : len(line)-1])
+		default:
+			key, value, found := strings.Cut(line, "=")
+			if !found {
+				key, value, found = strings.Cut(line, ":")
+			}
+			if !found {
+				continue
+			}
+			if conf[section] == nil {
+				conf[section] = make(map[string]string)
+			}
+			conf[section][strings.TrimSpace(key)] = strings.TrimSpace(value)
+		}
+	}
+	return conf, scanner.Err()
+}
+
+// hostPort returns host:port of the URL, the port defaults to defaultPort.
+func hostPort(u *url.URL, defaultPort string) string {
+	port := u.Port()
+	if port == "" {
+		port = defaultPort
+	}
+	return net.JoinHostPort(u.Hostname(), port)
+}
+
+// proxyEndpoint returns the proxy server used to reach the endpoint according
+// to the environment, or the endpoint itself, when no proxy is used.
+func proxyEndpoint(e endpoint) endpoint {
+	proxy, err := http.ProxyURL(e.address)
+	if err != nil || proxy == nil {
+		return e
+	}
+	return endpoint{name: e.name, address: hostPort(proxy, "80"), proxy: true}
+}
+
+// candlepinEndpoint returns the server RHSM registers the system with. The
+// server given by --server replaces the one in rhsm.conf the same way
+// configureRHSM does it.
+func candlepinEndpoint(serverURL string) endpoint {
+	conf, _ := readConfFile(rhsmConfFile)
+	server := conf["server"]
+	host := server["hostname"]
+	port := server["port"]
+
+	if serverURL != "" {
+		if URL, err := url.Parse(serverURL); err == nil {
+			if URL.Scheme == "" {
+				if URL.Path != "" {
+					host = URL.Path
+				}
+			} else {
+				if URL.Hostname() != "" {
+					host = URL.Hostname()
+				}
+				if URL.Port() != "" {
+					port = URL.Port()
+				}
+			}
+		}
+	}
+	if host == "" {
+		host = defaultCandlepinHost
+	}
+	if port == "" {
+		port = defaultHTTPSPort
+	}
+
+	if proxyHost := server["proxy_hostname"]; proxyHost != "" {
+		proxyPort := server["proxy_port"]
+		if proxyPort == "" {
+			proxyPort = defaultRHSMProxyPort
+		}
+		return endpoint{name: "rhsm", address: net.JoinHostPort(proxyHost, proxyPort), proxy: true}
+	}
+	return proxyEndpoint(endpoint{name: "rhsm", address: net.JoinHostPort(host, port)})
+}
+
+// insightsEndpoint returns the server insights-client uploads data to. Like
+// insights-client, it uses the Satellite server of RHSM, when base_url is
+// not configured and the system is registered with a Satellite.
+func insightsEndpoint(candlepin endpoint) endpoint {
+	conf, _ := readConfFile(insightsClientConfFile)
+	client := conf["insights-client"]
+
+	address := ""
+	if baseURL := client["base_url"]; baseURL != "" {
+		if !strings.Contains(baseURL, "://") {
+			baseURL = "https://" + baseURL
+		}
+		if URL, err := url.Parse(baseURL); err == nil && URL.Hostname() != "" {
+			address = hostPort(URL, defaultHTTPSPort)
+		}
+	}
+	if address == "" && !candlepin.proxy && strings.ToLower(client["auto_config"]) != "false" {
+		if host, _, err := net.SplitHostPort(candlepin.address); err == nil && host != defaultCandlepinHost {
+			address = candlepin.address
+		}
+	}
+	if address == "" {
+		URL, _ := url.Parse("https://" + defaultInsightsBaseURL)
+		address = hostPort(URL, defaultHTTPSPort)
+	}
+
+	if proxy := client["proxy"]; proxy != "" {
+		if URL, err := url.Parse(proxy); err == nil && URL.Hostname() != "" {
+			return endpoint{name: "insights", address: hostPort(URL, "80"), proxy: true}
+		}
+	}
+	return proxyEndpoint(endpoint{name: "insights", address: address})
+}
+
+// probeEndpoints probes all endpoints at once. TLS handshake is performed
+// with servers, which are not proxies. The results are in the order of the
+// endpoints.
+func probeEndpoints(ctx context.Context, endpoints []endpoint) []http.ProbeResult {
+	ctx, cancel := context.WithTimeout(ctx, preflightTimeout)
+	defer cancel()
+
+	results := make([]http.ProbeResult, len(endpoints))
+	var wg sync.WaitGroup
+	for i, e := range endpoints {
+		wg.Add(1)
+		go func(i int, e endpoint) {
+			defer wg.Done()
+			tlsConfig := probeTLSConfig
+			if e.proxy {
+				tlsConfig = nil
+			}
+			_ = trace.Run(ctx, "probe "+e.name+" "+e.address, func(ctx context.Context) error {
+				results[i] = http.Probe(ctx, e.address, tlsConfig)
+				return results[i].Err
+			})
+		}(i, e)
+	}
+	wg.Wait()
+	return results
+}
+
+// probeError describes the failed probe of the endpoint.
+func probeError(e endpoint, result http.ProbeResult) error {
+	server := "server"
+	if e.proxy {
+		server = "proxy server"
+	}
+	if result.Stage == http.StageDNS {
+		return fmt.Errorf("cannot resolve %v %v: %w", server, e.address, result.Err)
+	}
+	return fmt.Errorf("cannot connect to %v %v: %w", server, e.address, result.Err)
+}
+
+// preflightCheck checks that the servers needed to connect the system are
+// reachable, before any configuration is changed. It fails, when the server
+// of RHSM cannot be reached, because the registration would fail anyway, but
+// only after the network timeout of RHSM. Unreachable server of Insights is
+// only reported, the system can still be registered.
+func preflightCheck(ctx context.Context, serverURL string, checkInsights bool) error {
+	candlepin := candlepinEndpoint(serverURL)
+	endpoints := []endpoint{candlepin}
+	if checkInsights {
+		endpoints = append(endpoints, insightsEndpoint(candlepin))
+	}
+
+	results := probeEndpoints(ctx, endpoints)
+	for i, result := range results[1:] {
+		if result.Err != nil {
+			err := probeError(endpoints[i+1], result)
+			log.Warnf("cannot reach Red Hat Insights: %v", err)
+			interactivePrintf("%s[%v] Red Hat Insights may be unreachable: %v\n", smallIndent, uiSettings.iconInfo, err)
+		}
+	}
+	if results[0].Err != nil {
+		return probeError(candlepin, results[0])
+	}
+	return nil
+}
@@ -2,7 +2,9 @@ package main
 
 import (
 	"bufio"
+	"context"
 	"encoding/json"
+	"errors"
 	"fmt"
 	"github.com/briandowns/spinner"
 	"github.com/urfave/cli/v2"
@@ -11,34 +13,125 @@ import (
 	"net/url"
 	"os"
 	"strings"
+	"sync"
 	"text/tabwriter"
 	"time"
 
 	"github.com/godbus/dbus/v5"
+	"github.com/redhatinsights/rhc/internal/trace"
 )
 
 const EnvTypeContentTemplate = "content-template"
 
-func getConsumerUUID() (string, error) {
-	conn, err := dbus.SystemBus()
+// consumerCertFile is the consumer certificate of the system registered to
+// RHSM.
+var consumerCertFile = "/etc/pki/consumer/cert.pem"
+
+// rhsmClient talks to RHSM using the system D-Bus. It keeps one connection to
+// the bus for the whole rhc command, and it remembers the consumer UUID until
+// the system is registered or unregistered.
+type rhsmClient struct {
+	mu   sync.Mutex
+	conn *dbus.Conn
+	// uuid is the cached consumer UUID. It is nil, when the UUID has not
+	// been received from RHSM yet.
+	uuid *string
+}
+
+// rhsm is the RHSM client shared by all actions of rhc.
+var rhsm = &rhsmClient{}
+
+// connection returns the connection to the system bus. The connection is
+// established, when it is called for the first time, and again when it was
+// closed, e.g. because the D-Bus daemon was restarted while rhc serve was
+// running.
+func (c *rhsmClient) connection(ctx context.Context) (*dbus.Conn, error) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if c.conn == nil || !c.conn.Connected() {
+		err := trace.Run(ctx, "dbus connect system bus", func(ctx context.Context) error {
+			// The shared connection is established again, when it was closed.
+			conn, err := dbus.SystemBus()
+			c.conn = conn
+			return err
+		})
+		if err != nil {
+			return nil, err
+		}
+	}
+	return c.conn, nil
+}
+
+// traceCall calls the D-Bus method in a span named after the method, and it
+// returns the result of the call. The call is abandoned, when ctx is done.
+// When the deadline of ctx is exceeded, the call fails with an error saying
+// which call timed out.
+func traceCall(ctx context.Context, object dbus.BusObject, method string, flags dbus.Flags, args ...interface{}) *dbus.Call {
+	_, span := trace.Start(ctx, "dbus "+method)
+	defer span.End()
+	call := object.CallWithContext(ctx, method, flags, args...)
+	if call.Err != nil && errors.Is(ctx.Err(), context.DeadlineExceeded) {
+		call.Err = fmt.Errorf("%v timed out: %w", method, ctx.Err())
+	}
+	span.SetError(call.Err)
+	return call
+}
+
+// detachedContext keeps the values of its parent context, e.g. the span, but
+// it is never canceled. It is used for calls, which release resources of RHSM
+// and have to be made even when the command was canceled or timed out.
+type detachedContext struct {
+	context.Context
+}
+
+func (detachedContext) Deadline() (time.Time, bool) { return time.Time{}, false }
+func (detachedContext) Done() <-chan struct{}       { return nil }
+func (detachedContext) Err() error                  { return nil }
+
+// consumerUUID asks RHSM for the consumer UUID of the system. An empty string
+// is returned, when the system is not registered. The UUID is asked only
+// once, until forgetConsumerUUID is called.
+func (c *rhsmClient) consumerUUID(ctx context.Context) (string, error) {
+	conn, err := c.connection(ctx)
 	if err != nil {
 		return "", err
 	}
 
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if c.uuid != nil {
+		return *c.uuid, nil
+	}
+
 	locale := getLocale()
 
 	var uuid string
-	if err := conn.Object(
-		"com.redhat.RHSM1",
-		"/com/redhat/RHSM1/Consumer").Call(
+	if err := traceCall(
+		ctx,
+		conn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/Consumer"),
 		"com.redhat.RHSM1.Consumer.GetUuid",
 		dbus.Flags(0),
 		locale).Store(&uuid); err != nil {
 		return "", unpackRHSMError(err)
 	}
+	c.uuid = &uuid
 	return uuid, nil
 }
 
+// forgetConsumerUUID drops the cached consumer UUID. It has to be called,
+// whenever the system could be registered or unregistered.
+func (c *rhsmClient) forgetConsumerUUID() {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	c.uuid = nil
+}
+
+// getConsumerUUID asks RHSM for the consumer UUID of the system. An empty string
+// is returned, when the system is not registered.
+func getConsumerUUID(ctx context.Context) (string, error) {
+	return rhsm.consumerUUID(ctx)
+}
+
 // Organization is structure containing information about RHSM organization (sometimes called owner)
 // JSON document returned from candlepin server can have the following format. We care only about key,
 // but it can be extended and more information can be added to the structure in the future.
@@ -87,20 +180,20 @@ func unpackOrgs(s string) ([]string, error) {
 // registerUsernamePassword tries to register system against candlepin server (Red Hat Management Service)
 // username and password are mandatory. When organization is not obtained, then this method
 // returns list of available organization and user can select one organization from the list.
-func registerUsernamePassword(username, password, organization string, environments []string, serverURL string, enableContent bool) ([]string, error) {
+func registerUsernamePassword(ctx context.Context, username, password, organization string, environments []string, serverURL string, enableContent bool) ([]string, error) {
 	var orgs []string
 	if serverURL != "" {
-		if err := configureRHSM(serverURL); err != nil {
+		if err := configureRHSM(ctx, serverURL); err != nil {
 			return orgs, fmt.Errorf("cannot configure RHSM: %w", err)
 		}
 	}
 
-	conn, err := dbus.SystemBus()
+	conn, err := rhsm.connection(ctx)
 	if err != nil {
 		return orgs, err
 	}
 
-	uuid, err := getConsumerUUID()
+	uuid, err := getConsumerUUID(ctx)
 	if err != nil {
 		return orgs, err
 	}
@@ -108,31 +201,16 @@ func registerUsernamePassword(username, password, organization string, environme
 		return orgs, fmt.Errorf("warning: the system is already registered")
 	}
 
-	registerServer := conn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/RegisterServer")
+	// The system can be registered after this point
+	defer rhsm.forgetConsumerUUID()
 
 	locale := getLocale()
 
-	var privateDbusSocketURI string
-	if err := registerServer.Call(
-		"com.redhat.RHSM1.RegisterServer.Start",
-		dbus.Flags(0),
-		locale).Store(&privateDbusSocketURI); err != nil {
-		return orgs, err
-	}
-	defer registerServer.Call(
-		"com.redhat.RHSM1.RegisterServer.Stop",
-		dbus.FlagNoReplyExpected,
-		locale)
-
-	privConn, err := dbus.Dial(privateDbusSocketURI)
+	privConn, stopRegisterServer, err := startRegisterServer(ctx, conn, locale)
 	if err != nil {
 		return orgs, err
 	}
-	defer privConn.Close()
-
-	if err := privConn.Auth(nil); err != nil {
-		return orgs, err
-	}
+	defer stopRegisterServer()
 
 	options := make(map[string]string)
 	if len(environments) != 0 {
@@ -143,9 +221,10 @@ func registerUsernamePassword(username, password, organization string, environme
 
 	options["enable_content"] = fmt.Sprintf("%v", enableContent)
 
-	if err := privConn.Object(
-		"com.redhat.RHSM1",
-		"/com/redhat/RHSM1/Register").Call(
+	register := privConn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/Register")
+	if err := traceCall(
+		ctx,
+		register,
 		"com.redhat.RHSM1.Register.Register",
 		dbus.Flags(0),
 		organization,
@@ -168,45 +247,42 @@ func registerUsernamePassword(username, password, organization string, environme
 		// try to get list of available organizations
 		if organization == "" && rhsmError.Exception == "OrgNotSpecifiedException" {
 			var s string
-			orgsCall := privConn.Object(
-				"com.redhat.RHSM1",
-				"/com/redhat/RHSM1/Register",
-			).Call(
+			err = traceCall(
+				ctx,
+				register,
 				"com.redhat.RHSM1.Register.GetOrgs",
 				dbus.Flags(0),
 				username,
 				password,
 				map[string]string{},
 				locale,
-			)
-
-			err = orgsCall.Store(&s)
+			).Store(&s)
 			if err != nil {
-				return orgs, err
+				return orgs, unpackRHSMError(err)
 			}
 
 			orgs, err = unpackOrgs(s)
 			return orgs, err
 		}
-		return orgs, unpackRHSMError(err)
+		return orgs, rhsmError
 	}
 
 	return orgs, nil
 }
 
-func registerActivationKey(orgID string, activationKeys []string, environments []string, serverURL string, enableContent bool) error {
+func registerActivationKey(ctx context.Context, orgID string, activationKeys []string, environments []string, serverURL string, enableContent bool) error {
 	if serverURL != "" {
-		if err := configureRHSM(serverURL); err != nil {
+		if err := configureRHSM(ctx, serverURL); err != nil {
 			return fmt.Errorf("cannot configure RHSM: %w", err)
 		}
 	}
 
-	conn, err := dbus.SystemBus()
+	conn, err := rhsm.connection(ctx)
 	if err != nil {
 		return err
 	}
 
-	uuid, err := getConsumerUUID()
+	uuid, err := getConsumerUUID(ctx)
 	if err != nil {
 		return err
 	}
@@ -214,31 +290,16 @@ func registerActivationKey(orgID string, activationKeys []string, environments [
 		return fmt.Errorf("warning: the system is already registered")
 	}
 
-	registerServer := conn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/RegisterServer")
+	// The system can be registered after this point
+	defer rhsm.forgetConsumerUUID()
 
 	locale := getLocale()
 
-	var privateDbusSocketURI string
-	if err := registerServer.Call(
-		"com.redhat.RHSM1.RegisterServer.Start",
-		dbus.Flags(0),
-		locale).Store(&privateDbusSocketURI); err != nil {
-		return err
-	}
-	defer registerServer.Call(
-		"com.redhat.RHSM1.RegisterServer.Stop",
-		dbus.FlagNoReplyExpected,
-		locale)
-
-	privConn, err := dbus.Dial(privateDbusSocketURI)
+	privConn, stopRegisterServer, err := startRegisterServer(ctx, conn, locale)
 	if err != nil {
 		return err
 	}
-	defer privConn.Close()
-
-	if err := privConn.Auth(nil); err != nil {
-		return err
-	}
+	defer stopRegisterServer()
 
 	options := make(map[string]string)
 	if len(environments) != 0 {
@@ -248,9 +309,9 @@ func registerActivationKey(orgID string, activationKeys []string, environments [
 
 	options["enable_content"] = fmt.Sprintf("%v", enableContent)
 
-	if err := privConn.Object(
-		"com.redhat.RHSM1",
-		"/com/redhat/RHSM1/Register").Call(
+	if err := traceCall(
+		ctx,
+		privConn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/Register"),
 		"com.redhat.RHSM1.Register.RegisterWithActivationKeys",
 		dbus.Flags(0),
 		orgID,
@@ -264,13 +325,13 @@ func registerActivationKey(orgID string, activationKeys []string, environments [
 	return nil
 }
 
-func unregister() error {
-	conn, err := dbus.SystemBus()
+func unregister(ctx context.Context) error {
+	conn, err := rhsm.connection(ctx)
 	if err != nil {
 		return err
 	}
 
-	uuid, err := getConsumerUUID()
+	uuid, err := getConsumerUUID(ctx)
 	if err != nil {
 		return err
 	}
@@ -280,9 +341,12 @@ func unregister() error {
 
 	locale := getLocale()
 
-	err = conn.Object(
-		"com.redhat.RHSM1",
-		"/com/redhat/RHSM1/Unregister").Call(
+	// The system can be unregistered after this point
+	defer rhsm.forgetConsumerUUID()
+
+	err = traceCall(
+		ctx,
+		conn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/Unregister"),
 		"com.redhat.RHSM1.Unregister.Unregister",
 		dbus.Flags(0),
 		map[string]string{},
@@ -295,6 +359,62 @@ func unregister() error {
 	return nil
 }
 
+// startRegisterServer starts the register server of RHSM, and it connects to
+// its private D-Bus socket. The returned function closes the connection and
+// stops the server. The server is stopped even when ctx was canceled, because
+// the registration timed out.
+func startRegisterServer(ctx context.Context, conn *dbus.Conn, locale string) (*dbus.Conn, func(), error) {
+	registerServer := conn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/RegisterServer")
+
+	var privateDbusSocketURI string
+	if err := traceCall(
+		ctx,
+		registerServer,
+		"com.redhat.RHSM1.RegisterServer.Start",
+		dbus.Flags(0),
+		locale).Store(&privateDbusSocketURI); err != nil {
+		return nil, nil, err
+	}
+	stop := func() {
+		traceCall(
+			detachedContext{ctx},
+			registerServer,
+			"com.redhat.RHSM1.RegisterServer.Stop",
+			dbus.FlagNoReplyExpected,
+			locale)
+	}
+
+	privConn, err := dialRegisterServer(ctx, privateDbusSocketURI)
+	if err != nil {
+		stop()
+		return nil, nil, err
+	}
+	return privConn, func() {
+		privConn.Close()
+		stop()
+	}, nil
+}
+
+// dialRegisterServer connects to the private D-Bus socket of the RHSM register
+// server and authenticates. The connection is closed, when ctx is done, so a
+// register server, which does not respond, cannot block rhc.
+func dialRegisterServer(ctx context.Context, address string) (*dbus.Conn, error) {
+	var conn *dbus.Conn
+	err := trace.Run(ctx, "dbus connect register server", func(ctx context.Context) error {
+		var err error
+		conn, err = dbus.Dial(address, dbus.WithContext(ctx))
+		if err != nil {
+			return err
+		}
+		if err := conn.Auth(nil); err != nil {
+			conn.Close()
+			return err
+		}
+		return nil
+	})
+	return conn, err
+}
+
 // RHSMError is used for parsing JSON document returned by D-Bus methods.
 type RHSMError struct {
 	Exception string `json:"exception"`
@@ -326,7 +446,7 @@ func unpackRHSMError(err error) error {
 	return err
 }
 
-func configureRHSM(serverURL string) error {
+func configureRHSM(ctx context.Context, serverURL string) error {
 	if _, err := os.Stat("/etc/rhsm/rhsm.conf.orig"); os.IsNotExist(err) {
 		src, err := os.Open("/etc/rhsm/rhsm.conf")
 		if err != nil {
@@ -352,81 +472,68 @@ func configureRHSM(serverURL string) error {
 		return fmt.Errorf("cannot parse URL: %w", err)
 	}
 
-	conn, err := dbus.SystemBus()
+	conn, err := rhsm.connection(ctx)
 	if err != nil {
 		return fmt.Errorf("cannot connect to system D-Bus: %w", err)
 	}
 
 	locale := getLocale()
 
-	config := conn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/Config")
+	// Collect all changes of configuration, and write them using single D-Bus call
+	settings := make(map[string]dbus.Variant)
 
 	// If the scheme is empty, attempt to set the server.hostname based on the
 	// path component alone. This enables the --server argument to accept just a
 	// host name without a full URI.
 	if URL.Scheme == "" {
 		if URL.Path != "" {
-			if err := config.Call(
-				"com.redhat.RHSM1.Config.Set",
-				0,
-				"server.hostname",
-				URL.Path,
-				locale).Err; err != nil {
-				return unpackRHSMError(err)
-			}
+			settings["server.hostname"] = dbus.MakeVariant(URL.Path)
 		}
 	} else {
 		if URL.Hostname() != "" {
-			if err := config.Call(
-				"com.redhat.RHSM1.Config.Set",
-				0,
-				"server.hostname",
-				URL.Hostname(),
-				locale).Err; err != nil {
-				return unpackRHSMError(err)
-			}
+			settings["server.hostname"] = dbus.MakeVariant(URL.Hostname())
 		}
 
 		if URL.Port() != "" {
-			if err := config.Call(
-				"com.redhat.RHSM1.Config.Set",
-				0,
-				"server.port",
-				URL.Port(),
-				locale).Err; err != nil {
-				return unpackRHSMError(err)
-			}
+			settings["server.port"] = dbus.MakeVariant(URL.Port())
 		}
 
 		if URL.Path != "" {
-			if err := config.Call(
-				"com.redhat.RHSM1.Config.Set",
-				0,
-				"server.prefix",
-				URL.Path,
-				locale).Err; err != nil {
-				return unpackRHSMError(err)
-			}
+			settings["server.prefix"] = dbus.MakeVariant(URL.Path)
 		}
 	}
 
+	if len(settings) == 0 {
+		return nil
+	}
+
+	if err := traceCall(
+		ctx,
+		conn.Object("com.redhat.RHSM1", "/com/redhat/RHSM1/Config"),
+		"com.redhat.RHSM1.Config.SetAll",
+		dbus.Flags(0),
+		settings,
+		locale).Err; err != nil {
+		return unpackRHSMError(err)
+	}
+
 	return nil
 }
 
 // registerRHSM tries to register system against Red Hat Subscription Management server (candlepin server)
-func registerRHSM(ctx *cli.Context, enableContent bool) (string, error) {
-	uuid, err := getConsumerUUID()
+func registerRHSM(ctx context.Context, cliCtx *cli.Context, enableContent bool) (string, error) {
+	uuid, err := getConsumerUUID(ctx)
 	if err != nil {
 		return "Unable to get consumer UUID", cli.Exit(err, 1)
 	}
 	var successMsg string
 
 	if uuid == "" {
-		username := ctx.String("username")
-		password := ctx.String("password")
-		organization := ctx.String("organization")
-		activationKeys := ctx.StringSlice("activation-key")
-		contentTemplates := ctx.StringSlice("content-template")
+		username := cliCtx.String("username")
+		password := cliCtx.String("password")
+		organization := cliCtx.String("organization")
+		activationKeys := cliCtx.StringSlice("activation-key")
+		contentTemplates := cliCtx.StringSlice("content-template")
 
 		if len(activationKeys) == 0 {
 			if username == "" {
@@ -459,17 +566,18 @@ func registerRHSM(ctx *cli.Context, enableContent bool) (string, error) {
 		var err error
 		if len(activationKeys) > 0 {
 			err = registerActivationKey(
+				ctx,
 				organization,
-				ctx.StringSlice("activation-key"),
+				cliCtx.StringSlice("activation-key"),
 				contentTemplates,
-				ctx.String("server"),
+				cliCtx.String("server"),
 				enableContent)
 		} else {
 			var orgs []string
 			if organization != "" {
-				_, err = registerUsernamePassword(username, password, organization, contentTemplates, ctx.String("server"), enableContent)
+				_, err = registerUsernamePassword(ctx, username, password, organization, contentTemplates, cliCtx.String("server"), enableContent)
 			} else {
-				orgs, err = registerUsernamePassword(username, password, "", contentTemplates, ctx.String("server"), enableContent)
+				orgs, err = registerUsernamePassword(ctx, username, password, "", contentTemplates, cliCtx.String("server"), enableContent)
 				/* When organization was not specified using CLI option --organization, and it is
 				   required, because user is member of more than one organization, then ask for
 				   the organization. */
@@ -504,7 +612,7 @@ func registerRHSM(ctx *cli.Context, enableContent bool) (string, error) {
 					}
 
 					// Try to register once again with given organization
-					_, err = registerUsernamePassword(username, password, organization, contentTemplates, ctx.String("server"), enableContent)
+					_, err = registerUsernamePassword(ctx, username, password, organization, contentTemplates, cliCtx.String("server"), enableContent)
 				}
 			}
 		}
@@ -519,8 +627,8 @@ func registerRHSM(ctx *cli.Context, enableContent bool) (string, error) {
 }
 
 // isRHSMRegistered returns true, when system is registered
-func isRHSMRegistered() (bool, error) {
-	uuid, err := getConsumerUUID()
+func isRHSMRegistered(ctx context.Context) (bool, error) {
+	uuid, err := getConsumerUUID(ctx)
 	if err != nil {
 		return false, err
 	}
@@ -0,0 +1,86 @@
+package main
+
+import (
+	"context"
+	"errors"
+	"testing"
+	"time"
+
+	"github.com/godbus/dbus/v5"
+)
+
+// fakeRHSMObject is a D-Bus object of RHSM, which replies to method calls
+// after the delay of the method. Calls are abandoned, when their context is
+// done, like godbus does.
+type fakeRHSMObject struct {
+	dbus.BusObject
+	delays map[string]time.Duration
+}
+
+func (o *fakeRHSMObject) CallWithContext(ctx context.Context, method string, flags dbus.Flags, args ...interface{}) *dbus.Call {
+	call := &dbus.Call{Method: method, Args: args}
+	select {
+	case <-time.After(o.delays[method]):
+	case <-ctx.Done():
+		call.Err = ctx.Err()
+	}
+	return call
+}
+
+func TestTraceCallTimeout(t *testing.T) {
+	object := &fakeRHSMObject{delays: map[string]time.Duration{
+		"com.redhat.RHSM1.Consumer.GetUuid":  0,
+		"com.redhat.RHSM1.Register.Register": time.Hour,
+	}}
+
+	tests := []struct {
+		description string
+		method      string
+		cancel      bool
+		wantError   string
+	}{
+		{
+			description: "reply",
+			method:      "com.redhat.RHSM1.Consumer.GetUuid",
+		},
+		{
+			description: "deadline exceeded",
+			method:      "com.redhat.RHSM1.Register.Register",
+			wantError:   "com.redhat.RHSM1.Register.Register timed out: context deadline exceeded",
+		},
+		{
+			description: "canceled",
+			method:      "com.redhat.RHSM1.Register.Register",
+			cancel:      true,
+			wantError:   "context canceled",
+		},
+	}
+
+	for _, test := range tests {
+		t.Run(test.description, func(t *testing.T) {
+			ctx, cancel := context.WithTimeout(context.Background(), 50*time.Millisecond)
+			defer cancel()
+			if test.cancel {
+				cancel()
+			}
+
+			start := time.Now()
+			err := traceCall(ctx, object, test.method, dbus.Flags(0)).Err
+			if elapsed := time.Since(start); elapsed > time.Second {
+				t.Errorf("call was not abandoned: %v", elapsed)
+			}
+			if test.wantError == "" {
+				if err != nil {
+					t.Errorf("unexpected error: %v", err)
+				}
+				return
+			}
+			if err == nil || err.Error() != test.wantError {
+				t.Errorf("got error %v, want %v", err, test.wantError)
+			}
+			if !errors.Is(err, ctx.Err()) {
+				t.Errorf("error does not wrap %v", ctx.Err())
+			}
+		})
+	}
+}
@@ -0,0 +1,506 @@
+package main
+
+import (
+	"bufio"
+	"context"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"net"
+	"os"
+	"os/signal"
+	"path/filepath"
+	"sync"
+	"syscall"
+	"time"
+
+	"github.com/coreos/go-systemd/v22/activation"
+	"github.com/redhatinsights/rhc/internal/trace"
+	"github.com/subpop/go-log"
+	"github.com/urfave/cli/v2"
+	"golang.org/x/sys/unix"
+)
+
+// daemonSocketPath is the Unix socket the daemon started by `rhc serve`
+// listens on, and other rhc commands query.
+var daemonSocketPath = filepath.Join("/run", LongName, "rhc.sock")
+
+// Queries of the daemon. A query is a line of text, and it is answered by
+// a line containing daemonResponse as JSON. A connection can be used for any
+// number of queries.
+const (
+	daemonQueryStatus         = "status"
+	daemonQueryCanonicalFacts = "canonical-facts"
+	// daemonQueryRefresh makes the daemon check the status and collect the
+	// canonical facts again, and it is answered like daemonQueryStatus. Only
+	// root is allowed to send it.
+	daemonQueryRefresh = "refresh"
+)
+
+// errDaemonNotReady is answered to queries received before the daemon took
+// the first snapshot. The command does the work itself then, instead of
+// waiting for the daemon.
+var errDaemonNotReady = errors.New("daemon is not ready")
+
+const (
+	// daemonDialTimeout is the longest time to wait for a connection to the
+	// daemon, before the command does the work itself.
+	daemonDialTimeout = 100 * time.Millisecond
+	// daemonQueryTimeout is the longest time to wait for an answer. Queries
+	// are answered from the snapshot right away, and nobody waits for the
+	// answer of refresh.
+	daemonQueryTimeout = 5 * time.Second
+	// daemonIdleTimeout is the time a connection without queries is kept open.
+	daemonIdleTimeout = time.Minute
+	// daemonStatusDebounce is the time to wait for further changes of files,
+	// before the status is checked again.
+	daemonStatusDebounce = 100 * time.Millisecond
+)
+
+// daemonStatusFiles returns the files changing with the status of the system,
+// in the form accepted by watchFiles.
+func daemonStatusFiles() map[string]string {
+	files := make(map[string]string)
+	for _, file := range []string{consumerCertFile, insightsRegisteredFile, insightsUnregisteredFile, insightsMachineIDFile} {
+		files[file] = "status"
+	}
+	return files
+}
+
+// daemonResponse is the answer of the daemon to a query.
+type daemonResponse struct {
+	// Error is set, when the daemon cannot answer the query.
+	Error string `json:"error,omitempty"`
+	// Updated is the time the answer was last changed.
+	Updated        time.Time       `json:"updated"`
+	Status         *SystemStatus   `json:"status,omitempty"`
+	CanonicalFacts *CanonicalFacts `json:"canonical_facts,omitempty"`
+}
+
+// daemon holds the snapshot of the status and canonical facts of the system.
+// The answers are encoded, when the snapshot changes, so a query is answered
+// by writing prepared bytes.
+type daemon struct {
+	// ctx holds the connections shared by all status probes.
+	ctx context.Context
+	// refreshTimeout is the timeout of every status probe.
+	refreshTimeout time.Duration
+
+	// statusMu serializes changes of the status.
+	statusMu  sync.Mutex
+	status    *SystemStatus
+	statusErr error
+
+	// mu guards the answers. They are nil until the first snapshot is taken.
+	mu           sync.RWMutex
+	statusAnswer []byte
+	factsAnswer  []byte
+}
+
+// newDaemon creates a daemon without any snapshot. Queries are answered by
+// errDaemonNotReady until the first snapshot is taken. The status probes run
+// with ctx.
+func newDaemon(ctx context.Context) *daemon {
+	return &daemon{
+		ctx:            ctx,
+		refreshTimeout: statusProbeTimeout,
+	}
+}
+
+// encodeAnswer returns the response as a line of JSON.
+func encodeAnswer(response daemonResponse) []byte {
+	data, err := json.Marshal(response)
+	if err != nil {
+		data, _ = json.Marshal(daemonResponse{Error: err.Error()})
+	}
+	return append(data, '\n')
+}
+
+// setStatus replaces the snapshot of the status. The caller has to hold
+// statusMu. A status with failed probes is not served, and the commands
+// check the status themselves instead.
+func (d *daemon) setStatus(status *SystemStatus, probeErr error) {
+	d.status = status
+	d.statusErr = probeErr
+	response := daemonResponse{Updated: time.Now()}
+	if probeErr != nil {
+		response.Error = probeErr.Error()
+	} else {
+		response.Status = status
+	}
+	answer := encodeAnswer(response)
+
+	d.mu.Lock()
+	defer d.mu.Unlock()
+	d.statusAnswer = answer
+}
+
+// setFacts replaces the snapshot of canonical facts. When facts is nil, the
+// snapshot is dropped, and the commands collect the facts themselves until
+// the next snapshot.
+func (d *daemon) setFacts(facts *CanonicalFacts) {
+	var answer []byte
+	if facts != nil {
+		snapshot := *facts
+		answer = encodeAnswer(daemonResponse{Updated: time.Now(), CanonicalFacts: &snapshot})
+	}
+
+	d.mu.Lock()
+	defer d.mu.Unlock()
+	d.factsAnswer = answer
+}
+
+// refreshStatus runs all status probes and replaces the snapshot of the
+// status.
+func (d *daemon) refreshStatus() {
+	d.statusMu.Lock()
+	defer d.statusMu.Unlock()
+
+	// The registration could have changed since the UUID was received.
+	rhsm.forgetConsumerUUID()
+	// Spans are recorded by a throwaway recorder, the daemon runs for a long
+	// time and it never writes a trace.
+	ctx, span := trace.NewRecorder().Start(d.ctx, "status")
+	var status SystemStatus
+	probes := statusProbes()
+	results := runStatusProbes(ctx, probes, d.refreshTimeout, &status)
+	span.End()
+
+	status.ProbeDurations = make(map[string]int64, len(probes))
+	var probeErr error
+	for i, probe := range probes {
+		status.ProbeDurations[probe.name] = results[i].duration.Milliseconds()
+		if results[i].err != nil {
+			log.Errorf("cannot check status of %v: %v", probe.name, results[i].err)
+			if probeErr == nil {
+				probeErr = results[i].err
+			}
+		}
+	}
+	d.setStatus(&status, probeErr)
+}
+
+// refreshFacts collects all canonical facts and replaces the snapshot. The
+// snapshot is dropped, when collecting fails.
+func (d *daemon) refreshFacts() {
+	ctx, span := trace.NewRecorder().Start(d.ctx, "collect")
+	var facts CanonicalFacts
+	err := collectCanonicalFacts(ctx, &facts, nil)
+	span.End()
+	if err != nil {
+		log.Errorf("cannot collect canonical facts: %v", err)
+		return
+	}
+	d.setFacts(&facts)
+}
+
+// setServiceState updates the snapshot with the state of the yggdrasil (rhcd)
+// service received in a D-Bus signal.
+func (d *daemon) setServiceState(state string) {
+	d.statusMu.Lock()
+	defer d.statusMu.Unlock()
+	if d.status == nil {
+		return
+	}
+	status := *d.status
+	status.YggdrasilRunning = state == "active"
+	d.setStatus(&status, d.statusErr)
+}
+
+// runStatusUpdates checks the status for the first time, and then again
+// whenever the files reflecting the status change and no further change is
+// received for the debounce time, and every interval. States of the service
+// received on serviceStates are applied right away. It returns when the stop
+// channel is closed.
+func (d *daemon) runStatusUpdates(events <-chan string, serviceStates <-chan string, debounce, interval time.Duration, stop <-chan struct{}) {
+	d.refreshStatus()
+
+	timer := time.NewTimer(debounce)
+	if !timer.Stop() {
+		<-timer.C
+	}
+	armed := false
+	ticker := time.NewTicker(interval)
+	defer ticker.Stop()
+
+	for {
+		select {
+		case <-stop:
+			timer.Stop()
+			return
+		case <-events:
+			if armed && !timer.Stop() {
+				<-timer.C
+			}
+			timer.Reset(debounce)
+			armed = true
+		case state := <-serviceStates:
+			log.Debugf("%v service is %v", ServiceName, state)
+			d.setServiceState(state)
+		case <-timer.C:
+			armed = false
+			d.refreshStatus()
+		case <-ticker.C:
+			d.refreshStatus()
+		}
+	}
+}
+
+// answer returns the answer to the query. Refresh runs all status probes and
+// collects the canonical facts, so it is answered only, when the query was
+// sent by root.
+func (d *daemon) answer(query string, root bool) []byte {
+	switch query {
+	case daemonQueryStatus, daemonQueryCanonicalFacts:
+	case daemonQueryRefresh:
+		if !root {
+			return encodeAnswer(daemonResponse{Error: "refresh is allowed only for root"})
+		}
+		// The snapshot is not served, until it is taken again. The command
+		// sending refresh does not wait for the answer.
+		d.mu.Lock()
+		d.statusAnswer, d.factsAnswer = nil, nil
+		d.mu.Unlock()
+		d.refreshFacts()
+		d.refreshStatus()
+	default:
+		return encodeAnswer(daemonResponse{Error: fmt.Sprintf("unknown query: %q", query)})
+	}
+
+	d.mu.RLock()
+	answer := d.statusAnswer
+	if query == daemonQueryCanonicalFacts {
+		answer = d.factsAnswer
+	}
+	d.mu.RUnlock()
+	if answer == nil {
+		return encodeAnswer(daemonResponse{Error: errDaemonNotReady.Error()})
+	}
+	return answer
+}
+
+// peerUID returns the user ID of the process connected to the Unix socket.
+func peerUID(conn net.Conn) (uint32, error) {
+	unixConn, ok := conn.(*net.UnixConn)
+	if !ok {
+		return 0, fmt.Errorf("not a Unix socket connection: %v", conn.LocalAddr())
+	}
+	rawConn, err := unixConn.SyscallConn()
+	if err != nil {
+		return 0, err
+	}
+	var cred *unix.Ucred
+	var credErr error
+	err = rawConn.Control(func(fd uintptr) {
+		cred, credErr = unix.GetsockoptUcred(int(fd), unix.SOL_SOCKET, unix.SO_PEERCRED)
+	})
+	if err != nil {
+		return 0, err
+	}
+	if credErr != nil {
+		return 0, credErr
+	}
+	return cred.Uid, nil
+}
+
+// handle answers queries received on the connection, until it is closed or
+// idle for too long.
+func (d *daemon) handle(conn net.Conn) {
+	defer conn.Close()
+	uid, err := peerUID(conn)
+	if err != nil {
+		log.Debugf("cannot get credentials of peer: %v", err)
+	}
+	root := err == nil && uid == 0
+	scanner := bufio.NewScanner(conn)
+	for {
+		_ = conn.SetReadDeadline(time.Now().Add(daemonIdleTimeout))
+		if !scanner.Scan() {
+			return
+		}
+		if _, err := conn.Write(d.answer(scanner.Text(), root)); err != nil {
+			log.Debugf("cannot answer query: %v", err)
+			return
+		}
+	}
+}
+
+// serve accepts connections until the listener is closed.
+func (d *daemon) serve(listener net.Listener) error {
+	for {
+		conn, err := listener.Accept()
+		if err != nil {
+			if errors.Is(err, net.ErrClosed) {
+				return nil
+			}
+			return err
+		}
+		go d.handle(conn)
+	}
+}
+
+// daemonListener returns the socket passed by systemd, when the daemon is
+// socket-activated. Otherwise, it creates the socket.
+func daemonListener() (net.Listener, error) {
+	listeners, err := activation.Listeners()
+	if err != nil {
+		return nil, fmt.Errorf("cannot use sockets passed by systemd: %w", err)
+	}
+	if len(listeners) > 0 && listeners[0] != nil {
+		log.Debug("using socket passed by systemd")
+		return listeners[0], nil
+	}
+
+	if err := os.MkdirAll(filepath.Dir(daemonSocketPath), 0755); err != nil {
+		return nil, fmt.Errorf("cannot create socket directory: %w", err)
+	}
+	if err := os.Remove(daemonSocketPath); err != nil && !errors.Is(err, os.ErrNotExist) {
+		return nil, fmt.Errorf("cannot remove stale socket: %w", err)
+	}
+	listener, err := net.Listen("unix", daemonSocketPath)
+	if err != nil {
+		return nil, fmt.Errorf("cannot listen on %v: %w", daemonSocketPath, err)
+	}
+	// Only the status and facts are provided to any user, which they can get
+	// using rhc commands too. Refresh is answered only for root.
+	if err := os.Chmod(daemonSocketPath, 0666); err != nil {
+		_ = listener.Close()
+		return nil, fmt.Errorf("cannot set permissions of %v: %w", daemonSocketPath, err)
+	}
+	return listener, nil
+}
+
+// serveAction keeps running until it is terminated, and it answers queries of
+// the status and canonical facts of the system on the daemon socket. The
+// connections to D-Bus are kept open, and the answers are updated, when
+// systemd signals a change of the service state, when the files reflecting the
+// status or facts change, and every refresh interval.
+func serveAction(ctx *cli.Context) error {
+	listener, err := daemonListener()
+	if err != nil {
+		return cli.Exit(err, 1)
+	}
+	d := newDaemon(ctx.Context)
+
+	statusEvents := make(chan string, 64)
+	if err := watchFiles(daemonStatusFiles(), statusEvents); err != nil {
+		return cli.Exit(err, 1)
+	}
+	factsEvents := make(chan string, 64)
+	if err := watchFactsSources(factsEvents); err != nil {
+		return cli.Exit(err, 1)
+	}
+
+	var serviceStates <-chan string
+	conn, err := getSystemdConn(ctx.Context)
+	if err == nil {
+		var unwatch func()
+		serviceStates, unwatch, err = conn.WatchUnitState(ServiceName + ".service")
+		if err == nil {
+			defer unwatch()
+		}
+	}
+	if err != nil {
+		log.Warnf("cannot watch state of the %v service, it is checked every %v: %v",
+			ServiceName, ctx.Duration("refresh-interval"), err)
+	}
+
+	signals := make(chan os.Signal, 1)
+	signal.Notify(signals, syscall.SIGINT, syscall.SIGTERM)
+	stop := make(chan struct{})
+	var wg sync.WaitGroup
+	wg.Add(2)
+	go func() {
+		defer wg.Done()
+		d.runStatusUpdates(statusEvents, serviceStates, daemonStatusDebounce, ctx.Duration("refresh-interval"), stop)
+	}()
+	go func() {
+		defer wg.Done()
+		runFactsWatch(factsEvents, factsWatchDebounce, stop, d.setFacts)
+	}()
+	go func() {
+		<-signals
+		close(stop)
+		_ = listener.Close()
+	}()
+
+	log.Infof("answering queries on %v", listener.Addr())
+	err = d.serve(listener)
+	wg.Wait()
+	if err != nil {
+		return cli.Exit(fmt.Errorf("cannot accept connection: %w", err), 1)
+	}
+	return nil
+}
+
+// queryDaemon sends the query to the daemon and returns its response. An
+// error is returned, when the daemon is not running or it cannot answer.
+func queryDaemon(ctx context.Context, query string) (*daemonResponse, error) {
+	var response daemonResponse
+	err := trace.Run(ctx, "daemon "+query, func(ctx context.Context) error {
+		dialer := net.Dialer{Timeout: daemonDialTimeout}
+		conn, err := dialer.DialContext(ctx, "unix", daemonSocketPath)
+		if err != nil {
+			return err
+		}
+		defer conn.Close()
+		_ = conn.SetDeadline(time.Now().Add(daemonQueryTimeout))
+		if _, err := conn.Write([]byte(query + "\n")); err != nil {
+			return err
+		}
+		line, err := bufio.NewReader(conn).ReadBytes('\n')
+		if err != nil {
+			return err
+		}
+		if err := json.Unmarshal(line, &response); err != nil {
+			return err
+		}
+		if response.Error != "" {
+			return errors.New(response.Error)
+		}
+		return nil
+	})
+	if err != nil {
+		return nil, err
+	}
+	return &response, nil
+}
+
+// daemonStatus returns the status of the system kept by the daemon, or nil,
+// when the daemon is not running or it does not know the status.
+func daemonStatus(ctx context.Context) *SystemStatus {
+	response, err := queryDaemon(ctx, daemonQueryStatus)
+	if err != nil {
+		log.Debugf("cannot get status from daemon: %v", err)
+		return nil
+	}
+	return response.Status
+}
+
+// daemonCanonicalFacts returns the canonical facts kept by the daemon, or nil,
+// when the daemon is not running or it does not know the facts.
+func daemonCanonicalFacts(ctx context.Context) *CanonicalFacts {
+	response, err := queryDaemon(ctx, daemonQueryCanonicalFacts)
+	if err != nil {
+		log.Debugf("cannot get canonical facts from daemon: %v", err)
+		return nil
+	}
+	return response.CanonicalFacts
+}
+
+// refreshDaemon makes the daemon check the status and collect the canonical
+// facts again, when the daemon is running. It does not wait for the answer.
+// The daemon drops its snapshot, when it receives the query, so the next
+// commands do the work themselves until the new snapshot is taken.
+func refreshDaemon() {
+	conn, err := net.DialTimeout("unix", daemonSocketPath, daemonDialTimeout)
+	if err != nil {
+		log.Debugf("cannot refresh status of daemon: %v", err)
+		return
+	}
+	defer conn.Close()
+	_ = conn.SetWriteDeadline(time.Now().Add(daemonDialTimeout))
+	if _, err := conn.Write([]byte(daemonQueryRefresh + "\n")); err != nil {
+		log.Debugf("cannot refresh status of daemon: %v", err)
+	}
+}
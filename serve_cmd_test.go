@@ -0,0 +1,180 @@
+package main
+
+import (
+	"bufio"
+	"context"
+	"fmt"
+	"net"
+	"os"
+	"path/filepath"
+	"testing"
+	"time"
+
+	"github.com/google/go-cmp/cmp"
+)
+
+// startTestDaemon serves queries of d on a socket in a temporary directory,
+// and points daemonSocketPath to it.
+func startTestDaemon(t testing.TB, d *daemon) {
+	saved := daemonSocketPath
+	daemonSocketPath = filepath.Join(t.TempDir(), "rhc.sock")
+	listener, err := net.Listen("unix", daemonSocketPath)
+	if err != nil {
+		t.Fatal(err)
+	}
+	done := make(chan error)
+	go func() { done <- d.serve(listener) }()
+	t.Cleanup(func() {
+		_ = listener.Close()
+		if err := <-done; err != nil {
+			t.Error(err)
+		}
+		daemonSocketPath = saved
+	})
+}
+
+func TestDaemonQueries(t *testing.T) {
+	d := newDaemon(context.Background())
+	startTestDaemon(t, d)
+
+	// Queries received before the first snapshot are not waiting for it.
+	if _, err := queryDaemon(context.Background(), daemonQueryStatus); err == nil || err.Error() != errDaemonNotReady.Error() {
+		t.Errorf("unexpected error of status query before the first snapshot: %v", err)
+	}
+	if facts := daemonCanonicalFacts(context.Background()); facts != nil {
+		t.Errorf("canonical facts before the first snapshot: %+v", facts)
+	}
+
+	d.setFacts(&CanonicalFacts{MachineID: "machine", IPAddresses: []string{"10.0.0.1"}})
+	facts := daemonCanonicalFacts(context.Background())
+	if diff := cmp.Diff(&CanonicalFacts{MachineID: "machine", IPAddresses: []string{"10.0.0.1"}}, facts); diff != "" {
+		t.Errorf("unexpected canonical facts: %v", diff)
+	}
+	// Dropped facts are not served, the command collects them itself.
+	d.setFacts(nil)
+	if facts := daemonCanonicalFacts(context.Background()); facts != nil {
+		t.Errorf("dropped canonical facts were served: %+v", facts)
+	}
+
+	d.statusMu.Lock()
+	d.setStatus(&SystemStatus{RHSMConnected: true, InsightsConnected: true}, nil)
+	d.statusMu.Unlock()
+	d.setServiceState("active")
+	status := daemonStatus(context.Background())
+	if status == nil || !status.RHSMConnected || !status.InsightsConnected || !status.YggdrasilRunning {
+		t.Errorf("unexpected status: %+v", status)
+	}
+
+	// Status with a failed probe is not used, the command checks the status
+	// itself.
+	d.statusMu.Lock()
+	d.setStatus(&SystemStatus{RHSMConnected: true}, fmt.Errorf("insights probe timed out"))
+	d.statusMu.Unlock()
+	d.setServiceState("inactive")
+	if status := daemonStatus(context.Background()); status != nil {
+		t.Errorf("status with failed probe was used: %+v", status)
+	}
+
+	if _, err := queryDaemon(context.Background(), "shutdown"); err == nil || err.Error() != `unknown query: "shutdown"` {
+		t.Errorf("unexpected error of unknown query: %v", err)
+	}
+}
+
+func TestDaemonRefreshNotRoot(t *testing.T) {
+	d := newDaemon(context.Background())
+	want := `{"error":"refresh is allowed only for root","updated":"0001-01-01T00:00:00Z"}` + "\n"
+	if got := string(d.answer(daemonQueryRefresh, false)); got != want {
+		t.Errorf("unexpected answer of refresh sent by non-root user: %v", got)
+	}
+}
+
+func TestRefreshDaemonNotWaiting(t *testing.T) {
+	saved := daemonSocketPath
+	defer func() { daemonSocketPath = saved }()
+	daemonSocketPath = filepath.Join(t.TempDir(), "rhc.sock")
+	listener, err := net.Listen("unix", daemonSocketPath)
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer listener.Close()
+
+	// The fake daemon reads the query, and it never answers.
+	received := make(chan string, 1)
+	go func() {
+		conn, err := listener.Accept()
+		if err != nil {
+			return
+		}
+		defer conn.Close()
+		line, _ := bufio.NewReader(conn).ReadString('\n')
+		received <- line
+	}()
+
+	start := time.Now()
+	refreshDaemon()
+	if elapsed := time.Since(start); elapsed > time.Second {
+		t.Errorf("refresh waited for the answer for %v", elapsed)
+	}
+	if got := <-received; got != daemonQueryRefresh+"\n" {
+		t.Errorf("got query %q, want %q", got, daemonQueryRefresh+"\n")
+	}
+}
+
+func TestPeerUID(t *testing.T) {
+	d := newDaemon(context.Background())
+	startTestDaemon(t, d)
+	conn, err := net.Dial("unix", daemonSocketPath)
+	if err != nil {
+		t.Fatal(err)
+	}
+	defer conn.Close()
+	uid, err := peerUID(conn)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if uid != uint32(os.Getuid()) {
+		t.Errorf("got uid %v, want %v", uid, os.Getuid())
+	}
+}
+
+func TestDaemonNotRunning(t *testing.T) {
+	saved := daemonSocketPath
+	defer func() { daemonSocketPath = saved }()
+	daemonSocketPath = filepath.Join(t.TempDir(), "rhc.sock")
+
+	start := time.Now()
+	if status := daemonStatus(context.Background()); status != nil {
+		t.Errorf("status without daemon: %+v", status)
+	}
+	if elapsed := time.Since(start); elapsed > daemonDialTimeout {
+		t.Errorf("missing daemon was noticed after %v", elapsed)
+	}
+}
+
+// BenchmarkDaemonQuery measures a status query on a connection kept open, as
+// a monitoring agent polling the daemon would use it.
+func BenchmarkDaemonQuery(b *testing.B) {
+	d := newDaemon(context.Background())
+	d.statusMu.Lock()
+	d.setStatus(&SystemStatus{RHSMConnected: true, InsightsConnected: true, YggdrasilRunning: true}, nil)
+	d.statusMu.Unlock()
+	startTestDaemon(b, d)
+
+	conn, err := net.Dial("unix", daemonSocketPath)
+	if err != nil {
+		b.Fatal(err)
+	}
+	defer conn.Close()
+	buf := make([]byte, 4096)
+	query := []byte(daemonQueryStatus + "\n")
+	b.ReportAllocs()
+	b.ResetTimer()
+	for i := 0; i < b.N; i++ {
+		if _, err := conn.Write(query); err != nil {
+			b.Fatal(err)
+		}
+		if _, err := conn.Read(buf); err != nil {
+			b.Fatal(err)
+		}
+	}
+}
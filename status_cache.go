@@ -0,0 +1,134 @@
+package main
+
+import (
+	"context"
+	"encoding/json"
+	"errors"
+	"fmt"
+	"io/fs"
+	"os"
+	"path/filepath"
+	"strings"
+	"time"
+
+	"github.com/redhatinsights/rhc/internal/trace"
+	"github.com/subpop/go-log"
+)
+
+// statusCacheStateFiles is the list of files reflecting the state of the system
+// connection. When any of these files changes, the cached status is invalid.
+var statusCacheStateFiles = []string{
+	"/etc/pki/consumer/cert.pem",
+	"/etc/insights-client/.registered",
+	"/etc/insights-client/.unregistered",
+}
+
+// statusCache is the on-disk representation of cached status of the system.
+type statusCache struct {
+	// Key identifies the state of the system at the time the status was cached.
+	Key string `json:"key"`
+	// Created is the time, when the status was cached.
+	Created time.Time `json:"created"`
+	// Status is the cached status of the system.
+	Status SystemStatus `json:"status"`
+}
+
+// statusCacheFilePath returns the path of the file with cached status.
+func statusCacheFilePath() string {
+	return filepath.Join("/var/cache", LongName, "status.json")
+}
+
+// statusCacheKey computes a string that changes whenever any of the state files
+// or the active state of the yggdrasil (rhcd) service changes.
+func statusCacheKey(ctx context.Context) (string, error) {
+	var parts []string
+	for _, path := range statusCacheStateFiles {
+		info, err := statFile(ctx, path)
+		if errors.Is(err, fs.ErrNotExist) {
+			parts = append(parts, path+":-")
+			continue
+		}
+		if err != nil {
+			return "", err
+		}
+		parts = append(parts, fmt.Sprintf("%v:%v:%v", path, info.Size(), info.ModTime().UnixNano()))
+	}
+
+	conn, err := getSystemdConn(ctx)
+	if err != nil {
+		return "", err
+	}
+	unitName := ServiceName + ".service"
+	var timestamp interface{}
+	err = systemdCall(ctx, "GetUnitProperty "+unitName+" StateChangeTimestamp", func() (err error) {
+		timestamp, err = conn.GetUnitPropertyContext(ctx, unitName, "StateChangeTimestamp")
+		return err
+	})
+	if err != nil {
+		return "", fmt.Errorf("unable to get property of %s: %s", unitName, err)
+	}
+	parts = append(parts, fmt.Sprintf("%v:%v", unitName, timestamp))
+
+	return strings.Join(parts, "\n"), nil
+}
+
+// readStatusCache returns the cached status, when it was created for the given
+// key and it is not older than maxAge. Otherwise, nil is returned.
+func readStatusCache(ctx context.Context, key string, maxAge time.Duration) *SystemStatus {
+	_, span := trace.Start(ctx, "read "+statusCacheFilePath())
+	data, err := os.ReadFile(statusCacheFilePath())
+	span.SetError(err)
+	span.End()
+	if err != nil {
+		if !errors.Is(err, fs.ErrNotExist) {
+			log.Debugf("cannot read status cache: %v", err)
+		}
+		return nil
+	}
+	var cache statusCache
+	if err := json.Unmarshal(data, &cache); err != nil {
+		log.Debugf("cannot parse status cache: %v", err)
+		return nil
+	}
+	if cache.Key != key {
+		log.Debug("status cache is invalid: state of the system changed")
+		return nil
+	}
+	if time.Since(cache.Created) > maxAge {
+		log.Debugf("status cache is older than %v", maxAge)
+		return nil
+	}
+	return &cache.Status
+}
+
+// writeStatusCache stores the status of the system to the cache file. The file
+// is replaced atomically, so concurrent readers never see partial content.
+func writeStatusCache(ctx context.Context, key string, systemStatus *SystemStatus) error {
+	_, span := trace.Start(ctx, "write "+statusCacheFilePath())
+	defer span.End()
+	data, err := json.Marshal(statusCache{
+		Key:     key,
+		Created: time.Now(),
+		Status:  *systemStatus,
+	})
+	if err != nil {
+		return err
+	}
+	if err := os.MkdirAll(filepath.Dir(statusCacheFilePath()), 0755); err != nil {
+		span.SetError(err)
+		return fmt.Errorf("cannot create cache directory: %w", err)
+	}
+	err = writeFileAtomically(statusCacheFilePath(), data, 0644)
+	span.SetError(err)
+	return err
+}
+
+// invalidateStatusCache removes cached status of the system, and it makes the
+// daemon refresh its status, when the daemon is running. It is called, when the
+// connection of the system was changed by rhc.
+func invalidateStatusCache() {
+	if err := os.Remove(statusCacheFilePath()); err != nil && !errors.Is(err, fs.ErrNotExist) {
+		log.Debugf("cannot remove status cache: %v", err)
+	}
+	refreshDaemon()
+}
@@ -3,125 +3,180 @@ package main
 import (
 	"context"
 	"encoding/json"
+	"errors"
 	"fmt"
 	"github.com/urfave/cli/v2"
 	"os"
+	"sync"
 	"time"
 
 	"github.com/briandowns/spinner"
-	systemd "github.com/coreos/go-systemd/v22/dbus"
+	"github.com/redhatinsights/rhc/internal/trace"
+	"github.com/subpop/go-log"
 )
 
-// rhsmStatus tries to print status provided by RHSM D-Bus API. If we provide
-// output in machine-readable format, then we only set files in SystemStatus
-// structure and content of this structure will be printed later
-func rhsmStatus(systemStatus *SystemStatus) error {
+// statusProbeTimeout is the longest time a single status probe is allowed to
+// run before it is canceled and reported as failed.
+const statusProbeTimeout = 30 * time.Second
 
-	uuid, err := getConsumerUUID()
-	if err != nil {
-		return fmt.Errorf("unable to get consumer UUID: %s", err)
+// statusProbe is a single check of the status command. All probes are run
+// concurrently, and every probe writes only its own fields of SystemStatus.
+type statusProbe struct {
+	name string
+	run  func(ctx context.Context, systemStatus *SystemStatus) error
+}
+
+// statusProbeResult holds the outcome of one statusProbe.
+type statusProbeResult struct {
+	err      error
+	duration time.Duration
+}
+
+// runStatusProbes starts all probes at once, each with its own timeout and span,
+// and waits until all of them finish. Results are returned in the same order as
+// the probes.
+func runStatusProbes(ctx context.Context, probes []statusProbe, timeout time.Duration, systemStatus *SystemStatus) []statusProbeResult {
+	results := make([]statusProbeResult, len(probes))
+	var wg sync.WaitGroup
+	for i, probe := range probes {
+		wg.Add(1)
+		go func(i int, probe statusProbe) {
+			defer wg.Done()
+			probeCtx, span := trace.Start(ctx, probe.name)
+			defer span.End()
+			probeCtx, cancel := context.WithTimeout(probeCtx, timeout)
+			defer cancel()
+			start := time.Now()
+			err := probe.run(probeCtx, systemStatus)
+			if err != nil && errors.Is(probeCtx.Err(), context.DeadlineExceeded) {
+				err = fmt.Errorf("%v probe timed out after %v", probe.name, timeout)
+			}
+			span.SetError(err)
+			results[i] = statusProbeResult{err: err, duration: time.Since(start)}
+		}(i, probe)
 	}
-	if uuid == "" {
-		systemStatus.returnCode += 1
-		if uiSettings.isMachineReadable {
-			systemStatus.RHSMConnected = false
-		} else {
-			fmt.Printf("%v Not connected to Red Hat Subscription Management\n", uiSettings.iconInfo)
-		}
-	} else {
-		if uiSettings.isMachineReadable {
-			systemStatus.RHSMConnected = true
-		} else {
-			fmt.Printf("%v Connected to Red Hat Subscription Management\n", uiSettings.iconOK)
-		}
+	wg.Wait()
+	return results
+}
+
+// statusProbes returns the probes of the status of RHSM, insights-client and
+// yggdrasil (rhcd) service, in this order.
+func statusProbes() []statusProbe {
+	return []statusProbe{
+		{name: "rhsm", run: rhsmStatus},
+		{name: "insights", run: insightStatus},
+		{name: ServiceName, run: serviceStatus},
 	}
-	return nil
 }
 
-// insightStatus tries to print status of insights client
-func insightStatus(systemStatus *SystemStatus) {
-	var s *spinner.Spinner
-	if uiSettings.isRich {
-		s = spinner.New(spinner.CharSets[9], 100*time.Millisecond)
-		s.Suffix = " Checking Red Hat Insights..."
-		s.Start()
+// hasProbeErrors returns true, when any of the probes failed.
+func hasProbeErrors(results []statusProbeResult) bool {
+	for _, result := range results {
+		if result.err != nil {
+			return true
+		}
 	}
-	isRegistered, err := insightsIsRegistered()
-	if uiSettings.isRich {
-		s.Stop()
+	return false
+}
+
+// rhsmStatus tries to get status provided by RHSM D-Bus API and stores it in
+// SystemStatus structure.
+func rhsmStatus(ctx context.Context, systemStatus *SystemStatus) error {
+	uuid, err := getConsumerUUID(ctx)
+	if err != nil {
+		return fmt.Errorf("unable to get consumer UUID: %s", err)
 	}
+	systemStatus.RHSMConnected = uuid != ""
+	return nil
+}
+
+// insightStatus tries to get status of insights client and stores it in
+// SystemStatus structure. Returned error is not fatal for the status command.
+func insightStatus(ctx context.Context, systemStatus *SystemStatus) error {
+	isRegistered, err := insightsIsRegistered(ctx)
+	systemStatus.InsightsConnected = isRegistered
 	if isRegistered {
-		if uiSettings.isMachineReadable {
-			systemStatus.InsightsConnected = true
-		} else {
-			fmt.Print(uiSettings.iconOK + " Connected to Red Hat Insights\n")
-		}
-	} else {
-		systemStatus.returnCode += 1
-		if err == nil {
-			if uiSettings.isMachineReadable {
-				systemStatus.InsightsConnected = false
-			} else {
-				fmt.Print(uiSettings.iconInfo + " Not connected to Red Hat Insights\n")
-			}
-		} else {
-			if uiSettings.isMachineReadable {
-				systemStatus.InsightsConnected = false
-				systemStatus.InsightsError = err.Error()
-			} else {
-				fmt.Printf(uiSettings.iconError+" Cannot detect Red Hat Insights status: %v\n", err)
-			}
-		}
+		return nil
 	}
+	return err
 }
 
-// serviceStatus tries to print status of yggdrasil.service or rhcd.service
-func serviceStatus(systemStatus *SystemStatus) error {
-	ctx := context.Background()
-	conn, err := systemd.NewSystemConnectionContext(ctx)
+// serviceStatus tries to get status of yggdrasil.service or rhcd.service and
+// stores it in SystemStatus structure
+func serviceStatus(ctx context.Context, systemStatus *SystemStatus) error {
+	conn, err := getSystemdConn(ctx)
 	if err != nil {
 		systemStatus.YggdrasilRunning = false
 		systemStatus.YggdrasilError = err.Error()
-		return fmt.Errorf("unable to connect to systemd: %s", err)
+		return err
 	}
-	defer conn.Close()
 	unitName := ServiceName + ".service"
-	properties, err := conn.GetUnitPropertiesContext(ctx, unitName)
+	var activeState string
+	err = systemdCall(ctx, "GetUnitState "+unitName, func() (err error) {
+		activeState, err = conn.GetUnitStateContext(ctx, unitName)
+		return err
+	})
 	if err != nil {
 		systemStatus.YggdrasilRunning = false
 		systemStatus.YggdrasilError = err.Error()
 		return fmt.Errorf("unable to get properties of %s: %s", unitName, err)
 	}
-	activeState := properties["ActiveState"]
-	if activeState.(string) == "active" {
-		if uiSettings.isMachineReadable {
-			systemStatus.YggdrasilRunning = true
-		} else {
-			fmt.Printf(uiSettings.iconOK+" The %v service is active\n", ServiceName)
-		}
+	systemStatus.YggdrasilRunning = activeState == "active"
+	return nil
+}
+
+// printRHSMStatus prints status of RHSM stored in SystemStatus structure, when
+// human-readable output is used
+func printRHSMStatus(systemStatus *SystemStatus) {
+	if systemStatus.RHSMConnected {
+		interactivePrintf("%v Connected to Red Hat Subscription Management\n", uiSettings.iconOK)
 	} else {
 		systemStatus.returnCode += 1
-		if uiSettings.isMachineReadable {
-			systemStatus.YggdrasilRunning = false
-		} else {
-			fmt.Printf(uiSettings.iconInfo+" The %v service is inactive\n", ServiceName)
-		}
+		interactivePrintf("%v Not connected to Red Hat Subscription Management\n", uiSettings.iconInfo)
+	}
+}
+
+// printInsightsStatus prints status of insights-client stored in SystemStatus
+// structure, when human-readable output is used
+func printInsightsStatus(systemStatus *SystemStatus) {
+	if systemStatus.InsightsConnected {
+		interactivePrintf(uiSettings.iconOK + " Connected to Red Hat Insights\n")
+		return
+	}
+	systemStatus.returnCode += 1
+	if systemStatus.InsightsError == "" {
+		interactivePrintf(uiSettings.iconInfo + " Not connected to Red Hat Insights\n")
+	} else {
+		interactivePrintf(uiSettings.iconError+" Cannot detect Red Hat Insights status: %v\n",
+			systemStatus.InsightsError)
+	}
+}
+
+// printServiceStatus prints status of yggdrasil (rhcd) service stored in
+// SystemStatus structure, when human-readable output is used
+func printServiceStatus(systemStatus *SystemStatus) {
+	if systemStatus.YggdrasilRunning {
+		interactivePrintf(uiSettings.iconOK+" The %v service is active\n", ServiceName)
+	} else {
+		systemStatus.returnCode += 1
+		interactivePrintf(uiSettings.iconInfo+" The %v service is inactive\n", ServiceName)
 	}
-	return nil
 }
 
 // SystemStatus is structure holding information about system status
 // When more file format is supported, then add more tags for fields
 // like xml:"hostname"
 type SystemStatus struct {
-	SystemHostname    string `json:"hostname"`
-	HostnameError     string `json:"hostname_error,omitempty"`
-	RHSMConnected     bool   `json:"rhsm_connected"`
-	RHSMError         string `json:"rhsm_error,omitempty"`
-	InsightsConnected bool   `json:"insights_connected"`
-	InsightsError     string `json:"insights_error,omitempty"`
-	YggdrasilRunning  bool   `json:"yggdrasil_running"`
-	YggdrasilError    string `json:"yggdrasil_error,omitempty"`
+	SystemHostname    string           `json:"hostname"`
+	HostnameError     string           `json:"hostname_error,omitempty"`
+	RHSMConnected     bool             `json:"rhsm_connected"`
+	RHSMError         string           `json:"rhsm_error,omitempty"`
+	InsightsConnected bool             `json:"insights_connected"`
+	InsightsError     string           `json:"insights_error,omitempty"`
+	YggdrasilRunning  bool             `json:"yggdrasil_running"`
+	YggdrasilError    string           `json:"yggdrasil_error,omitempty"`
+	ProbeDurations    map[string]int64 `json:"probe_durations_ms"`
+	Timings           []trace.Timing   `json:"timings,omitempty"`
 	returnCode        int
 }
 
@@ -138,10 +193,11 @@ func printJSONStatus(systemStatus *SystemStatus) error {
 
 // beforeStatusAction ensures the user has supplied a correct `--format` flag.
 func beforeStatusAction(ctx *cli.Context) error {
-	err := setupFormatOption(ctx)
+	err := setupFormatOption(ctx, "json")
 	if err != nil {
 		return err
 	}
+	insightsStatusFromClient = ctx.Bool("insights-client-status")
 
 	return checkForUnknownArgs(ctx)
 }
@@ -154,6 +210,8 @@ func beforeStatusAction(ctx *cli.Context) error {
 // Status can be printed as human-readable text or machine-readable JSON document.
 // Format is influenced by --format json CLI option stored in CLI context
 func statusAction(ctx *cli.Context) (err error) {
+	spanCtx, endTrace := startCommandTrace(ctx)
+	defer endTrace()
 	var systemStatus SystemStatus
 	var machineReadablePrintFunc func(systemStatus *SystemStatus) error
 
@@ -169,6 +227,7 @@ func statusAction(ctx *cli.Context) (err error) {
 	// at the end of this function
 	if uiSettings.isMachineReadable {
 		defer func(systemStatus *SystemStatus) {
+			systemStatus.Timings = trace.Timings()
 			err = machineReadablePrintFunc(systemStatus)
 			// When it was not possible to print status to machine-readable format, then
 			// change returned error to CLI exit error to be able to set exit code to
@@ -200,20 +259,71 @@ func statusAction(ctx *cli.Context) (err error) {
 		fmt.Printf("Connection status for %v:\n\n", hostname)
 	}
 
-	/* 1. Get Status of RHSM */
-	err = rhsmStatus(&systemStatus)
-	if err != nil {
-		return cli.Exit(err, 1)
+	/* Get status of RHSM, insights-client and yggdrasil (rhcd) service at once */
+	probes := statusProbes()
+	/* Use the status kept up to date by the daemon, when it is running, or
+	   cached status, when state of the system has not changed since it was cached */
+	var cacheKey string
+	var cached *SystemStatus
+	if !ctx.Bool("no-cache") {
+		if !insightsStatusFromClient {
+			cached = daemonStatus(spanCtx)
+		}
+		if cached == nil {
+			cacheKey, err = statusCacheKey(spanCtx)
+			if err != nil {
+				log.Debugf("cannot compute status cache key: %v", err)
+			} else {
+				cached = readStatusCache(spanCtx, cacheKey, ctx.Duration("max-age"))
+			}
+		}
 	}
 
-	/* 2. Get status of insights-client */
-	insightStatus(&systemStatus)
+	results := make([]statusProbeResult, len(probes))
+	systemStatus.ProbeDurations = make(map[string]int64, len(probes))
+	if cached != nil {
+		log.Debug("using cached status")
+		systemStatus.RHSMConnected = cached.RHSMConnected
+		systemStatus.InsightsConnected = cached.InsightsConnected
+		systemStatus.YggdrasilRunning = cached.YggdrasilRunning
+	} else {
+		var s *spinner.Spinner
+		if uiSettings.isRich {
+			s = spinner.New(spinner.CharSets[9], 100*time.Millisecond)
+			s.Suffix = " Checking connection status..."
+			s.Start()
+		}
+		results = runStatusProbes(spanCtx, probes, statusProbeTimeout, &systemStatus)
+		if uiSettings.isRich {
+			s.Stop()
+		}
+		for i, probe := range probes {
+			systemStatus.ProbeDurations[probe.name] = results[i].duration.Milliseconds()
+		}
+		if cacheKey != "" && !hasProbeErrors(results) {
+			if err := writeStatusCache(spanCtx, cacheKey, &systemStatus); err != nil {
+				log.Debugf("cannot write status cache: %v", err)
+			}
+		}
+	}
 
-	/* 3. Get status of yggdrasil (rhcd) service */
-	err = serviceStatus(&systemStatus)
-	if err != nil {
-		return cli.Exit(err, 1)
+	/* 1. Print status of RHSM */
+	if results[0].err != nil {
+		return cli.Exit(results[0].err, 1)
+	}
+	printRHSMStatus(&systemStatus)
+
+	/* 2. Print status of insights-client */
+	if results[1].err != nil {
+		systemStatus.InsightsError = results[1].err.Error()
+	}
+	printInsightsStatus(&systemStatus)
+
+	/* 3. Print status of yggdrasil (rhcd) service */
+	if results[2].err != nil {
+		return cli.Exit(results[2].err, 1)
 	}
+	printServiceStatus(&systemStatus)
 
 	if !uiSettings.isMachineReadable {
 		fmt.Printf("\nManage your connected systems: https://red.ht/connector\n")
@@ -0,0 +1,57 @@
+package main
+
+import (
+	"context"
+	"fmt"
+	"testing"
+	"time"
+)
+
+func TestRunStatusProbes(t *testing.T) {
+	probes := []statusProbe{
+		{
+			name: "fast",
+			run: func(ctx context.Context, systemStatus *SystemStatus) error {
+				systemStatus.RHSMConnected = true
+				return nil
+			},
+		},
+		{
+			name: "failing",
+			run: func(ctx context.Context, systemStatus *SystemStatus) error {
+				return fmt.Errorf("failed")
+			},
+		},
+		{
+			name: "hanging",
+			run: func(ctx context.Context, systemStatus *SystemStatus) error {
+				<-ctx.Done()
+				return ctx.Err()
+			},
+		},
+	}
+
+	var systemStatus SystemStatus
+	start := time.Now()
+	results := runStatusProbes(context.Background(), probes, 50*time.Millisecond, &systemStatus)
+	if elapsed := time.Since(start); elapsed > 5*time.Second {
+		t.Fatalf("probes were not canceled after timeout: %v", elapsed)
+	}
+
+	if len(results) != len(probes) {
+		t.Fatalf("got %v results, want %v", len(results), len(probes))
+	}
+	if !systemStatus.RHSMConnected {
+		t.Errorf("fast probe did not update system status")
+	}
+	if results[0].err != nil {
+		t.Errorf("unexpected error: %v", results[0].err)
+	}
+	if results[1].err == nil || results[1].err.Error() != "failed" {
+		t.Errorf("got error %v, want 'failed'", results[1].err)
+	}
+	want := "hanging probe timed out after 50ms"
+	if results[2].err == nil || results[2].err.Error() != want {
+		t.Errorf("got error %v, want '%v'", results[2].err, want)
+	}
+}
@@ -1,12 +1,15 @@
 package main
 
 import (
+	"context"
 	"fmt"
 	"io"
 	"os"
 	"path/filepath"
 	"strings"
+	"syscall"
 
+	"github.com/redhatinsights/rhc/internal/trace"
 	"github.com/subpop/go-log"
 
 	"github.com/urfave/cli/v2"
@@ -57,6 +60,49 @@ func BashComplete(c *cli.Context) {
 	}
 }
 
+// writeFileAtomically writes data to a temporary file in the directory of
+// filename and then renames it to filename, so readers never see partial
+// content. When filename already exists, the new file keeps its permissions
+// and owner. Otherwise, perm is used.
+func writeFileAtomically(filename string, data []byte, perm os.FileMode) error {
+	uid, gid := -1, -1
+	if info, err := os.Stat(filename); err == nil {
+		perm = info.Mode().Perm()
+		if stat, ok := info.Sys().(*syscall.Stat_t); ok {
+			uid, gid = int(stat.Uid), int(stat.Gid)
+		}
+	}
+
+	f, err := os.CreateTemp(filepath.Dir(filename), "."+filepath.Base(filename)+"-*")
+	if err != nil {
+		return fmt.Errorf("cannot create temporary file: %w", err)
+	}
+	defer os.Remove(f.Name())
+
+	if _, err := f.Write(data); err != nil {
+		f.Close()
+		return fmt.Errorf("cannot write temporary file: %w", err)
+	}
+	if err := f.Chmod(perm); err != nil {
+		f.Close()
+		return fmt.Errorf("cannot set permissions of temporary file: %w", err)
+	}
+	if uid != -1 {
+		if err := f.Chown(uid, gid); err != nil {
+			f.Close()
+			return fmt.Errorf("cannot set owner of temporary file: %w", err)
+		}
+	}
+	if err := f.Sync(); err != nil {
+		f.Close()
+		return fmt.Errorf("cannot write temporary file: %w", err)
+	}
+	if err := f.Close(); err != nil {
+		return fmt.Errorf("cannot write temporary file: %w", err)
+	}
+	return os.Rename(f.Name(), filename)
+}
+
 func ConfigPath() (string, error) {
 	// default config file path in `/etc/rhc/config.toml`
 	filePath := filepath.Join("/etc", LongName, "config.toml")
@@ -97,25 +143,64 @@ func checkForUnknownArgs(ctx *cli.Context) error {
 	return nil
 }
 
-// setupFormatOption ensures the user has supplied a correct `--format` flag
-// and set values in uiSettings, when JSON format is used.
-func setupFormatOption(ctx *cli.Context) error {
+// setupFormatOption ensures the user has supplied a `--format` flag supported
+// by the command and set values in uiSettings, when a machine-readable format
+// is used.
+func setupFormatOption(ctx *cli.Context, supportedFormats ...string) error {
 	// This is run after the `app.Before()` has been run,
 	// the uiSettings is already set up for us to modify.
 	format := ctx.String("format")
-	switch format {
-	case "":
+	if format == "" {
 		return nil
-	case "json":
+	}
+	for _, supported := range supportedFormats {
+		if format != supported {
+			continue
+		}
 		uiSettings.isMachineReadable = true
 		uiSettings.isRich = false
+		uiSettings.streamEvents = format == "ndjson"
 		return nil
-	default:
-		err := fmt.Errorf(
-			"unsupported format: %s (supported formats: %s)",
-			format,
-			`"json"`,
-		)
-		return cli.Exit(err, 1)
+	}
+	quoted := make([]string, len(supportedFormats))
+	for i, supported := range supportedFormats {
+		quoted[i] = `"` + supported + `"`
+	}
+	err := fmt.Errorf(
+		"unsupported format: %s (supported formats: %s)",
+		format,
+		strings.Join(quoted, ", "),
+	)
+	return cli.Exit(err, 1)
+}
+
+// withCommandTimeout returns a context, which is canceled, when the time given
+// by the --timeout option of the command elapses. The context has no deadline,
+// when the option is not used.
+func withCommandTimeout(ctx *cli.Context, parent context.Context) (context.Context, context.CancelFunc) {
+	if timeout := ctx.Duration("timeout"); timeout > 0 {
+		return context.WithTimeout(parent, timeout)
+	}
+	return context.WithCancel(parent)
+}
+
+// startCommandTrace starts the root span of the command. The context of the
+// span has the deadline given by --timeout. The returned function ends the
+// span and, when --trace is used, writes all recorded spans to the file. It
+// has to be called before the action returns, because exit errors terminate
+// rhc before any After hook runs.
+func startCommandTrace(ctx *cli.Context) (context.Context, func()) {
+	timeoutCtx, cancel := withCommandTimeout(ctx, ctx.Context)
+	spanCtx, span := trace.Start(timeoutCtx, ctx.Command.Name)
+	return spanCtx, func() {
+		cancel()
+		span.End()
+		filename := ctx.String("trace")
+		if filename == "" {
+			return
+		}
+		if err := trace.DefaultRecorder.WriteFile(filename, ctx.String("trace-format")); err != nil {
+			log.Errorf("cannot write trace: %v", err)
+		}
 	}
 }